@@ -0,0 +1,241 @@
+"""
+Which snippets each user can see, kept in memory as compressed bitmaps.
+
+Snippet IDs are stored like a Roaring bitmap: split by their high 16 bits into
+chunks of up to 65536 IDs, each kept as a sorted array while it is sparse and as
+a bitset once it is dense. Membership is a dictionary lookup and a binary search
+or bit test, and intersecting two bitmaps only visits the chunks they share.
+"""
+
+import array
+import bisect
+import threading
+
+# Most IDs a chunk keeps as a sorted array, beyond which a bitset is smaller
+ARRAY_MAX = 4096
+
+
+def _bits(bitset):
+    """Yields the positions of the set bits in an int, lowest first."""
+    while bitset:
+        low = bitset & -bitset
+        yield low.bit_length() - 1
+        bitset ^= low
+
+
+def _compact(chunk):
+    """Returns a chunk in its smaller form, or None if it is empty."""
+    if isinstance(chunk, int):
+        count = chunk.bit_count()
+        if count > ARRAY_MAX:
+            return chunk
+        return array.array("H", _bits(chunk)) if count else None
+    if len(chunk) > ARRAY_MAX:
+        bitset = 0
+        for low in chunk:
+            bitset |= 1 << low
+        return bitset
+    return chunk if chunk else None
+
+
+def _and(a, b):
+    if isinstance(a, int) and isinstance(b, int):
+        return _compact(a & b)
+    if isinstance(a, int):
+        a, b = b, a
+    if isinstance(b, int):
+        return _compact(array.array("H", (low for low in a if b >> low & 1)))
+    if len(a) > len(b):
+        a, b = b, a
+    found = array.array("H")
+    for low in a:
+        index = bisect.bisect_left(b, low)
+        if index < len(b) and b[index] == low:
+            found.append(low)
+    return _compact(found)
+
+
+def _or(a, b):
+    if isinstance(a, int) or isinstance(b, int):
+        bitset = 0
+        for chunk in (a, b):
+            if isinstance(chunk, int):
+                bitset |= chunk
+            else:
+                for low in chunk:
+                    bitset |= 1 << low
+        return _compact(bitset)
+    return _compact(array.array("H", sorted(set(a) | set(b))))
+
+
+class Bitmap:
+    """A set of non-negative integer IDs, compressed Roaring-style."""
+
+    def __init__(self, ids=()):
+        self._chunks = {}  # High 16 bits -> array of low 16 bits or int bitset
+        for id in ids:
+            self.add(id)
+
+    def __contains__(self, id):
+        chunk = self._chunks.get(id >> 16)
+        if chunk is None:
+            return False
+        low = id & 0xFFFF
+        if isinstance(chunk, int):
+            return bool(chunk >> low & 1)
+        index = bisect.bisect_left(chunk, low)
+        return index < len(chunk) and chunk[index] == low
+
+    def __len__(self):
+        return sum(
+            chunk.bit_count() if isinstance(chunk, int) else len(chunk)
+            for chunk in self._chunks.values()
+        )
+
+    def __iter__(self):
+        for high in sorted(self._chunks):
+            chunk = self._chunks[high]
+            lows = _bits(chunk) if isinstance(chunk, int) else chunk
+            for low in lows:
+                yield high << 16 | low
+
+    def __and__(self, other):
+        result = Bitmap()
+        if len(other._chunks) < len(self._chunks):
+            self, other = other, self
+        for high, chunk in self._chunks.items():
+            if high in other._chunks:
+                found = _and(chunk, other._chunks[high])
+                if found is not None:
+                    result._chunks[high] = found
+        return result
+
+    def __or__(self, other):
+        result = Bitmap()
+        result._chunks = dict(self._chunks)
+        for high, chunk in other._chunks.items():
+            mine = result._chunks.get(high)
+            result._chunks[high] = chunk if mine is None else _or(mine, chunk)
+        return result
+
+    def add(self, id):
+        high, low = id >> 16, id & 0xFFFF
+        chunk = self._chunks.get(high)
+        if chunk is None:
+            self._chunks[high] = array.array("H", [low])
+        elif isinstance(chunk, int):
+            self._chunks[high] = chunk | 1 << low
+        else:
+            index = bisect.bisect_left(chunk, low)
+            if index == len(chunk) or chunk[index] != low:
+                chunk.insert(index, low)
+                self._chunks[high] = _compact(chunk)
+
+    def discard(self, id):
+        high, low = id >> 16, id & 0xFFFF
+        chunk = self._chunks.get(high)
+        if chunk is None:
+            return
+        if isinstance(chunk, int):
+            chunk &= ~(1 << low)
+        else:
+            index = bisect.bisect_left(chunk, low)
+            if index < len(chunk) and chunk[index] == low:
+                del chunk[index]
+        chunk = _compact(chunk)
+        if chunk is None:
+            del self._chunks[high]
+        else:
+            self._chunks[high] = chunk
+
+
+class AccessIndex:
+    """
+    Which snippets are public, and which each user owns or was given permission
+    to view. Filled from the database by `rebuild`, and kept current by passing
+    `update` the changed snippets. Safe to use from any thread.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.change_id = None  # Last change applied, for the caller's bookkeeping
+        self._clear()
+
+    def _clear(self):
+        self._public = Bitmap()
+        self._owned = {}  # User ID -> Bitmap
+        self._permitted = {}  # User ID -> Bitmap
+        self._snippets = {}  # Snippet ID -> (owner, permitted user IDs)
+
+    def rebuild(self, snippets, permissions):
+        """
+        Replaces everything with `snippets`, `(id, is_public, owner)` rows, and
+        `permissions`, `(snippet_id, user_id)` rows.
+        """
+        with self._lock:
+            self._clear()
+            self._set(snippets, permissions)
+
+    def update(self, snippet_ids, snippets, permissions):
+        """
+        Replaces what's known of the snippets with `snippet_ids` with their rows
+        in `snippets` and `permissions`, like `rebuild`'s. Snippets without a row
+        were deleted.
+        """
+        with self._lock:
+            for id in snippet_ids:
+                owner, permitted = self._snippets.pop(id, (None, ()))
+                self._public.discard(id)
+                for users, user_id in [(self._owned, owner)] + [
+                    (self._permitted, user_id) for user_id in permitted
+                ]:
+                    bitmap = users.get(user_id)
+                    if bitmap is not None:
+                        bitmap.discard(id)
+                        if not len(bitmap):
+                            del users[user_id]
+            self._set(snippets, permissions)
+
+    def _set(self, snippets, permissions):
+        for id, is_public, owner in snippets:
+            self._snippets[id] = (owner, [])
+            if is_public:
+                self._public.add(id)
+            if owner is not None:
+                self._owned.setdefault(owner, Bitmap()).add(id)
+        for id, user_id in permissions:
+            if id in self._snippets:
+                self._snippets[id][1].append(user_id)
+                self._permitted.setdefault(user_id, Bitmap()).add(id)
+
+    def can_view(self, snippet_id, user_id):
+        """Whether a snippet is public, or owned by or shared with a user."""
+        snippet_id = int(snippet_id)
+        with self._lock:
+            if snippet_id in self._public:
+                return True
+            if user_id is None:
+                return False
+            user_id = int(user_id)
+            return any(
+                snippet_id in users.get(user_id, ())
+                for users in (self._owned, self._permitted)
+            )
+
+    def filter(self, snippet_ids, user_id, owned=True):
+        """
+        Returns the IDs from `snippet_ids` that are public or shared with a user,
+        or owned by them unless `owned` is false, in ascending order.
+        """
+        candidates = Bitmap(snippet_ids)
+        with self._lock:
+            visible = candidates & self._public
+            if user_id is not None:
+                user_id = int(user_id)
+                for users in (self._owned, self._permitted) if owned else (
+                    self._permitted,
+                ):
+                    bitmap = users.get(user_id)
+                    if bitmap is not None:
+                        visible = visible | (candidates & bitmap)
+        return list(visible)
@@ -10,21 +10,37 @@ The main Flask module for Snippet Oracle.
 
 import flask
 import flask_login
+import assets
 import auth
+import cache
 import uuid
 import os
 import base64
+import click
+import code_search
+import concurrent.futures
+import datetime
+import hashlib
+import search_query
+import tasks
+import gzip
+import json
+import time
 import data
 from io import BytesIO
 from PIL import Image
 from flask import jsonify, request, g
 from urllib.parse import urlparse
+from werkzeug.http import is_resource_modified
 
 
 app = flask.Flask("snippet_oracle")
 auth.init(app, "login")
+assets.init(app)
 app.secret_key = auth.get_secret_key()
 data.preload_transformer()
+data.start_trending_refresh()
+data.preload_word_indexes()
 
 
 # Configure file upload settings
@@ -41,6 +57,7 @@ MAX_CODE_LENGTH = 5000
 MAX_TAG_INPUT_LENGTH = 20
 MAX_TAG_COUNT = 15
 MAX_BIO_LENGTH = 250
+MAX_USERNAME_LENGTH = 20
 
 
 def allowed_file(filename):
@@ -63,6 +80,81 @@ def regenerate_snippet_embeddings():
     get_db().regenerate_embeddings()
 
 
+@app.cli.command("build-assets")
+def build_assets():
+    for bundle, path in assets.build(app.static_folder).items():
+        print(f"{bundle} -> {path}")
+
+
+@app.cli.command("refresh-trending")
+def refresh_trending():
+    get_db().refresh_trending()
+
+
+@app.cli.command("refresh-recommendations")
+def refresh_recommendations():
+    get_db().refresh_recommendations()
+
+
+@app.cli.command("benchmark-search-payload")
+@click.argument("queries", nargs=-1)
+def benchmark_search_payload(queries):
+    """Compares /search response sizes in the full and compact formats."""
+    queries = queries or ["", "a", "sort", "+python", "@admin"]
+    totals = [0, 0]
+
+    click.echo(f"{'query':<20} {'format 1':>16} {'format 2':>16} {'saved':>7}")
+    for query in queries:
+        results, _ = get_search_results(query, True, None)
+        sizes = []
+        for payload in (results, data.compact_listings(results)):
+            encoded = json.dumps(payload).encode()
+            sizes.append((len(encoded), len(gzip.compress(encoded))))
+        totals[0] += sizes[0][0]
+        totals[1] += sizes[1][0]
+
+        saved = 1 - sizes[1][0] / sizes[0][0]
+        click.echo(
+            f"{query or '(empty)':<20} "
+            f"{sizes[0][0]:>7} ({sizes[0][1]:>6}) "
+            f"{sizes[1][0]:>7} ({sizes[1][1]:>6}) {saved:>7.1%}"
+        )
+
+    click.echo(f"Total: {totals[0]} -> {totals[1]} bytes (gzipped in parentheses)")
+
+
+@app.cli.command("benchmark-code-search")
+@click.option("--count", default=100_000, help="Synthetic snippets to search.")
+def benchmark_code_search(count):
+    """Times code searches with a full scan and with the trigram index."""
+    click.echo(
+        f"{'query':<34} {'matches':>8} {'candidates':>10} {'scan':>9} {'index':>9}"
+    )
+    for kind, text, matches, candidates, scan_ms, index_ms in code_search.benchmark(
+        count
+    ):
+        click.echo(
+            f"{kind + ' ' + text:<34} {matches:>8} {candidates:>10} "
+            f"{scan_ms:>7.1f}ms {index_ms:>7.1f}ms"
+        )
+
+
+@app.cli.command("benchmark-storage")
+@click.option("--count", default=100_000, help="Synthetic snippets to store.")
+def benchmark_storage(count):
+    """Compares the database's size and query times before and after migrating."""
+    measurements, (before, after) = data.benchmark_storage(count)
+    if before != after:
+        raise click.ClickException("Migrated tables gave different results")
+
+    click.echo(f"{'measurement':<20} {'before':>12} {'after':>12} {'change':>8}")
+    for name, unit, before, after in measurements:
+        click.echo(
+            f"{name:<20} {before:>9.1f}{unit:>3} {after:>9.1f}{unit:>3} "
+            f"{after / before - 1:>+8.0%}"
+        )
+
+
 def get_db():
     db = getattr(g, "_database", None)
     if db is None:
@@ -70,6 +162,67 @@ def get_db():
     return db
 
 
+def get_cancel_token():
+    """
+    Returns the current request's cancel token. Servers that can tell when a
+    client has gone away, like the one in asgi.py, provide it in the environ.
+    """
+    token = getattr(g, "_cancel_token", None)
+    if token is None:
+        token = request.environ.get(tasks.ENVIRON_KEY) or tasks.CancelToken()
+        g._cancel_token = token
+    return token
+
+
+@app.errorhandler(tasks.Cancelled)
+def cancelled_request(error):
+    """Answers a request whose work was cancelled; the client isn't waiting for it."""
+    return "", 499
+
+
+def conditional_response(version, last_modified, render, public=False):
+    """
+    Builds a response with `render`, unless the client's cached copy is still current.
+    In that case, 304 Not Modified is returned without rendering anything.
+
+    `version` must change whenever anything in the rendered response could, and
+    `last_modified` is an SQLite UTC timestamp or `None`. Rendered responses marked
+    no-store (like incomplete results) are sent without validators.
+    """
+    # Flashed messages are only shown once, so a page showing them can't be reused
+    if "_flashes" in flask.session:
+        return render()
+
+    etag = hashlib.sha1(repr(version).encode()).hexdigest()
+    if last_modified is not None:
+        last_modified = datetime.datetime.fromisoformat(last_modified).replace(
+            tzinfo=datetime.timezone.utc
+        )
+
+    if is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        response = flask.make_response(render())
+        if response.status_code != 200 or response.cache_control.no_store:
+            return response
+    else:
+        response = flask.Response(status=304)
+
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    response.cache_control.public = public
+    response.cache_control.private = not public
+    response.cache_control.no_cache = True
+    return response
+
+
+def get_versions(*names):
+    """
+    Returns the combined `(versions, last_modified)` of several GlobalVersion counters.
+    """
+    versions = [get_db().get_version(name) for name in names]
+    last_modified = max(filter(None, [v[1] for v in versions]), default=None)
+    return tuple(v[0] for v in versions), last_modified
+
+
 @app.teardown_appcontext
 def close_connection(exception):
     db = getattr(g, "_database", None)
@@ -82,19 +235,13 @@ def index():
     """
     Render the homepage with optional search results.
     """
-    user_snippets = []
     user_data = None
     query = request.args.get("q", "").strip()
 
     if flask_login.current_user.is_authenticated:
-        user_snippets = get_db().get_user_snippets(
-            flask_login.current_user.id, flask_login.current_user.id
-        )
         user_data = get_db().get_user_details(flask_login.current_user.id)
 
-    return flask.render_template(
-        "index.html", snippets=user_snippets, user=user_data, query=query
-    )
+    return flask.render_template("index.html", user=user_data, query=query)
 
 
 @app.route("/login", methods=["GET", "POST"])
@@ -177,6 +324,10 @@ def logout():
 
 
 # Add Route for Profile Page
+# Snippets on each page of a profile
+PROFILE_PAGE_SIZE = 24
+
+
 @app.route("/profile", methods=["GET", "POST"])
 @app.route("/profile/<string:username>")
 def profile(username=None):
@@ -282,34 +433,58 @@ def profile(username=None):
                 )
 
         get_db()._db.commit()
+        get_db().invalidate_user(user_id)
         flask.flash("Profile updated successfully!", "info")
 
-    # Fetch social links
-    cur.execute("SELECT Platform, URL FROM Links WHERE UserID = ?", [user_id])
-    user_links = cur.fetchall()
-
     # Fetch all snippets if owner, only public snippets if visitor
     viewer_id = (
         flask_login.current_user.id
         if flask_login.current_user.is_authenticated
         else None
     )
-    user_snippets = get_db().get_user_snippets(user_id, viewer_id)
 
-    if not is_owner:
-        user_snippets = [
-            snippet for snippet in user_snippets if snippet["is_public"]
-        ]  # Filter only public snippets
+    sort = request.args.get("sort", "newest")
+    after = request.args.get("after")
+    if sort not in data.SNIPPET_SORTS:
+        flask.abort(400)
 
-    user_details = get_db().get_user_details(user_id)
+    def render():
+        try:
+            page = get_db().get_user_snippets(
+                user_id,
+                viewer_id,
+                public_only=not is_owner,
+                sort=sort,
+                after=after,
+                limit=PROFILE_PAGE_SIZE,
+            )
+        except ValueError:
+            flask.abort(400)  # A cursor that isn't for this sort order
 
-    return flask.render_template(
-        "profile.html",
-        user=user_details,
-        links=user_links,
-        snippets=user_snippets,
-        is_owner=is_owner,
-        get_social_icon=get_social_icon,
+        user_details = get_db().get_user_details(user_id)
+
+        return flask.render_template(
+            "profile.html",
+            user=user_details,
+            links=user_details["social_links"],
+            snippets=page["snippets"],
+            next_page=page["next"],
+            sort=sort,
+            is_first_page=not after,
+            is_owner=is_owner,
+            get_social_icon=get_social_icon,
+        )
+
+    if flask.request.method == "POST":
+        return render()
+
+    snippets_version, snippets_modified = get_db().get_user_snippets_version(user_id)
+    profiles_version, profiles_modified = get_versions("profiles")
+    return conditional_response(
+        (viewer_id, user_id, sort, after, snippets_version, profiles_version),
+        max(filter(None, [snippets_modified, profiles_modified]), default=None),
+        render,
+        public=viewer_id is None,
     )
 
 
@@ -446,12 +621,8 @@ def createSnippet(snippet_id=None):
         else:
             flask.flash("Failed to create snippet!", "danger")
 
-    all_users = get_db().get_all_users_excluding_current(flask_login.current_user.id)
-
     return flask.render_template(
         "createSnippet.html",
-        all_users=all_users,
-        preset_tags=data.preset_tags,
         snippet=original_snippet,  # Pass original snippet if remixing
         user=get_db().get_user_details(flask_login.current_user.id),
     )
@@ -465,26 +636,53 @@ def view_snippet(snippet_id):
         current_user_id = flask_login.current_user.id
     elif not get_db().get_snippet_isPublic(snippet_id):
         return auth.login_manager.unauthorized()
+    comments_after = request.args.get("comments_after")
 
-    snippet = get_db().get_snippet(snippet_id, current_user_id)
-    if not snippet:
-        flask.flash("Snippet not found or not accessible!", "warning")
-        return flask.redirect(flask.url_for("index"))
+    def render():
+        snippet = get_db().get_snippet(snippet_id, current_user_id)
+        if not snippet:
+            flask.flash("Snippet not found or not accessible!", "warning")
+            return flask.redirect(flask.url_for("index"))
+
+        ancestry = []
+        if snippet["parent_snippet_id"] is not None:
+            ancestry = get_db().get_remix_ancestry(snippet_id, current_user_id)
+        forks = get_db().get_fork_counts([snippet_id], current_user_id)[snippet_id]
 
-    parent_snippet = None
-    if snippet["parent_snippet_id"] is not None:
-        parent_snippet = get_db().get_snippet(
-            snippet["parent_snippet_id"], current_user_id
+        try:
+            comments = get_db().get_comments(snippet_id, after=comments_after)
+        except ValueError:
+            flask.abort(400)  # Not a comments cursor
+
+        return flask.render_template(
+            "snippetDetail.html",
+            user=get_db().get_user_details(current_user_id),
+            snippet=snippet,
+            comments=comments["comments"],
+            comments_next=comments["next"],
+            ancestry=ancestry,
+            forks=forks,
+            remixes=get_db().get_remix_tree(snippet_id, current_user_id)
+            if forks["descendants"]
+            else [],
         )
 
-    comments = get_db().get_comments(snippet_id)  # Fetch comments from database
+    snippet_version = get_db().get_snippet_version(snippet_id)
+    if snippet_version is None:
+        return render()
 
-    return flask.render_template(
-        "snippetDetail.html",
-        user=get_db().get_user_details(current_user_id),
-        snippet=snippet,
-        comments=comments,
-        parent_snippet=parent_snippet,
+    profiles_version, profiles_modified = get_versions("profiles")
+    return conditional_response(
+        (
+            current_user_id,
+            snippet_id,
+            comments_after,
+            snippet_version[0],
+            profiles_version,
+        ),
+        max(filter(None, [snippet_version[1], profiles_modified]), default=None),
+        render,
+        public=current_user_id is None,
     )
 
 
@@ -505,51 +703,343 @@ def update_snippet_visibility(snippet_id):
     return flask.redirect(flask.url_for("view_snippet", snippet_id=snippet_id))
 
 
+# Response formats understood by /search; 2 is the compact format
+SEARCH_FORMATS = ("1", "2")
+
+
 @app.route("/search", methods=["GET"])
 @app.route("/search/", methods=["GET"])
 def search_snippets():
     query = request.args.get("q", "").strip()
     public = request.args.get("public") == "1"
+    response_format = request.args.get("format", "1")
     if len(query) > 300:
         query = query[:300]  # Limit query length
+    if response_format not in SEARCH_FORMATS:
+        return jsonify({"error": "Unknown response format"}), 400
+    sort = request.args.get("sort", "relevance")
+    after = request.args.get("after") or None
+    if sort not in data.SEARCH_SORTS:
+        return jsonify({"error": "Unknown sort order"}), 400
+    # Searches for symbols sort by one more key, so their cursors have one more
+    symbols = any(
+        kind == "symbol" for clause in search_query.parse(query) for kind, _ in clause
+    )
+    if after is not None and not data.is_cursor_for(after, sort, symbols):
+        return jsonify({"error": "Invalid cursor"}), 400
+
+    user_id = None
+    if flask_login.current_user.is_authenticated:
+        user_id = flask_login.current_user.id
+
+    token = get_cancel_token()
+    supersede_search(token)
+
+    if request.args.get("stream") == "1":
+        return stream_search(
+            query, public, user_id, response_format, token, sort, after
+        )
+
+    def render():
+        results, complete = get_search_results(
+            query, public, user_id, token, sort, after
+        )
+        if response_format == "2":
+            results = data.compact_listings(results)
+
+        response = jsonify(results)
+        if not complete:
+            # Don't let clients reuse results missing a section
+            response.cache_control.no_store = True
+        return response
+
+    # Results can include any snippet or user, so any change invalidates them
+    versions, last_modified = get_versions("snippets", "profiles")
+    return conditional_response(
+        (user_id, query, public, response_format, sort, after, versions),
+        last_modified,
+        render,
+        public=user_id is None,
+    )
+
+
+# Search subqueries run in parallel, each on its own pooled connection, so there
+# are as many workers as connections kept idle for them
+SEARCH_WORKERS = data.CONNECTION_POOL_SIZE
+# Seconds to wait for each subquery before sending its section empty; None waits
+SEARCH_TIMEOUTS = {"similar": 2.0}
+_search_executor = concurrent.futures.ThreadPoolExecutor(
+    max_workers=SEARCH_WORKERS, thread_name_prefix="search"
+)
 
-    # Initialize filters
-    include_tags, exclude_tags, usernames, general_terms = set(), set(), set(), []
-
-    # Process query terms
-    terms = query.split(" ")
-    for term in terms:
-        if term.startswith("+"):
-            include_tags.add(term[1:].lower())
-        elif term.startswith("-"):
-            exclude_tags.add(term[1:].lower())
-        elif term.startswith("@"):
-            usernames.add(term[1:].lower())
+
+# How often a search waiting on its subqueries checks whether it was cancelled
+SEARCH_CANCEL_POLL_SECONDS = 0.1
+
+# Latest search of each page, keyed by `get_search_session`
+SEARCH_SESSION_CACHE_SIZE = 4096
+_latest_searches = cache.TTLCache(max_size=SEARCH_SESSION_CACHE_SIZE, ttl=60)
+
+
+def get_search_session():
+    """
+    Returns the search session of the page that sent the request: its
+    X-Search-Session header, scoped to the signed-in user or else to the visitor's
+    Flask session, so that clients can't touch each other's searches. Returns None
+    if the page didn't send one.
+    """
+    session = getattr(g, "_search_session", None)
+    if session is None and request.headers.get("X-Search-Session"):
+        if flask_login.current_user.is_authenticated:
+            owner = "user:" + str(flask_login.current_user.id)
         else:
-            general_terms.append(term)  # Fuzzy search for names & descriptions
+            owner = flask.session.setdefault("search_client", uuid.uuid4().hex)
+        session = g._search_session = (
+            f"{owner}:{request.headers.get('X-Search-Session')}"
+        )
+    return session
+
+
+def supersede_search(token):
+    """
+    Makes `token` the latest search of the page that sent the request, cancelling
+    the one it replaces. Pages that don't send X-Search-Session aren't tracked.
+    """
+    session = get_search_session()
+    if not session:
+        return
+
+    previous = _latest_searches.get(session)
+    _latest_searches.set(session, token)
+    if previous is not None and previous is not token:
+        previous.cancel()
+
+
+def run_pooled(token, method, *args, **kwargs):
+    """Calls a `Data` method on a pooled connection, unless `token` is cancelled."""
+    with data.pooled() as db, token.watching(db):
+        return getattr(db, method)(*args, **kwargs)
+
+
+def get_search_results(
+    query, public, user_id, token=None, sort="relevance", after=None
+):
+    """
+    Runs a search query, returning the matching "tags", "users", "snippets" and
+    "similar" snippets, the query corrected for typos as "did_you_mean", the
+    cursor for the next page of snippets as "next", and whether every section
+    is complete.
+    """
+    results = {
+        "tags": [],
+        "users": [],
+        "snippets": [],
+        "next": None,
+        "similar": [],
+        "did_you_mean": None,
+    }
+    complete = True
+    for name, section, section_complete in iter_search_results(
+        query, public, user_id, token, sort, after
+    ):
+        results[name] = section
+        complete = complete and section_complete
+
+    return results, complete
 
+
+def iter_search_results(
+    query, public, user_id, token=None, sort="relevance", after=None
+):
+    """
+    Runs a search query, yielding `(name, results, complete)` for each of the
+    "tags", "users", "snippets" and "similar" sections as soon as it is ready,
+    for "did_you_mean", the query with its typos corrected or None, and for
+    "next", the cursor for the page of snippets after this one or None.
+
+    Snippets are sorted in `sort` order, starting after the cursor `after` if
+    given. Only "snippets" and "next" are yielded for pages after the first.
+
+    Sections are searched in parallel. One that takes longer than its entry in
+    `SEARCH_TIMEOUTS` is yielded empty and marked incomplete. Cancelling `token`
+    interrupts the subqueries and raises `tasks.Cancelled`.
+    """
+    if token is None:
+        token = tasks.CancelToken()
+
+    clauses = search_query.parse(query)
+    advanced = search_query.is_advanced(clauses)
+
+    futures = {
+        "snippets": _search_executor.submit(
+            run_pooled,
+            token,
+            "search_snippets_page",
+            clauses=clauses,
+            viewer_id=user_id,
+            public=public,
+            session=get_search_session(),
+            sort=sort,
+            after=after,
+        ),
+    }
+    if after is None:
+        futures["similar"] = _search_executor.submit(
+            run_pooled, token, "smart_search_snippets", query
+        )
+    if after is None and not advanced:
+        futures["users"] = _search_executor.submit(
+            run_pooled, token, "search_users", query
+        )
+
+    # Tags and typos are matched in memory, so they don't need a worker
+    if after is None:
+        yield "tags", get_db().search_tags(query) if not advanced else [], True
+        yield "did_you_mean", get_db().did_you_mean(query), True
+    if after is None and advanced:
+        yield "users", [], True
+
+    started = time.monotonic()
+    names = {future: name for name, future in futures.items()}
+    deadlines = {
+        future: started + SEARCH_TIMEOUTS[name]
+        for future, name in names.items()
+        if SEARCH_TIMEOUTS.get(name) is not None
+    }
+
+    pending = set(names)
+    try:
+        while pending:
+            token.raise_if_cancelled()
+
+            waiting = [deadlines[future] for future in pending if future in deadlines]
+            timeout = SEARCH_CANCEL_POLL_SECONDS
+            if waiting:
+                timeout = max(0, min(timeout, min(waiting) - time.monotonic()))
+            done, pending = concurrent.futures.wait(
+                pending, timeout=timeout, return_when=concurrent.futures.FIRST_COMPLETED
+            )
+
+            for future in done:
+                if names[future] == "snippets":
+                    page = future.result()
+                    yield "snippets", page["snippets"], True
+                    yield "next", page["next"], True
+                else:
+                    yield names[future], future.result(), True
+
+            for future in list(pending):
+                if deadlines.get(future, float("inf")) <= time.monotonic():
+                    app.logger.warning(
+                        "Search for %r timed out in %s", query, names[future]
+                    )
+                    pending.discard(future)
+                    yield names[future], [], False
+    except GeneratorExit:
+        # Nobody will read the rest of the sections
+        token.cancel()
+        raise
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def stream_search(
+    query, public, user_id, response_format, token, sort="relevance", after=None
+):
+    """
+    Streams search results as newline-delimited JSON, one record per section in
+    the order they finish. Each record holds a "section" name and that section's
+    results in the requested format. A final record holds "done" and "complete".
+    The stream just ends if the search is cancelled.
+    """
+
+    def records():
+        complete = True
+        try:
+            for name, section, section_complete in iter_search_results(
+                query, public, user_id, token, sort, after
+            ):
+                complete = complete and section_complete
+                record = {name: section}
+                if response_format == "2":
+                    record = data.compact_listings(record)
+                record["section"] = name
+                yield app.json.dumps(record) + "\n"
+        except tasks.Cancelled:
+            return
+
+        yield app.json.dumps({"done": True, "complete": complete}) + "\n"
+
+    response = flask.Response(
+        flask.stream_with_context(records()), mimetype="application/x-ndjson"
+    )
+    # Sections are sent before the last one is known, so there's nothing to validate
+    response.cache_control.no_cache = True
+    response.headers["X-Accel-Buffering"] = "no"  # Ask proxies not to hold records back
+    return response
+
+
+@app.route("/snippet/<int:snippet_id>/code", methods=["GET"])
+def snippet_code(snippet_id):
+    """Returns a snippet's full code, for listings that only sent a preview."""
     user_id = None
     if flask_login.current_user.is_authenticated:
         user_id = flask_login.current_user.id
 
-    search_results = get_db().search_snippets(
-        terms=general_terms if general_terms else None,
-        include_tags=include_tags if include_tags else None,
-        exclude_tags=exclude_tags if exclude_tags else None,
-        usernames=usernames if usernames else None,
-        viewer_id=user_id,
-        public=public,
+    code = get_db().get_snippet_code(snippet_id, user_id)
+    if code is None:
+        return jsonify({"error": "Snippet not found"}), 404
+
+    version = get_db().get_snippet_version(snippet_id)
+    if version is None:
+        return jsonify({"code": code})
+    return conditional_response(
+        (snippet_id, version[0]),
+        version[1],
+        lambda: jsonify({"code": code}),
+        public=user_id is None,
     )
 
-    advanced = include_tags or exclude_tags or usernames
 
+# Most users returned by each request for /users
+USER_PAGE_LIMIT = 50
+
+
+@app.route("/users", methods=["GET"])
+@flask_login.login_required
+def find_users():
+    """
+    Returns a page of the other users whose names start with `q`, for choosing
+    who to share a snippet with. Pass the page's "next" cursor as `after` for the
+    page after it.
+    """
+    prefix = request.args.get("q", "").strip()[:MAX_USERNAME_LENGTH]
+    limit = request.args.get("limit", 10, type=int)
+    limit = min(max(limit, 1), USER_PAGE_LIMIT)
     return jsonify(
-        {
-            "tags": get_db().search_tags(query) if not advanced else [],
-            "users": get_db().search_users(query) if not advanced else [],
-            "snippets": search_results,
-            "similar": get_db().smart_search_snippets(query),
-        }
+        get_db().find_users_by_prefix(
+            prefix,
+            flask_login.current_user.id,
+            limit,
+            after=request.args.get("after"),
+        )
+    )
+
+
+@app.route("/tags", methods=["GET"])
+def complete_tags():
+    """Returns the tags containing `q`, the most used first, for autocompletion."""
+    text = request.args.get("q", "").strip()[:MAX_TAG_INPUT_LENGTH]
+    limit = min(request.args.get("limit", data.TAG_SUGGESTION_LIMIT, type=int), 100)
+
+    # Use counts change with any snippet
+    versions, last_modified = get_versions("snippets")
+    return conditional_response(
+        (text, limit, versions),
+        last_modified,
+        lambda: jsonify(get_db().complete_tag(text, max(limit, 1))),
+        public=True,
     )
 
 
@@ -612,17 +1102,12 @@ def edit_snippet(snippet_id):
             )
         )
     elif snippet:
-        all_users = get_db().get_all_users_excluding_current(
-            flask_login.current_user.id
-        )
         return flask.render_template(
             "editSnippet.html",
             user=get_db().get_user_details(flask_login.current_user.id),
-            all_users=all_users,
             snippet=snippet,
             tags=snippet["tags"],
             users=prev_users,
-            preset_tags=data.preset_tags,
         )
     else:
         flask.flash("Snippet not found!", "warning")
@@ -719,15 +1204,49 @@ def getPopular():
     viewer_id = None
     if flask_login.current_user.is_authenticated:
         viewer_id = flask_login.current_user.id
-    popularTags = get_db().get_popular_public_tags()
-    popularUsers = get_db().get_popular_users()
-    popularSnippets = get_db().get_popular_public_snippets(viewer_id)
-    recentlyShared = get_db().get_recent_shared_snippets(viewer_id)
+
+    def render():
+        with get_cancel_token().watching(get_db()):
+            # Shared by every viewer, so only the viewer's own data is queried here
+            popular = get_db().get_popular()
+            popularSnippets = popular["snippets"]
+            recentlyShared = []
+            recommended = []
+            if viewer_id is not None:
+                liked = get_db().get_liked_snippet_ids(
+                    viewer_id, [snippet["id"] for snippet in popularSnippets]
+                )
+                popularSnippets = [
+                    {**snippet, "is_liked": snippet["id"] in liked}
+                    for snippet in popularSnippets
+                ]
+                recentlyShared = get_db().get_recent_shared_snippets(viewer_id)
+                recommended = get_db().get_recommended_snippets(viewer_id)
+
+        return jsonify(
+            {
+                "tags": popular["tags"],
+                "users": popular["users"],
+                "snippets": popularSnippets,
+                "shared": recentlyShared,
+                "recommended": recommended,
+            }
+        )
+
+    # Likes and shares change snippets' versions, while feeds and trending scores
+    # are refreshed in bulk
+    versions, last_modified = get_versions(
+        "snippets", "profiles", "recommendations", "trending"
+    )
+    return conditional_response(
+        (viewer_id, versions), last_modified, render, public=viewer_id is None
+    )
+
+
+@app.route("/forYou", methods=["GET"])
+@flask_login.login_required
+def for_you():
+    """Returns the current user's precomputed snippet recommendations."""
     return jsonify(
-        {
-            "tags": popularTags,
-            "users": popularUsers,
-            "snippets": popularSnippets,
-            "shared": recentlyShared,
-        }
+        {"snippets": get_db().get_recommended_snippets(flask_login.current_user.id)}
     )
@@ -0,0 +1,169 @@
+"""
+Serves Snippet Oracle over ASGI, with `uvicorn asgi:application`.
+
+Requests are handled by the same Flask app, each on a worker thread, while an
+asyncio event loop does the network I/O. Unlike a WSGI server, the loop notices
+when a client disconnects. If that happens before a GET request is answered, the
+request's cancel token is cancelled, so an abandoned search-as-you-type request
+stops its queries instead of running them to completion.
+"""
+
+import asyncio
+import concurrent.futures
+import io
+import sys
+import tasks
+from app import app
+
+# Requests handled at once; others wait on the event loop without using a thread
+ASGI_WORKERS = 16
+_executor = concurrent.futures.ThreadPoolExecutor(
+    max_workers=ASGI_WORKERS, thread_name_prefix="asgi"
+)
+
+# Requests that only read, so nothing is lost by abandoning them
+CANCELLABLE_METHODS = ("GET", "HEAD")
+
+
+async def application(scope, receive, send):
+    """The ASGI entry point."""
+    if scope["type"] == "lifespan":
+        await _lifespan(receive, send)
+        return
+    if scope["type"] != "http":
+        return  # WebSockets aren't used
+
+    body = bytearray()
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            break
+
+    token = tasks.CancelToken()
+    environ = build_environ(scope, bytes(body), token)
+    loop = asyncio.get_running_loop()
+
+    watcher = None
+    if scope["method"] in CANCELLABLE_METHODS:
+        watcher = asyncio.create_task(_cancel_on_disconnect(receive, token))
+
+    try:
+        await loop.run_in_executor(_executor, _run_wsgi, environ, send, loop, token)
+    finally:
+        if watcher is not None:
+            watcher.cancel()
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            _executor.shutdown(wait=False, cancel_futures=True)
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def _cancel_on_disconnect(receive, token):
+    """Cancels `token` once the client disconnects."""
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            token.cancel()
+            return
+
+
+def _run_wsgi(environ, send, loop, token):
+    """
+    Runs the Flask app on this worker thread, sending each piece of its response
+    through the event loop as soon as it is produced.
+    """
+
+    def send_message(message):
+        asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+    response_start = {"type": "http.response.start"}
+    started = False
+
+    def start_response(status, headers, exc_info=None):
+        response_start["status"] = int(status.split(" ", 1)[0])
+        response_start["headers"] = [
+            (name.lower().encode("latin-1"), value.encode("latin-1"))
+            for name, value in headers
+        ]
+
+    def send_start():
+        nonlocal started
+        if not started:
+            send_message(response_start)
+            started = True
+
+    result = app(environ, start_response)
+    try:
+        for chunk in result:
+            if token.cancelled:
+                return  # The client is gone, so the rest isn't needed
+            if chunk:
+                send_start()
+                send_message(
+                    {"type": "http.response.body", "body": chunk, "more_body": True}
+                )
+
+        send_start()
+        send_message({"type": "http.response.body", "body": b""})
+    except tasks.Cancelled:
+        pass
+    finally:
+        if hasattr(result, "close"):
+            result.close()
+
+
+def build_environ(scope, body, token):
+    """Builds a WSGI environ for an ASGI HTTP request."""
+    root_path = scope.get("root_path", "")
+    path = scope["path"]
+    if path.startswith(root_path):
+        path = path[len(root_path) :]
+
+    server_name, server_port = scope.get("server") or ("localhost", 80)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": root_path.encode("utf-8").decode("latin-1"),
+        "PATH_INFO": path.encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope["query_string"].decode("latin-1"),
+        "SERVER_NAME": server_name,
+        "SERVER_PORT": str(server_port),
+        "SERVER_PROTOCOL": "HTTP/" + scope["http_version"],
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False,
+        tasks.ENVIRON_KEY: token,
+    }
+    client = scope.get("client")
+    if client:
+        environ["REMOTE_ADDR"] = client[0]
+        environ["REMOTE_PORT"] = str(client[1])
+
+    for name, value in scope["headers"]:
+        name = name.decode("latin-1")
+        if name == "content-length":
+            key = "CONTENT_LENGTH"
+        elif name == "content-type":
+            key = "CONTENT_TYPE"
+        else:
+            key = "HTTP_" + name.upper().replace("-", "_")
+
+        value = value.decode("latin-1")
+        if key in environ:
+            value = environ[key] + "," + value
+        environ[key] = value
+
+    return environ
@@ -0,0 +1,316 @@
+"""
+Bundles, minifies and fingerprints the site's first-party JS and CSS.
+
+Templates link to bundles with `url_for("static", filename="bundles/<name>")`.
+Until `flask build-assets` is run, each bundle is concatenated from its sources on
+every request. Once built, the same `url_for` calls point at content-hashed files in
+`static/dist`, which are served precompressed and cached forever.
+"""
+
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import shutil
+import flask
+
+try:
+    import brotli
+except ImportError:
+    brotli = None  # Brotli variants are skipped when the package isn't installed
+
+# Bundle name -> source files, relative to the static folder
+BUNDLES = {
+    "layout.css": ["lib/bulma.min.css", "style.css"],
+    "jquery.js": ["lib/jquery.js"],
+    "layout.js": ["warningMessage.js", "site.js", "profileDropdown.js"],
+    "index.js": ["search.js", "positionSearchBar.js"],
+    "createSnippet.js": [
+        "userSelection.js",
+        "counter.js",
+        "tagHandler.js",
+        "codeEditor.js",
+    ],
+    "editSnippet.js": ["cancel.js"],
+    "profile.js": ["profile.js", "counter.js"],
+    "snippetDetail.js": ["comments.js"],
+}
+
+DIST_FOLDER = "dist"
+MANIFEST_NAME = "manifest.json"
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+
+# "bundles/<name>" -> "dist/<hashed name>", filled in by init() or build()
+manifest: dict[str, str] = {}
+
+
+def init(app):
+    """Loads the asset manifest, if one was built, and registers the asset routes."""
+    manifest_path = os.path.join(app.static_folder, DIST_FOLDER, MANIFEST_NAME)
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as manifest_file:
+            manifest.update(json.load(manifest_file))
+
+    @app.url_defaults
+    def fingerprint_static_url(endpoint, values):
+        if endpoint == "static" and values.get("filename") in manifest:
+            values["filename"] = manifest[values["filename"]]
+
+    @app.route("/static/bundles/<path:name>")
+    def unbuilt_bundle(name):
+        """Serves a bundle straight from its sources, for when assets aren't built."""
+        if name not in BUNDLES:
+            flask.abort(404)
+
+        response = flask.Response(
+            bundle_source(app.static_folder, name),
+            mimetype=mimetypes.guess_type(name)[0],
+        )
+        response.cache_control.no_cache = True
+        return response
+
+    @app.route("/static/dist/<path:filename>")
+    def built_asset(filename):
+        """Serves a fingerprinted file, precompressed if the client accepts it."""
+        dist_folder = os.path.join(app.static_folder, DIST_FOLDER)
+        mimetype = mimetypes.guess_type(filename)[0]
+
+        for encoding, suffix in [("br", ".br"), ("gzip", ".gz")]:
+            if flask.request.accept_encodings[encoding] and os.path.exists(
+                os.path.join(dist_folder, filename + suffix)
+            ):
+                response = flask.send_from_directory(
+                    dist_folder,
+                    filename + suffix,
+                    mimetype=mimetype,
+                    max_age=IMMUTABLE_MAX_AGE,
+                )
+                response.headers["Content-Encoding"] = encoding
+                break
+        else:
+            response = flask.send_from_directory(
+                dist_folder, filename, mimetype=mimetype, max_age=IMMUTABLE_MAX_AGE
+            )
+
+        response.vary.add("Accept-Encoding")
+        response.cache_control.immutable = True
+        return response
+
+
+def bundle_source(static_folder, name):
+    """Concatenates a bundle's source files."""
+    sources = []
+    for path in BUNDLES[name]:
+        with open(os.path.join(static_folder, path), encoding="utf-8") as source:
+            sources.append(source.read())
+
+    # Semicolons keep one script's last statement from running into the next
+    return (";\n" if name.endswith(".js") else "\n").join(sources)
+
+
+def build(static_folder):
+    """
+    Writes every bundle to `static/dist` as a minified, content-hashed file with
+    gzip (and, if available, brotli) variants, then writes the manifest.
+    Returns the new manifest.
+    """
+    dist_folder = os.path.join(static_folder, DIST_FOLDER)
+    shutil.rmtree(dist_folder, ignore_errors=True)
+    os.mkdir(dist_folder)
+
+    new_manifest = {}
+    for name in BUNDLES:
+        source = bundle_source(static_folder, name)
+        minified = minify_js(source) if name.endswith(".js") else minify_css(source)
+        content = minified.encode("utf-8")
+
+        stem, extension = os.path.splitext(name)
+        digest = hashlib.sha256(content).hexdigest()[:12]
+        filename = f"{stem}.{digest}{extension}"
+
+        with open(os.path.join(dist_folder, filename), "wb") as file:
+            file.write(content)
+        with open(os.path.join(dist_folder, filename + ".gz"), "wb") as file:
+            file.write(gzip.compress(content, compresslevel=9, mtime=0))
+        if brotli is not None:
+            with open(os.path.join(dist_folder, filename + ".br"), "wb") as file:
+                file.write(brotli.compress(content))
+
+        new_manifest["bundles/" + name] = DIST_FOLDER + "/" + filename
+
+    with open(os.path.join(dist_folder, MANIFEST_NAME), "w") as manifest_file:
+        json.dump(new_manifest, manifest_file, indent=2)
+
+    manifest.clear()
+    manifest.update(new_manifest)
+    return new_manifest
+
+
+# Tokens after which a "/" starts a regular expression instead of a division
+_REGEX_PRECEDERS = set("(,=:[!&|?{};+-*%<>~^")
+_REGEX_KEYWORDS = {
+    "return",
+    "typeof",
+    "case",
+    "do",
+    "else",
+    "in",
+    "instanceof",
+    "new",
+    "void",
+    "delete",
+    "throw",
+}
+
+
+def minify_js(source):
+    """
+    Removes comments and redundant whitespace from JavaScript.
+
+    This only ever deletes comments and collapses whitespace, keeping line breaks so
+    that automatic semicolon insertion behaves the same. Strings, template literals
+    and regular expressions are copied untouched. Comments starting with "/*!"
+    (licenses) are kept.
+    """
+    out = []
+    i = 0
+    length = len(source)
+    # Open template literals; each entry counts the braces open inside its "${"
+    templates = []
+    last = ""  # Last significant token, used to tell regexes from divisions
+
+    def emit_space(text):
+        if out and out[-1] not in ("\n", " "):
+            out.append("\n" if "\n" in text else " ")
+        elif out and out[-1] == " " and "\n" in text:
+            out[-1] = "\n"
+
+    while i < length:
+        c = source[i]
+
+        if c in " \t\r\n\f\v":
+            start = i
+            while i < length and source[i] in " \t\r\n\f\v":
+                i += 1
+            emit_space(source[start:i])
+            continue
+
+        if source.startswith("//", i):
+            end = source.find("\n", i)
+            i = length if end == -1 else end
+            continue
+
+        if source.startswith("/*", i):
+            end = source.find("*/", i + 2)
+            end = length if end == -1 else end + 2
+            if source.startswith("/*!", i):
+                out.append(source[i:end])
+            else:
+                emit_space(source[i:end])
+            i = end
+            continue
+
+        if c in "'\"":
+            end = i + 1
+            while end < length and source[end] != c and source[end] != "\n":
+                end += 2 if source[end] == "\\" else 1
+            out.append(source[i : end + 1])
+            i = end + 1
+            last = "string"
+            continue
+
+        if c == "`" or (c == "}" and templates and templates[-1] == 0):
+            # Start or resume a template literal, up to its end or next "${"
+            if c == "}":
+                templates.pop()
+            end = i + 1
+            while end < length and source[end] != "`" and not source.startswith("${", end):
+                end += 2 if source[end] == "\\" else 1
+            if source.startswith("${", end):
+                templates.append(0)
+                end += 1
+            out.append(source[i : end + 1])
+            i = end + 1
+            last = "string"
+            continue
+
+        if c == "/" and (last == "" or last in _REGEX_PRECEDERS or last in _REGEX_KEYWORDS):
+            end = _find_regex_end(source, i)
+            if end is not None:
+                while end < length and (source[end].isalnum() or source[end] == "_"):
+                    end += 1  # Flags
+                out.append(source[i:end])
+                i = end
+                last = "regex"
+                continue
+
+        if c.isalnum() or c in "_$":
+            end = i
+            while end < length and (source[end].isalnum() or source[end] in "_$"):
+                end += 1
+            last = source[i:end]
+            out.append(last)
+            i = end
+            continue
+
+        if templates:
+            if c == "{":
+                templates[-1] += 1
+            elif c == "}":
+                templates[-1] -= 1
+
+        out.append(c)
+        last = c
+        i += 1
+
+    return "".join(out).strip() + "\n"
+
+
+def _find_regex_end(source, start):
+    """
+    Returns the index just past the closing "/" of a regex literal starting at
+    `start`, or None if there isn't one on the same line.
+    """
+    i = start + 1
+    in_class = False
+    while i < len(source):
+        c = source[i]
+        if c == "\n":
+            return None
+        if c == "\\":
+            i += 2
+            continue
+        if c == "[":
+            in_class = True
+        elif c == "]":
+            in_class = False
+        elif c == "/" and not in_class:
+            return i + 1
+        i += 1
+    return None
+
+
+def minify_css(source):
+    """
+    Removes comments and redundant whitespace from CSS.
+    Strings and comments starting with "/*!" (licenses) are kept.
+    """
+    parts = re.split(r"""("(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*'|/\*.*?\*/)""", source, flags=re.S)
+
+    out = []
+    for index, part in enumerate(parts):
+        if index % 2:
+            # Strings and comments alternate with everything else
+            if part.startswith("/*") and not part.startswith("/*!"):
+                out.append(" ")
+            else:
+                out.append(part)
+            continue
+
+        part = re.sub(r"\s+", " ", part)
+        part = re.sub(r"\s*([{};,>])\s*", r"\1", part)
+        out.append(part)
+
+    return "".join(out).replace(";}", "}").strip() + "\n"
@@ -6,6 +6,7 @@ import os
 import flask_login
 import argon2
 import app
+import data
 
 login_manager = flask_login.LoginManager()
 password_hasher = argon2.PasswordHasher()
@@ -74,13 +75,20 @@ def get_password_error(password):
 def load_user(user_id):
     """
     Fetch a user by ID, returning None if that user does not exist.
+    Recently loaded users are reused without querying the database.
     """
-    res = app.get_db().get_user_by_id(user_id)
+    user = data.session_users.get(user_id)
+    if user is not None:
+        return user
 
-    if res is None:
+    name = app.get_db().get_user_name(user_id)
+    if name is None:
         return None
-    else:
-        return User(user_id, res["name"], res["password_hash"])
+
+    # The password hash is only needed to log in, so it isn't loaded here
+    user = User(user_id, name, None)
+    data.session_users.set(user_id, user)
+    return user
 
 
 def try_login(username, password):
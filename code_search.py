@@ -0,0 +1,250 @@
+"""
+Substring and regular expression search over snippet code, narrowed down with a
+trigram index.
+
+`Snippet.Code` is indexed by the `SnippetCode` FTS5 table, which finds every
+snippet containing a given string of three or more characters. Like Google Code
+Search, a regular expression is searched for by working out strings that all of
+its matches contain, finding the snippets containing those with the index, and
+running the regular expression on just those snippets.
+
+Regular expressions are run with RE2, which takes time linear in the length of
+the code, so that no pattern can backtrack for minutes on end like `re` can.
+"""
+
+import functools
+import random
+import re
+import re2
+import sqlite3
+import time
+
+try:
+    from re import _parser as sre_parse
+except ImportError:
+    import sre_parse  # Python 3.10 and older
+
+# Creates the code index and the triggers that keep it in step with Snippet
+INDEX_SQL = """
+    CREATE VIRTUAL TABLE IF NOT EXISTS SnippetCode USING fts5(
+        Code, content='Snippet', content_rowid='ID', tokenize='trigram'
+    );
+    CREATE TRIGGER IF NOT EXISTS SnippetCodeInsert AFTER INSERT ON Snippet BEGIN
+        INSERT INTO SnippetCode (rowid, Code) VALUES (NEW.ID, NEW.Code);
+    END;
+    CREATE TRIGGER IF NOT EXISTS SnippetCodeDelete AFTER DELETE ON Snippet BEGIN
+        INSERT INTO SnippetCode (SnippetCode, rowid, Code)
+        VALUES ('delete', OLD.ID, OLD.Code);
+    END;
+    CREATE TRIGGER IF NOT EXISTS SnippetCodeUpdate AFTER UPDATE OF Code ON Snippet
+    BEGIN
+        INSERT INTO SnippetCode (SnippetCode, rowid, Code)
+        VALUES ('delete', OLD.ID, OLD.Code);
+        INSERT INTO SnippetCode (rowid, Code) VALUES (NEW.ID, NEW.Code);
+    END;
+"""
+
+# Fills the code index from scratch
+REBUILD_SQL = "INSERT INTO SnippetCode (SnippetCode) VALUES ('rebuild')"
+
+# Shortest string the trigram index can look up
+MIN_LITERAL_LENGTH = 3
+
+_RE2_OPTIONS = re2.Options()
+_RE2_OPTIONS.log_errors = False
+_RE2_OPTIONS.never_capture = True
+
+_REPEATS = {
+    sre_parse.MAX_REPEAT,
+    sre_parse.MIN_REPEAT,
+    getattr(sre_parse, "POSSESSIVE_REPEAT", sre_parse.MAX_REPEAT),
+}
+
+
+def substring_query(text):
+    """
+    Returns an FTS5 query for code containing `text`, or None if it is too short
+    to look up in the index.
+    """
+    if len(text) < MIN_LITERAL_LENGTH:
+        return None
+    return _quote(text)
+
+
+@functools.lru_cache(maxsize=256)
+def regex_query(pattern):
+    """
+    Returns an FTS5 query for code containing the strings that every match of
+    `pattern` contains, or None if there aren't any long enough to look up.
+    The query finds a superset of the matching code, ignoring case.
+    """
+    return _to_fts(_required(sre_parse.parse(pattern)))
+
+
+def supported(pattern):
+    """
+    Whether `pattern` is a regular expression that can be searched for, which
+    rules out ones RE2 can't run in linear time, like backreferences and
+    lookarounds.
+    """
+    try:
+        sre_parse.parse(pattern)
+        _compile(pattern)
+    except (re.error, re2.error):
+        return False
+    return True
+
+
+def regexp(pattern, text):
+    """Implements SQLite's `text REGEXP pattern` operator."""
+    return text is not None and _compile(pattern).search(text) is not None
+
+
+@functools.lru_cache(maxsize=256)
+def _compile(pattern):
+    return re2.compile(pattern, _RE2_OPTIONS)
+
+
+def _required(items):
+    """
+    Returns what every match of a parsed regular expression contains: strings,
+    and lists of alternatives that each contain their own requirements.
+    """
+    required = []
+    run = []
+
+    def end_run():
+        if len(run) >= MIN_LITERAL_LENGTH:
+            required.append("".join(run))
+        run.clear()
+
+    for op, arg in items:
+        if op == sre_parse.LITERAL:
+            run.append(chr(arg))
+            continue
+
+        end_run()
+        if op == sre_parse.SUBPATTERN:
+            required += _required(arg[-1])
+        elif op == getattr(sre_parse, "ATOMIC_GROUP", None):
+            required += _required(arg)
+        elif op in _REPEATS and arg[0] >= 1:
+            required += _required(arg[2])
+        elif op == sre_parse.BRANCH:
+            branches = [_required(branch) for branch in arg[1]]
+            if all(branches):
+                required.append(branches)
+
+    end_run()
+    return required
+
+
+def _to_fts(required):
+    parts = []
+    for item in required:
+        if isinstance(item, str):
+            parts.append(_quote(item))
+        else:
+            parts.append("(" + " OR ".join(f"({_to_fts(b)})" for b in item) + ")")
+    return " AND ".join(parts) or None
+
+
+def _quote(text):
+    return '"' + text.replace('"', '""') + '"'
+
+
+## BENCHMARK ##
+
+_WORDS = (
+    "user data event list map value handler request response item index cache node "
+    "tree query result"
+).split()
+# Line templates and how common they are
+_LINES = [
+    (40, "const {a} = {b}.{c}({d});"),
+    (40, "def {a}_{b}({c}, {d}):"),
+    (40, "for (let i = 0; i < {a}.length; i++) {{"),
+    (40, "return {a}.{b}({c})"),
+    (40, "import {a} from './{b}';"),
+    (40, "    {a} = {b} + {c}"),
+    (40, "# {a} the {b} before {c}"),
+    (20, "SELECT {a} FROM {b} WHERE {c} = ?"),
+    (20, "if ({a} == null) throw new Error('{b}');"),
+    (2, "{a}.addEventListener('{b}', {c});"),
+    (1, "Map<String, {A}> {a} = new HashMap<>();"),
+    (1, "fetch({a}).then(({b}) => {b}.json())"),
+]
+BENCHMARK_QUERIES = [
+    ("substring", "addEventListener"),
+    ("substring", "cacheNodeHandler"),
+    ("regex", r"fetch\(\w+\)\.then"),
+    ("regex", r"def (tree|node)\w*_query\w*\("),
+    ("regex", r"HashMap<>|TreeMap<>"),
+]
+
+
+def _identifier(rng):
+    first, second = rng.sample(_WORDS, 2)
+    return first + second.title() + rng.choice(["", "", "Handler", "Id", "List"])
+
+
+def benchmark(count=100_000, seed=0):
+    """
+    Times each of `BENCHMARK_QUERIES` over `count` synthetic snippets, with a full
+    scan and with the trigram index. Returns a row per query of its kind, text,
+    number of matches, number of candidates from the index, and both timings in
+    milliseconds.
+    """
+    rng = random.Random(seed)
+    weights = [weight for weight, _ in _LINES]
+    templates = [template for _, template in _LINES]
+    db = sqlite3.connect(":memory:")
+    db.create_function("REGEXP", 2, regexp, deterministic=True)
+    db.execute("CREATE TABLE Snippet (ID INTEGER PRIMARY KEY, Code TEXT)")
+    db.executescript(INDEX_SQL)
+
+    rows = []
+    for _ in range(count):
+        lines = []
+        for template in rng.choices(templates, weights, k=rng.randint(5, 30)):
+            names = {key: _identifier(rng) for key in "abcd"}
+            names["A"] = names["a"].title()
+            lines.append(template.format(**names))
+        rows.append(["\n".join(lines)])
+    db.executemany("INSERT INTO Snippet (Code) VALUES (?)", rows)
+    db.commit()
+
+    results = []
+    for kind, text in BENCHMARK_QUERIES:
+        if kind == "substring":
+            scan = ("SELECT ID FROM Snippet WHERE instr(Code, ?) > 0", [text])
+            fts = substring_query(text)
+            check = "instr(Snippet.Code, ?) > 0"
+        else:
+            scan = ("SELECT ID FROM Snippet WHERE Code REGEXP ?", [text])
+            fts = regex_query(text)
+            check = "Snippet.Code REGEXP ?"
+
+        started = time.perf_counter()
+        matches = db.execute(*scan).fetchall()
+        scan_ms = (time.perf_counter() - started) * 1000
+
+        started = time.perf_counter()
+        indexed = db.execute(
+            f"""
+            SELECT Snippet.ID FROM SnippetCode
+            JOIN Snippet ON Snippet.ID = SnippetCode.rowid
+            WHERE SnippetCode MATCH ? AND {check}
+            """,
+            [fts, text],
+        ).fetchall()
+        index_ms = (time.perf_counter() - started) * 1000
+
+        candidates = db.execute(
+            "SELECT COUNT(*) FROM SnippetCode WHERE SnippetCode MATCH ?", [fts]
+        ).fetchone()[0]
+        assert sorted(indexed) == sorted(matches), f"Index missed matches for {text}"
+        results.append((kind, text, len(matches), candidates, scan_ms, index_ms))
+
+    db.close()
+    return results
@@ -0,0 +1,156 @@
+"""
+Splits snippet code into the identifiers it uses, for symbol search.
+
+Each snippet's language is picked from its tags, and a small lexer for that
+language skips comments, strings and keywords, so searching for `HashMap` finds
+code that uses it rather than code that mentions it in a comment. Snippets with
+no recognised language are lexed with the rules most languages share.
+"""
+
+import collections
+import keyword
+import re
+
+# Shortest identifier worth indexing, leaving out loop counters and the like
+MIN_SYMBOL_LENGTH = 2
+
+_NUMBER = r"\d[\w.]*"
+_IDENTIFIER = r"[A-Za-z_]\w*"
+_C_COMMENTS = [r"//[^\n]*", r"/\*(?s:.*?)(?:\*/|\Z)"]
+_HASH_COMMENT = r"#[^\n]*"
+_QUOTED = [r'"(?:\\.|[^"\\\n])*"', r"'(?:\\.|[^'\\\n])*'"]
+_BACKTICKS = r"`(?:\\.|[^`\\])*`"
+
+_C_KEYWORDS = """
+    abstract as async auto await bool boolean break byte case catch chan char class
+    const continue crate def default defer delete do double dyn else enum export
+    extends extern false final finally float fn for func function go goto if impl
+    implements import in instanceof int interface let long loop match mod
+    module mut namespace new nil null of override package private protected pub
+    public ref return select self short signed sizeof static struct
+    super switch synchronized template this throw throws trait true try type
+    typedef typename typeof uint unsafe unsigned use using var virtual void
+    volatile where while yield
+""".split()
+_SQL_KEYWORDS = """
+    add all alter and as asc begin between by case check commit constraint count
+    create default delete desc distinct drop else end exists foreign from full group
+    having if in index inner insert integer into is join key left like limit not
+    null offset on or order outer primary real references right rollback select set
+    table text then union unique update values varchar view when where with
+""".split()
+
+# How each family of languages writes comments, strings and identifiers
+_LEXERS = {
+    "c": (_C_COMMENTS + _QUOTED + [_BACKTICKS], _IDENTIFIER, _C_KEYWORDS),
+    "javascript": (
+        _C_COMMENTS + _QUOTED + [_BACKTICKS],
+        r"[A-Za-z_$][\w$]*",
+        _C_KEYWORDS,
+    ),
+    "rust": (
+        # Lifetimes like 'a look like unclosed character literals
+        _C_COMMENTS + [_QUOTED[0], r"'(?:\\.|[^'\\\n])'", r"'\w+"],
+        _IDENTIFIER,
+        _C_KEYWORDS,
+    ),
+    "php": (_C_COMMENTS + [_HASH_COMMENT] + _QUOTED, _IDENTIFIER, _C_KEYWORDS),
+    "python": (
+        [
+            _HASH_COMMENT,
+            r'[rRbBuUfF]{0,2}"""(?s:.*?)(?:"""|\Z)',
+            r"[rRbBuUfF]{0,2}'''(?s:.*?)(?:'''|\Z)",
+        ]
+        + [r"[rRbBuUfF]{0,2}" + quoted for quoted in _QUOTED],
+        _IDENTIFIER,
+        keyword.kwlist + ["self", "cls"],
+    ),
+    "hash": ([_HASH_COMMENT] + _QUOTED, _IDENTIFIER, _C_KEYWORDS),
+    "sql": (
+        [r"--[^\n]*", _C_COMMENTS[1], r"'(?:''|[^'])*'"],
+        _IDENTIFIER,
+        _SQL_KEYWORDS,
+    ),
+    "css": (
+        [_C_COMMENTS[1], r"<!--(?s:.*?)(?:-->|\Z)", r"#[\da-fA-F]{3,8}\b"] + _QUOTED,
+        r"[A-Za-z_][\w-]*",
+        [],
+    ),
+    "default": (
+        _C_COMMENTS + [_HASH_COMMENT] + _QUOTED + [_BACKTICKS],
+        _IDENTIFIER,
+        _C_KEYWORDS + keyword.kwlist,
+    ),
+}
+
+# Lowercased tags naming a language or a framework for one, and their lexer
+LANGUAGES = {
+    **dict.fromkeys(
+        """
+        c c++ c# java go golang swift kotlin scala dart objective-c groovy zig d
+        solidity cuda opengl opencl qt android spring spring-boot spring-framework
+        hibernate ios xcode swiftui flutter .net asp.net asp.net-core blazor
+        """.split(),
+        "c",
+    ),
+    **dict.fromkeys(
+        """
+        javascript typescript node.js react jquery express angular angularjs next.js
+        vue.js nuxt.js svelte nestjs deno electron react-native
+        """.split(),
+        "javascript",
+    ),
+    "rust": "rust",
+    **dict.fromkeys("php laravel wordpress symfon drupal codeigniter".split(), "php"),
+    **dict.fromkeys(
+        """
+        python django flask fastapi numpy pandas tensorflow keras scikit-learn
+        torch/pytorch jax machinelearning datascience opencv
+        """.split(),
+        "python",
+    ),
+    **dict.fromkeys(
+        "r ruby ruby-on-rails perl bash shell powershell julia elixir crystal".split(),
+        "hash",
+    ),
+    **dict.fromkeys(
+        "sql postgresql mysql sqlite mariadb microsoft-sql-server oracle duckdb".split(),
+        "sql",
+    ),
+    **dict.fromkeys("html css html/css sass tailwind bootstrap".split(), "css"),
+}
+
+
+def _compile(skipped, identifier, keywords):
+    pattern = "|".join(f"(?:{part})" for part in skipped + [_NUMBER])
+    keywords = frozenset(word.lower() for word in keywords)
+    return re.compile(f"{pattern}|({identifier})"), keywords
+
+
+_COMPILED = {name: _compile(*lexer) for name, lexer in _LEXERS.items()}
+
+
+def language(tags):
+    """Returns the lexer for the first tag naming a language, or "default"."""
+    for tag in tags or []:
+        name = LANGUAGES.get(tag.strip().lower())
+        if name is not None:
+            return name
+    return "default"
+
+
+def symbols(code, tags=None):
+    """
+    Counts the identifiers used in `code`, lowercased, leaving out comments,
+    strings and the keywords of the language its tags name.
+    """
+    pattern, keywords = _COMPILED[language(tags)]
+    counts = collections.Counter()
+    for match in pattern.finditer(code or ""):
+        symbol = match.group(1)
+        if symbol is None or len(symbol) < MIN_SYMBOL_LENGTH:
+            continue
+        symbol = symbol.lower()
+        if symbol not in keywords:
+            counts[symbol] += 1
+    return counts
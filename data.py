@@ -2,12 +2,29 @@
 Defines the application's databases.
 """
 
+import access
+import base64
+import json
 import random
 import sqlite3
 import sqlite_vec
+import string
+import tag_dictionary
 import os
 import csv
+import datetime
 import uuid  # For generating unique shareable links
+import cache
+import code_search
+import code_symbols
+import functools
+import fuzzy
+import contextlib
+import queue
+import re
+import search_query
+import threading
+import time
 import mock_data
 
 preset_tags: list[str] = []
@@ -19,6 +36,713 @@ preset_tags.sort()
 
 _desc_transformer = None
 
+# Number of snippets precomputed for each user's "for you" feed
+RECOMMENDATION_COUNT = 10
+
+# Top-level comments shown on each page of a snippet's comments
+COMMENT_PAGE_SIZE = 20
+
+# Largest k accepted by a sqlite-vec KNN query
+_MAX_KNN = 4096
+
+# Homepage listings that look the same to every viewer, shared between requests
+POPULAR_CACHE_SECONDS = 60
+_popular_cache = cache.TTLCache(max_size=1, ttl=POPULAR_CACHE_SECONDS)
+
+
+def invalidate_popular():
+    """Drops the cached homepage listings so that the next request rebuilds them."""
+    _popular_cache.clear()
+
+
+# Signed-in users loaded by auth, keyed by their session ID string
+SESSION_USER_CACHE_SECONDS = 30
+SESSION_USER_CACHE_SIZE = 1024
+session_users = cache.TTLCache(
+    max_size=SESSION_USER_CACHE_SIZE, ttl=SESSION_USER_CACHE_SECONDS
+)
+
+
+# Largest code preview stored with each snippet and sent by listings in place of
+# its code, which is fetched from /snippet/<id>/code when a card is opened
+CODE_PREVIEW_CHARS = 300
+CODE_PREVIEW_LINES = 10
+
+
+def code_preview(code):
+    """
+    Returns the start of a snippet's code, cut to at most `CODE_PREVIEW_LINES` lines
+    and `CODE_PREVIEW_CHARS` characters, and whether anything was cut off.
+    """
+    code = code or ""
+    preview = "\n".join(code.split("\n", CODE_PREVIEW_LINES)[:CODE_PREVIEW_LINES])
+    preview = preview[:CODE_PREVIEW_CHARS]
+    return preview, len(preview) < len(code)
+
+
+def compact_listings(sections):
+    """
+    Packs snippet listings into the compact (version 2) response format.
+
+    `sections` maps names like "snippets" to lists of snippets as returned by
+    `Data`; any other value is passed through unchanged. Each snippet is sent once,
+    without its author or full code, no matter how many sections list it:
+
+    - "version": Always 2.
+    - "authors": Author user details keyed by user ID.
+    - "snippets_by_id": Snippets keyed by ID, with "code_preview" and
+      "code_truncated" in place of any "code".
+    - Every section in `sections`, with snippets replaced by their IDs.
+    """
+    authors = {}
+    snippets_by_id = {}
+    compact = {"version": 2, "authors": authors, "snippets_by_id": snippets_by_id}
+
+    for name, listing in sections.items():
+        if not (listing and isinstance(listing[0], dict) and "user_id" in listing[0]):
+            compact[name] = listing
+            continue
+
+        for snippet in listing:
+            if snippet["id"] in snippets_by_id:
+                continue
+            entry = {
+                key: value
+                for key, value in snippet.items()
+                if key not in ("code", "author")
+            }
+            if "code" in snippet:
+                entry["code_preview"], entry["code_truncated"] = code_preview(
+                    snippet["code"]
+                )
+            snippets_by_id[snippet["id"]] = entry
+            if snippet.get("author") is not None:
+                authors[snippet["user_id"]] = snippet["author"]
+        compact[name] = [snippet["id"] for snippet in listing]
+
+    return compact
+
+
+# Idle connections kept open for queries run on worker threads, one for each of
+# the app's search workers
+CONNECTION_POOL_SIZE = 8
+_idle_connections = queue.LifoQueue(maxsize=CONNECTION_POOL_SIZE)
+
+
+@contextlib.contextmanager
+def pooled():
+    """
+    Lends out a `Data` connection for the length of a `with` block, opening a new
+    one if none are idle. Lookups it remembered are forgotten when it is returned.
+    """
+    try:
+        db = _idle_connections.get_nowait()
+    except queue.Empty:
+        db = Data()
+
+    try:
+        yield db
+    finally:
+        db._db.rollback()
+        db.clear_identity_maps()
+        try:
+            _idle_connections.put_nowait(db)
+        except queue.Full:
+            db.close()
+
+
+# Every snippet matching a page's last search, so that searches narrowing it down
+# only need to check those snippets. Keyed by the page's search session ID.
+SEARCH_STATE_SECONDS = 60
+SEARCH_STATE_CACHE_SIZE = 1024
+SEARCH_STATE_MAX_IDS = 5000
+search_states = cache.TTLCache(
+    max_size=SEARCH_STATE_CACHE_SIZE, ttl=SEARCH_STATE_SECONDS
+)
+
+# SQLite's LOWER() and LIKE only fold ASCII letters
+_SQL_CASE_FOLD = str.maketrans(string.ascii_uppercase, string.ascii_lowercase)
+
+# Lowercased user names and tag names, used to resolve search filters in memory.
+# Maps "profiles" and "snippets" to the version they were loaded at and the names.
+_search_vocabulary = {}
+
+# In-memory indexes of names, built at startup and updated as they change:
+# - "tags", "users" and "names": Typo-tolerant indexes of tags (preset and on
+#   public snippets), usernames and the words in public snippet names.
+# - "tag_dictionary": Preset and public tags with how many snippets use them.
+# - "snippets": Each indexed snippet's ID mapped to its words and tags.
+_word_indexes = {}
+
+# Which snippets each user can see, shared by every connection. Each request
+# brings it up to date with AccessChange once, before its first access check.
+_access_index = access.AccessIndex()
+_access_lock = threading.Lock()
+
+# Most tags suggested for a search or while tagging a snippet
+TAG_SUGGESTION_LIMIT = 20
+_word_lock = threading.Lock()
+
+
+def _name_words(name):
+    """Returns the words in a snippet name worth correcting typos in."""
+    return re.findall(r"[^\W\d_]{3,}", name or "")
+
+
+def _index_public_snippet(snippet_id, name, tags):
+    """Adds a public snippet to the in-memory indexes. Needs `_word_lock`."""
+    words = _name_words(name)
+    for word in words:
+        _word_indexes["names"].add(word)
+    for tag in tags:
+        _word_indexes["tags"].add(tag)
+        _word_indexes["tag_dictionary"].add(tag)
+    _word_indexes["snippets"][snippet_id] = (words, tags)
+
+
+def _unindex_public_snippet(snippet_id):
+    """Removes a snippet from the in-memory indexes. Needs `_word_lock`."""
+    words, tags = _word_indexes["snippets"].pop(snippet_id, ((), ()))
+    for word in words:
+        _word_indexes["names"].remove(word)
+    for tag in tags:
+        _word_indexes["tags"].remove(tag)
+        _word_indexes["tag_dictionary"].remove(tag)
+
+
+def _update_indexed_users(added=None, removed=None):
+    """Adds or removes a username in the in-memory indexes, if they're built."""
+    with _word_lock:
+        if not _word_indexes:
+            return
+        if added is not None:
+            _word_indexes["users"].add(added)
+        if removed is not None:
+            _word_indexes["users"].remove(removed)
+
+
+def _fold_search_value(kind, value):
+    """Folds the case of a search atom's value if it is matched case-insensitively."""
+    if kind in ("code", "regex"):
+        return value
+    return value.translate(_SQL_CASE_FOLD)
+
+
+def _implies(atom, other):
+    """Whether every snippet matching one search atom also matches `other`."""
+    if atom[0] != other[0]:
+        return False
+    if atom[0] in ("term", "code"):
+        return other[1] in atom[1]
+    return atom[1] == other[1]
+
+
+def _narrows(search, previous):
+    """Whether every snippet matching one search state also matches `previous`."""
+    return (
+        search["versions"] == previous["versions"]
+        and search["viewer_id"] == previous["viewer_id"]
+        and search["public"] == previous["public"]
+        # Each old clause is implied by a new clause all of whose alternatives
+        # imply one of the old clause's alternatives
+        and all(
+            any(
+                all(any(_implies(atom, old) for old in old_clause) for atom in clause)
+                for clause in search["clauses"]
+            )
+            for old_clause in previous["clauses"]
+        )
+    )
+
+
+# Conditions for each kind of search atom, with "{0}", "{1}"... standing in for
+# the numbers of its parameters
+_SEARCH_ATOMS = {
+    "term": """
+        (LOWER(Snippet.Name) LIKE ?{0} OR LOWER(Snippet.Description) LIKE ?{0})
+    """,
+    "tag": """
+        Snippet.ID IN (
+            SELECT TagUse.SnippetID FROM Tag JOIN TagUse ON TagUse.TagID = Tag.ID
+            WHERE Tag.NameNorm IN (SELECT value FROM json_each(?{0}))
+        )
+    """,
+    "exclude": """
+        Snippet.ID NOT IN (
+            SELECT TagUse.SnippetID FROM Tag JOIN TagUse ON TagUse.TagID = Tag.ID
+            WHERE Tag.NameNorm IN (SELECT value FROM json_each(?{0}))
+        )
+    """,
+    "user": "Snippet.UserID IN (SELECT value FROM json_each(?{0}))",
+    # Code is narrowed down with its trigram index, then checked exactly
+    "code": """
+        (Snippet.ID IN (SELECT rowid FROM SnippetCode WHERE SnippetCode MATCH ?{1})
+            AND instr(Snippet.Code, ?{0}) > 0)
+    """,
+    "code_scan": "instr(Snippet.Code, ?{0}) > 0",
+    "regex": """
+        (Snippet.ID IN (SELECT rowid FROM SnippetCode WHERE SnippetCode MATCH ?{1})
+            AND Snippet.Code REGEXP ?{0})
+    """,
+    "regex_scan": "Snippet.Code REGEXP ?{0}",
+    "symbol": """
+        Snippet.ID IN (SELECT SnippetID FROM SnippetSymbol WHERE Symbol = ?{0})
+    """,
+}
+
+SEARCH_PLAN_CACHE_SIZE = 256
+
+# Snippets in each page of search results or of a user's snippets
+SNIPPET_PAGE_SIZE = 50
+
+# Orders snippet listings can be sorted in, as the columns each is sorted by, all
+# descending. Each ends with the ID, so every snippet has its own place to resume
+# from, and has an index so that any page is read straight off it.
+SNIPPET_SORTS = {
+    "newest": ("Snippet.Date", "Snippet.ID"),
+    "liked": ("Snippet.LikeCount", "Snippet.Date", "Snippet.ID"),
+    "remixed": ("Snippet.RemixCount", "Snippet.Date", "Snippet.ID"),
+}
+# Search results can also be sorted by relevance: by how often snippets use the
+# symbols searched for, weighted by their likes, then as "liked"
+SEARCH_SORTS = ("relevance", *SNIPPET_SORTS)
+
+# Indexes for each order in SNIPPET_SORTS, and the triggers keeping the counts in
+# Snippet that they sort by current
+_LISTING_SQL = """
+    CREATE INDEX IF NOT EXISTS SnippetNewest ON Snippet(Date);
+    CREATE INDEX IF NOT EXISTS SnippetLiked ON Snippet(LikeCount, Date);
+    CREATE INDEX IF NOT EXISTS SnippetRemixed ON Snippet(RemixCount, Date);
+    CREATE INDEX IF NOT EXISTS SnippetUserNewest ON Snippet(UserID, Date);
+    CREATE INDEX IF NOT EXISTS SnippetUserLiked ON Snippet(UserID, LikeCount, Date);
+    CREATE INDEX IF NOT EXISTS SnippetUserRemixed ON Snippet(UserID, RemixCount, Date);
+    CREATE TRIGGER IF NOT EXISTS LikeCountInsert AFTER INSERT ON Like BEGIN
+        UPDATE Snippet SET LikeCount = LikeCount + 1 WHERE ID = NEW.SnippetID;
+    END;
+    CREATE TRIGGER IF NOT EXISTS LikeCountDelete AFTER DELETE ON Like BEGIN
+        UPDATE Snippet SET LikeCount = LikeCount - 1 WHERE ID = OLD.SnippetID;
+    END;
+    CREATE TRIGGER IF NOT EXISTS RemixCountInsert AFTER INSERT ON Snippet
+    WHEN NEW.ParentSnippetID IS NOT NULL BEGIN
+        UPDATE Snippet SET RemixCount = RemixCount + 1 WHERE ID = NEW.ParentSnippetID;
+    END;
+    CREATE TRIGGER IF NOT EXISTS RemixCountDelete AFTER DELETE ON Snippet
+    WHEN OLD.ParentSnippetID IS NOT NULL BEGIN
+        UPDATE Snippet SET RemixCount = RemixCount - 1 WHERE ID = OLD.ParentSnippetID;
+    END;
+    CREATE TRIGGER IF NOT EXISTS RemixCountUpdate AFTER UPDATE OF ParentSnippetID ON Snippet
+    WHEN OLD.ParentSnippetID IS NOT NEW.ParentSnippetID BEGIN
+        UPDATE Snippet SET RemixCount = RemixCount - 1 WHERE ID = OLD.ParentSnippetID;
+        UPDATE Snippet SET RemixCount = RemixCount + 1 WHERE ID = NEW.ParentSnippetID;
+    END;
+"""
+
+# Fills in the counts for snippets made before Snippet kept them
+_COUNT_SQL = """
+    UPDATE Snippet SET
+        LikeCount = (SELECT COUNT(*) FROM Like WHERE Like.SnippetID = Snippet.ID),
+        RemixCount = (
+            SELECT COUNT(*) FROM Snippet AS Remix WHERE Remix.ParentSnippetID = Snippet.ID
+        )
+"""
+
+# Snippet.Date is stored as seconds since the Unix epoch
+_NOW_SQL = "CAST(strftime('%s', 'now') AS INTEGER)"
+
+
+def _date_text(timestamp):
+    """Formats a Snippet.Date like SQLite's datetime(), as pages show dates."""
+    if timestamp is None:
+        return None
+    return datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc).strftime(
+        "%Y-%m-%d %H:%M:%S"
+    )
+
+
+# Tables linking snippets to tags, likes and permitted users. Tag names are kept
+# once each in Tag, and the link tables are keyed by their pair of IDs alone,
+# without a separate rowid.
+_LINK_TABLES_SQL = """
+    CREATE TABLE IF NOT EXISTS Tag (
+        ID INTEGER PRIMARY KEY,
+        Name TEXT NOT NULL,             -- Spelling of the tag's first use
+        NameNorm TEXT NOT NULL UNIQUE   -- lower(Name), for finding it ignoring case
+    );
+    CREATE TABLE IF NOT EXISTS TagUse (
+        SnippetID INTEGER NOT NULL,
+        TagID INTEGER NOT NULL,
+        PRIMARY KEY (SnippetID, TagID),
+        FOREIGN KEY (SnippetID) REFERENCES Snippet(ID) ON DELETE CASCADE,
+        FOREIGN KEY (TagID) REFERENCES Tag(ID)
+    ) WITHOUT ROWID;
+    CREATE INDEX IF NOT EXISTS TagUseTag ON TagUse(TagID);
+    CREATE TABLE IF NOT EXISTS Like (
+        SnippetID INTEGER NOT NULL,
+        UserID INTEGER NOT NULL,
+        PRIMARY KEY (SnippetID, UserID),
+        FOREIGN KEY (SnippetID) REFERENCES Snippet(ID) ON DELETE CASCADE,
+        FOREIGN KEY (UserID) REFERENCES User(ID) ON DELETE CASCADE
+    ) WITHOUT ROWID;
+    CREATE INDEX IF NOT EXISTS LikeUser ON Like(UserID);
+    CREATE TABLE IF NOT EXISTS SnippetPermissions (
+        SnippetID INTEGER NOT NULL,
+        UserID INTEGER NOT NULL,
+        PRIMARY KEY (SnippetID, UserID),
+        FOREIGN KEY (SnippetID) REFERENCES Snippet(ID) ON DELETE CASCADE,
+        FOREIGN KEY (UserID) REFERENCES User(ID) ON DELETE CASCADE
+    ) WITHOUT ROWID;
+    CREATE INDEX IF NOT EXISTS SnippetPermissionsUser ON SnippetPermissions(UserID);
+"""
+
+# Moves a database from the first storage layout, with tag names repeated in
+# TagUse, rowid link tables and text dates, to the current one. It runs in one
+# transaction, so other connections see either layout but never a mix of both.
+# Triggers on the old tables are dropped with them, and recreated afterwards.
+_STORAGE_V2_SQL = f"""
+    PRAGMA foreign_keys = 0;
+    BEGIN;
+    DROP TRIGGER IF EXISTS TagStatsTagUseInsert;
+    DROP TRIGGER IF EXISTS TagStatsTagUseDelete;
+    DROP TRIGGER IF EXISTS TagStatsSnippetDelete;
+    DROP TRIGGER IF EXISTS TagStatsSnippetVisibility;
+    DROP TRIGGER IF EXISTS TagStatsSnippetOwner;
+    DROP TABLE IF EXISTS TagStats;
+    ALTER TABLE TagUse RENAME TO TagUseV1;
+    ALTER TABLE Like RENAME TO LikeV1;
+    ALTER TABLE SnippetPermissions RENAME TO SnippetPermissionsV1;
+    {_LINK_TABLES_SQL}
+    INSERT OR IGNORE INTO Tag (Name, NameNorm)
+    SELECT TagName, lower(TagName) FROM TagUseV1 ORDER BY rowid;
+    INSERT OR IGNORE INTO TagUse (SnippetID, TagID)
+    SELECT TagUseV1.SnippetID, Tag.ID
+    FROM TagUseV1 JOIN Tag ON Tag.NameNorm = lower(TagUseV1.TagName);
+    INSERT OR IGNORE INTO Like (SnippetID, UserID) SELECT SnippetID, UserID FROM LikeV1;
+    INSERT OR IGNORE INTO SnippetPermissions (SnippetID, UserID)
+    SELECT SnippetID, UserID FROM SnippetPermissionsV1
+    WHERE SnippetID IS NOT NULL AND UserID IS NOT NULL;
+    DROP TABLE TagUseV1;
+    DROP TABLE LikeV1;
+    DROP TABLE SnippetPermissionsV1;
+    UPDATE Snippet SET Date = CAST(strftime('%s', Date) AS INTEGER)
+    WHERE typeof(Date) = 'text';
+    COMMIT;
+    PRAGMA foreign_keys = 1;
+"""
+
+# Trending snippets are ranked like Hacker News stories: likes besides the
+# author's own, divided by the snippet's age in hours plus two, raised to
+# TRENDING_GRAVITY. A snippet's score is recomputed whenever it gains or loses
+# a like, and every liked snippet's is by refresh_trending, run in the background
+# by start_trending_refresh, so that the ones nobody has liked lately sink. Each
+# user's score is the sum of their public snippets', kept current by triggers.
+TRENDING_GRAVITY = 1.8
+TRENDING_REFRESH_SECONDS = 15 * 60
+_HOT_SCORE_SQL = f"""
+    (LikeCount - EXISTS (
+        SELECT 1 FROM Like WHERE SnippetID = Snippet.ID AND UserID = Snippet.UserID
+    )) / pow(
+        max({_NOW_SQL} - coalesce(Date, {_NOW_SQL}), 0) / 3600.0 + 2,
+        {TRENDING_GRAVITY}
+    )
+"""
+_TRENDING_SQL = f"""
+    CREATE INDEX IF NOT EXISTS SnippetTrending
+    ON Snippet(HotScore, LikeCount, Date) WHERE IsPublic = 1;
+    CREATE INDEX IF NOT EXISTS UserTrending ON User(HotScore DESC, Name);
+    CREATE TRIGGER IF NOT EXISTS HotScoreLike AFTER UPDATE OF LikeCount ON Snippet
+    BEGIN
+        UPDATE Snippet SET HotScore = {_HOT_SCORE_SQL} WHERE ID = NEW.ID;
+    END;
+    CREATE TRIGGER IF NOT EXISTS UserHotScoreUpdate
+    AFTER UPDATE OF HotScore, IsPublic, UserID ON Snippet
+    WHEN OLD.HotScore IS NOT NEW.HotScore OR OLD.IsPublic IS NOT NEW.IsPublic
+        OR OLD.UserID IS NOT NEW.UserID
+    BEGIN
+        UPDATE User SET HotScore = HotScore - OLD.HotScore
+        WHERE ID = OLD.UserID AND OLD.IsPublic = 1;
+        UPDATE User SET HotScore = HotScore + NEW.HotScore
+        WHERE ID = NEW.UserID AND NEW.IsPublic = 1;
+    END;
+    CREATE TRIGGER IF NOT EXISTS UserHotScoreDelete AFTER DELETE ON Snippet
+    WHEN OLD.IsPublic = 1 AND OLD.HotScore != 0 BEGIN
+        UPDATE User SET HotScore = HotScore - OLD.HotScore WHERE ID = OLD.UserID;
+    END;
+"""
+
+# Decays every liked snippet's score to the current time, and sums the scores
+# of users with any afresh, undoing any rounding the triggers' running totals
+# have built up
+_TRENDING_REFRESH_SQL = f"""
+    UPDATE Snippet SET HotScore = {_HOT_SCORE_SQL} WHERE HotScore != 0;
+    UPDATE User SET HotScore = (
+        SELECT total(HotScore) FROM Snippet
+        WHERE Snippet.UserID = User.ID AND Snippet.IsPublic = 1
+    )
+    WHERE HotScore != 0 OR ID IN (
+        SELECT UserID FROM Snippet WHERE HotScore != 0 AND IsPublic = 1
+    );
+"""
+# Computes every snippet's score from scratch
+_TRENDING_REBUILD_SQL = f"""
+    UPDATE Snippet SET HotScore = {_HOT_SCORE_SQL} WHERE LikeCount > 0;
+    {_TRENDING_REFRESH_SQL}
+"""
+
+
+# Every remix's ancestors, as a closure table: a row for each snippet and each
+# snippet it was remixed from however indirectly, and for each snippet and
+# itself, with how many remixes apart they are. Triggers keep it current as
+# snippets are made, deleted or given a new parent.
+_LINEAGE_SQL = """
+    CREATE TABLE IF NOT EXISTS SnippetLineage (
+        AncestorID INTEGER NOT NULL,
+        DescendantID INTEGER NOT NULL,
+        Depth INTEGER NOT NULL,     -- 0 for a snippet and itself, 1 for a parent
+        PRIMARY KEY (AncestorID, DescendantID)
+    ) WITHOUT ROWID;
+    CREATE INDEX IF NOT EXISTS SnippetLineageDescendant
+    ON SnippetLineage(DescendantID, Depth);
+    CREATE TRIGGER IF NOT EXISTS LineageInsert AFTER INSERT ON Snippet BEGIN
+        INSERT INTO SnippetLineage (AncestorID, DescendantID, Depth)
+        SELECT AncestorID, NEW.ID, Depth + 1 FROM SnippetLineage
+        WHERE DescendantID = NEW.ParentSnippetID
+        UNION ALL
+        SELECT NEW.ID, NEW.ID, 0;
+    END;
+    CREATE TRIGGER IF NOT EXISTS LineageDelete AFTER DELETE ON Snippet BEGIN
+        DELETE FROM SnippetLineage WHERE AncestorID = OLD.ID;
+        DELETE FROM SnippetLineage WHERE DescendantID = OLD.ID;
+    END;
+    CREATE TRIGGER IF NOT EXISTS LineageUpdate AFTER UPDATE OF ParentSnippetID ON Snippet
+    WHEN OLD.ParentSnippetID IS NOT NEW.ParentSnippetID BEGIN
+        -- Detach the snippet and its remixes from everything above it
+        DELETE FROM SnippetLineage
+        WHERE DescendantID IN (
+            SELECT DescendantID FROM SnippetLineage WHERE AncestorID = NEW.ID
+        )
+        AND AncestorID NOT IN (
+            SELECT DescendantID FROM SnippetLineage WHERE AncestorID = NEW.ID
+        );
+        INSERT INTO SnippetLineage (AncestorID, DescendantID, Depth)
+        SELECT Above.AncestorID, Below.DescendantID, Above.Depth + Below.Depth + 1
+        FROM SnippetLineage AS Above, SnippetLineage AS Below
+        WHERE Above.DescendantID = NEW.ParentSnippetID AND Below.AncestorID = NEW.ID;
+    END;
+"""
+
+# Fills the closure table from scratch
+_LINEAGE_REBUILD_SQL = """
+    INSERT INTO SnippetLineage (AncestorID, DescendantID, Depth)
+    WITH RECURSIVE Lineage(AncestorID, DescendantID, Depth) AS (
+        SELECT ID, ID, 0 FROM Snippet
+        UNION ALL
+        SELECT Lineage.AncestorID, Snippet.ID, Lineage.Depth + 1
+        FROM Lineage
+        JOIN Snippet ON Snippet.ParentSnippetID = Lineage.DescendantID
+    )
+    SELECT * FROM Lineage
+"""
+
+# Changes to who can see snippets are logged for the in-memory access index to
+# catch up with, whichever process made them. Only the latest ACCESS_LOG_SIZE
+# changes are kept; an index further behind than that is rebuilt instead.
+ACCESS_LOG_SIZE = 10_000
+_ACCESS_SQL = f"""
+    CREATE TABLE IF NOT EXISTS AccessChange (
+        ID INTEGER PRIMARY KEY AUTOINCREMENT,
+        SnippetID INTEGER NOT NULL
+    );
+    CREATE TRIGGER IF NOT EXISTS AccessChangePrune AFTER INSERT ON AccessChange
+    BEGIN
+        DELETE FROM AccessChange WHERE ID <= NEW.ID - {ACCESS_LOG_SIZE};
+    END;
+    CREATE TRIGGER IF NOT EXISTS AccessSnippetInsert AFTER INSERT ON Snippet BEGIN
+        INSERT INTO AccessChange (SnippetID) VALUES (NEW.ID);
+    END;
+    CREATE TRIGGER IF NOT EXISTS AccessSnippetDelete AFTER DELETE ON Snippet BEGIN
+        INSERT INTO AccessChange (SnippetID) VALUES (OLD.ID);
+    END;
+    CREATE TRIGGER IF NOT EXISTS AccessSnippetUpdate
+    AFTER UPDATE OF IsPublic, UserID ON Snippet
+    WHEN OLD.IsPublic IS NOT NEW.IsPublic OR OLD.UserID IS NOT NEW.UserID BEGIN
+        INSERT INTO AccessChange (SnippetID) VALUES (NEW.ID);
+    END;
+    CREATE TRIGGER IF NOT EXISTS AccessPermissionInsert
+    AFTER INSERT ON SnippetPermissions BEGIN
+        INSERT INTO AccessChange (SnippetID) VALUES (NEW.SnippetID);
+    END;
+    CREATE TRIGGER IF NOT EXISTS AccessPermissionDelete
+    AFTER DELETE ON SnippetPermissions BEGIN
+        INSERT INTO AccessChange (SnippetID) VALUES (OLD.SnippetID);
+    END;
+"""
+
+
+def _sort_columns(sort, symbols=False):
+    """
+    Returns the columns a listing in `sort` order is sorted by. Searches sorted by
+    relevance for symbols sort by a "symbol_rank" result column first.
+    """
+    if sort not in SEARCH_SORTS:
+        raise ValueError(f"Unknown sort order {sort!r}")
+    columns = SNIPPET_SORTS.get(sort, SNIPPET_SORTS["liked"])
+    if sort == "relevance" and symbols:
+        columns = ("symbol_rank",) + columns
+    return columns
+
+
+def _encode_cursor(sort, keys):
+    """Packs the sort keys of the last snippet on a page into an opaque cursor."""
+    text = json.dumps([sort, *keys], separators=(",", ":"))
+    return base64.urlsafe_b64encode(text.encode()).decode().rstrip("=")
+
+
+def _decode_cursor(cursor, sort, count=None):
+    """
+    Unpacks the `count` sort keys in a cursor from `_encode_cursor`, or however
+    many it has, raising ValueError if it isn't one for `sort`.
+    """
+    try:
+        keys = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except ValueError:
+        raise ValueError("Invalid cursor") from None
+    if (
+        not isinstance(keys, list)
+        or keys[:1] != [sort]
+        or len(keys) != (len(keys) if count is None else count + 1)
+        or any(isinstance(key, (list, dict)) for key in keys)
+    ):
+        raise ValueError("Invalid cursor")
+    return keys[1:]
+
+
+def is_cursor_for(cursor, sort, symbols=False):
+    """
+    Whether `cursor` came from a listing sorted in `sort` order, by symbol use
+    first if `symbols` is true, like `_sort_columns`.
+    """
+    try:
+        _decode_cursor(cursor, sort, len(_sort_columns(sort, symbols)))
+    except ValueError:
+        return False
+    return True
+
+
+def _after_sql(columns, number):
+    """
+    SQL for rows after a cursor in the order sorted by `columns`, with the
+    cursor's keys as parameters `number + 1` onwards.
+    """
+    keys = ", ".join(f"?{number + i + 1}" for i in range(len(columns)))
+    return f"({', '.join(columns)}) < ({keys})"
+
+
+@functools.lru_cache(maxsize=SEARCH_PLAN_CACHE_SIZE)
+def _search_plan(
+    shape,
+    public,
+    candidates,
+    ranked,
+    symbols=False,
+    sort="relevance",
+    after=False,
+    checked=False,
+):
+    """
+    Builds the SQL for every search with the same shape: the kinds of atoms in
+    each clause, whether it is limited to the viewer's own snippets, whether it is
+    limited to a JSON list of candidate IDs, whether it returns ranked rows or
+    just IDs, whether it ranks by how often snippets use a JSON list of symbols,
+    the order to sort them in, whether it starts after a cursor, and whether the
+    viewer's access was already checked in memory. Parameters are numbered in the
+    order the atoms appear, followed by the viewer's ID unless access was checked,
+    the candidates, the symbols, the cursor's keys and the most rows to return.
+
+    Ranked rows end with the columns they're sorted by, from `_sort_columns`.
+    """
+    conditions = []
+    number = 0
+    for clause in shape:
+        alternatives = []
+        for kind in clause:
+            template = _SEARCH_ATOMS[kind]
+            count = 2 if "{1}" in template else 1
+            numbers = range(number + 1, number + count + 1)
+            alternatives.append(template.format(*numbers))
+            number += count
+        conditions.append("(" + " OR ".join(alternatives) + ")")
+
+    # Access control filter (public/private visibility), unless already checked
+    if not checked:
+        number += 1
+        if public:
+            conditions.append(
+                f"""
+                (Snippet.IsPublic = 1 OR EXISTS (
+                    SELECT 1 FROM SnippetPermissions AS P
+                    WHERE P.SnippetID = Snippet.ID AND P.UserID = ?{number}
+                ))
+                """
+            )
+        else:
+            conditions.append(f"Snippet.UserID = ?{number}")
+
+    if candidates:
+        number += 1
+        conditions.append(f"Snippet.ID IN (SELECT value FROM json_each(?{number}))")
+
+    if not ranked:
+        return f"SELECT Snippet.ID FROM Snippet WHERE {' AND '.join(conditions)}"
+
+    columns = _sort_columns(sort, symbols)
+    selected = list(columns)
+    if symbols:
+        # Snippets using the symbols most come first, weighted by their likes
+        number += 1
+        selected[0] = f"""
+            COALESCE((SELECT SUM(Count) FROM SnippetSymbol
+                WHERE SnippetID = Snippet.ID
+                AND Symbol IN (SELECT value FROM json_each(?{number}))), 0)
+                * (Snippet.LikeCount + 1) AS symbol_rank
+        """
+    if after:
+        conditions.append(_after_sql(columns, number))
+        number += len(columns)
+
+    return f"""
+        SELECT Snippet.ID, Snippet.Name, Snippet.CodePreview, Snippet.Description,
+            Snippet.UserID, Snippet.ParentSnippetID, Snippet.Date, Snippet.IsPublic,
+            Snippet.CodeTruncated, Snippet.LikeCount, {", ".join(selected)}
+        FROM Snippet
+        WHERE {" AND ".join(conditions)}
+        ORDER BY {", ".join(column + " DESC" for column in columns)}
+        LIMIT ?{number + 1}
+    """
+
+
+def start_trending_refresh():
+    """
+    Refreshes trending scores now, then every TRENDING_REFRESH_SECONDS on a
+    background thread, so that no request waits for it.
+    """
+
+    def refresh():
+        while True:
+            try:
+                with pooled() as db:
+                    db.refresh_trending()
+            except sqlite3.OperationalError:
+                pass  # The database was busy, so try again next time
+            time.sleep(TRENDING_REFRESH_SECONDS)
+
+    threading.Thread(target=refresh, name="trending-refresh", daemon=True).start()
+
+
+def preload_word_indexes():
+    """Builds the in-memory indexes of names, so that no search waits for them."""
+    with pooled() as db:
+        db._get_word_indexes()
+
 
 def preload_transformer():
     global _desc_transformer
@@ -35,6 +759,338 @@ def _get_transformer():
     return _desc_transformer
 
 
+def _bump_version_sql(name):
+    """SQL that increments one of the counters in GlobalVersion."""
+    # Triggers inherit the outer statement's conflict policy, so avoid OR REPLACE
+    return f"""
+        INSERT INTO GlobalVersion (Name, Version, Modified)
+        SELECT '{name}', 0, datetime('now')
+        WHERE NOT EXISTS (SELECT 1 FROM GlobalVersion WHERE Name = '{name}');
+        UPDATE GlobalVersion
+        SET Version = Version + 1, Modified = datetime('now')
+        WHERE Name = '{name}';
+    """
+
+
+def _bump_user_version_sql(user_id):
+    """SQL that increments a user's counter in UserVersion, if `user_id` isn't NULL."""
+    return f"""
+        INSERT INTO UserVersion (UserID, Version, Modified)
+        SELECT {user_id}, 0, datetime('now')
+        WHERE {user_id} IS NOT NULL
+        AND NOT EXISTS (SELECT 1 FROM UserVersion WHERE UserID = {user_id});
+        UPDATE UserVersion
+        SET Version = Version + 1, Modified = datetime('now')
+        WHERE UserID = {user_id};
+    """
+
+
+def _bump_snippet_version_sql(snippet_id):
+    """
+    SQL that increments a snippet's counter in SnippetVersion and its owner's in
+    UserVersion, if the snippet exists.
+    """
+    owner = f"(SELECT UserID FROM Snippet WHERE ID = {snippet_id})"
+    return (
+        f"""
+        INSERT INTO SnippetVersion (SnippetID, Version, Modified)
+        SELECT ID, 0, datetime('now')
+        FROM Snippet
+        WHERE ID = {snippet_id}
+        AND NOT EXISTS (SELECT 1 FROM SnippetVersion WHERE SnippetID = {snippet_id});
+        UPDATE SnippetVersion
+        SET Version = Version + 1, Modified = datetime('now')
+        WHERE SnippetID = {snippet_id};
+        """
+        + _bump_user_version_sql(owner)
+        + _bump_version_sql("snippets")
+    )
+
+
+def _bump_snippet_versions_sql(ids):
+    """SQL that increments the counters in SnippetVersion of the snippets `ids` selects."""
+    return f"""
+        INSERT INTO SnippetVersion (SnippetID, Version, Modified)
+        SELECT ID, 0, datetime('now')
+        FROM Snippet
+        WHERE ID IN ({ids})
+        AND NOT EXISTS (SELECT 1 FROM SnippetVersion WHERE SnippetID = Snippet.ID);
+        UPDATE SnippetVersion
+        SET Version = Version + 1, Modified = datetime('now')
+        WHERE SnippetID IN ({ids});
+    """
+
+
+def _ancestors_sql(snippet_id, depth=0):
+    """SQL selecting a snippet's ancestors at least `depth` remixes up, itself at 0."""
+    return f"""
+        SELECT AncestorID FROM SnippetLineage
+        WHERE DescendantID = {snippet_id} AND Depth >= {depth}
+    """
+
+
+def _descendants_sql(snippet_id):
+    """SQL selecting a snippet's remixes at any depth."""
+    return f"""
+        SELECT DescendantID FROM SnippetLineage
+        WHERE AncestorID = {snippet_id} AND Depth > 0
+    """
+
+
+def _lineage_version_triggers():
+    """
+    Builds the version triggers for snippet pages showing other snippets: their
+    remix tree and how many remixes there are, and the ancestry breadcrumb. Only
+    rows of SnippetLineage that the triggers on Snippet leave alone are read, so
+    they don't depend on the order triggers fire in.
+    """
+    shown = " OR ".join(
+        f"OLD.{column} IS NOT NEW.{column}" for column in ["Name", "IsPublic", "UserID"]
+    )
+    related = _ancestors_sql("NEW.ID", 1) + " UNION " + _descendants_sql("NEW.ID")
+    triggers = [
+        (
+            "LineageInsert",
+            "INSERT ON Snippet WHEN NEW.ParentSnippetID IS NOT NULL",
+            _bump_snippet_versions_sql(_ancestors_sql("NEW.ParentSnippetID")),
+        ),
+        (
+            "LineageDelete",
+            "DELETE ON Snippet WHEN OLD.ParentSnippetID IS NOT NULL",
+            _bump_snippet_versions_sql(_ancestors_sql("OLD.ParentSnippetID")),
+        ),
+        (
+            "LineageMove",
+            "UPDATE OF ParentSnippetID ON Snippet"
+            " WHEN OLD.ParentSnippetID IS NOT NEW.ParentSnippetID",
+            _bump_snippet_versions_sql(
+                _ancestors_sql("OLD.ParentSnippetID")
+                + " UNION "
+                + _ancestors_sql("NEW.ParentSnippetID")
+                + " UNION "
+                + _descendants_sql("NEW.ID")
+            ),
+        ),
+        (
+            "LineageShown",
+            f"UPDATE OF Name, IsPublic, UserID ON Snippet WHEN {shown}",
+            _bump_snippet_versions_sql(related),
+        ),
+    ]
+    for event, row in [("INSERT", "NEW"), ("DELETE", "OLD")]:
+        # Permissions change which related snippets the viewer is shown
+        triggers.append(
+            (
+                "LineagePermissions" + event.title(),
+                event + " ON SnippetPermissions",
+                _bump_snippet_versions_sql(
+                    _ancestors_sql(f"{row}.SnippetID", 1)
+                    + " UNION "
+                    + _descendants_sql(f"{row}.SnippetID")
+                ),
+            )
+        )
+    return triggers
+
+
+# Columns whose changes are shown to viewers, so change versions
+_SNIPPET_SHOWN_COLUMNS = [
+    "Name",
+    "Code",
+    "Description",
+    "UserID",
+    "ParentSnippetID",
+    "Date",
+    "IsPublic",
+    "ShareableLink",
+    "LikeCount",
+    "RemixCount",
+    "CodePreview",
+    "CodeTruncated",
+]
+_USER_SHOWN_COLUMNS = ["Name", "ProfilePicture", "Bio", "Description"]
+
+
+def _version_triggers():
+    """
+    Builds the triggers that keep SnippetVersion, UserVersion and GlobalVersion
+    current.
+
+    A snippet's version changes with anything shown alongside it: its own columns,
+    tags, likes, comments and permissions. A user's version changes with their
+    snippets' versions, and when they gain or lose a snippet. Snippets' versions
+    also change with the remixes and ancestors shown on their pages. The "profiles"
+    version changes with any user's details or links. Trending scores aren't
+    shown, so they change none of them.
+    """
+    snippet_columns = ", ".join(_SNIPPET_SHOWN_COLUMNS)
+    user_columns = ", ".join(_USER_SHOWN_COLUMNS)
+    triggers = [
+        ("SnippetInsert", "INSERT ON Snippet", _bump_snippet_version_sql("NEW.ID")),
+        (
+            "SnippetUpdate",
+            f"UPDATE OF {snippet_columns} ON Snippet",
+            _bump_snippet_version_sql("NEW.ID") + _bump_user_version_sql("OLD.UserID"),
+        ),
+        (
+            "SnippetDelete",
+            "DELETE ON Snippet",
+            "DELETE FROM SnippetVersion WHERE SnippetID = OLD.ID;"
+            + _bump_user_version_sql("OLD.UserID")
+            + _bump_version_sql("snippets"),
+        ),
+    ]
+    for table in ["TagUse", "Like", "Comments", "SnippetPermissions"]:
+        triggers.append(
+            (table + "Insert", "INSERT ON " + table, _bump_snippet_version_sql("NEW.SnippetID"))
+        )
+        triggers.append(
+            (table + "Delete", "DELETE ON " + table, _bump_snippet_version_sql("OLD.SnippetID"))
+        )
+    for event in ["INSERT", f"UPDATE OF {user_columns}", "DELETE"]:
+        name = "User" + event.split()[0].title()
+        triggers.append((name, event + " ON User", _bump_version_sql("profiles")))
+    for event in ["INSERT", "DELETE"]:
+        triggers.append(("Links" + event.title(), event + " ON Links", _bump_version_sql("profiles")))
+    triggers += _lineage_version_triggers()
+
+    return "BEGIN;" + "".join(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS Version{name} AFTER {event}
+        BEGIN {body} END;
+        """
+        for name, event, body in triggers
+    ) + "COMMIT;"
+
+
+_VERSION_TRIGGERS = _version_triggers()
+
+# Scope of the TagStats rows counting every user's snippets together
+_ALL_USERS = 0
+
+
+def _count_tags_sql(scope, tags, public, total):
+    """
+    SQL that adds `public` and `total` to the counts in TagStats of the tags
+    selected by the `tags` subquery, for a user ID or `_ALL_USERS` as `scope`.
+    """
+    return f"""
+        INSERT INTO TagStats (UserID, TagID, PublicCount, TotalCount)
+        SELECT DISTINCT {scope}, TagID, 0, 0 FROM ({tags}) AS Tags
+        WHERE {scope} IS NOT NULL AND NOT EXISTS (
+            SELECT 1 FROM TagStats
+            WHERE UserID = {scope} AND TagStats.TagID = Tags.TagID
+        );
+        UPDATE TagStats
+        SET PublicCount = PublicCount + ({public}), TotalCount = TotalCount + ({total})
+        WHERE UserID = {scope} AND TagID IN ({tags});
+        DELETE FROM TagStats WHERE UserID = {scope} AND TotalCount <= 0;
+    """
+
+
+def _tag_stats_triggers():
+    """
+    Builds the table of how many snippets use each tag, and the triggers that
+    keep it current. Each tag is counted for every user's snippets together,
+    and for each user's own, both among public snippets and among all of them.
+    """
+    snippet_tags = "SELECT TagID FROM TagUse WHERE SnippetID = {}"
+    owner = "(SELECT UserID FROM Snippet WHERE ID = {})"
+    is_public = "(SELECT IsPublic = 1 FROM Snippet WHERE ID = {})"
+
+    def count_everywhere(snippet, tags, public, total, owner=owner):
+        return _count_tags_sql(_ALL_USERS, tags, public, total) + _count_tags_sql(
+            owner.format(snippet), tags, public, total
+        )
+
+    triggers = [
+        (
+            "TagUseInsert",
+            "INSERT ON TagUse",
+            "",
+            count_everywhere(
+                "NEW.SnippetID", "SELECT NEW.TagID AS TagID",
+                is_public.format("NEW.SnippetID"), 1,
+            ),
+        ),
+        (
+            # Tags deleted along with their snippet are counted by SnippetDelete
+            "TagUseDelete",
+            "DELETE ON TagUse",
+            "WHEN EXISTS (SELECT 1 FROM Snippet WHERE ID = OLD.SnippetID)",
+            count_everywhere(
+                "OLD.SnippetID", "SELECT OLD.TagID AS TagID",
+                "-" + is_public.format("OLD.SnippetID"), -1,
+            ),
+        ),
+        (
+            "SnippetDelete",
+            "DELETE ON Snippet",
+            "",
+            count_everywhere(
+                "OLD.ID", snippet_tags.format("OLD.ID"),
+                "-(OLD.IsPublic = 1)", -1, owner="OLD.UserID",
+            ),
+        ),
+        (
+            "SnippetVisibility",
+            "UPDATE OF IsPublic ON Snippet",
+            "WHEN (OLD.IsPublic = 1) IS NOT (NEW.IsPublic = 1)",
+            count_everywhere(
+                "NEW.ID", snippet_tags.format("NEW.ID"),
+                "(NEW.IsPublic = 1) - (OLD.IsPublic = 1)", 0, owner="NEW.UserID",
+            ),
+        ),
+        (
+            "SnippetOwner",
+            "UPDATE OF UserID ON Snippet",
+            "WHEN OLD.UserID IS NOT NEW.UserID",
+            _count_tags_sql(
+                "OLD.UserID", snippet_tags.format("NEW.ID"), "-(OLD.IsPublic = 1)", -1
+            )
+            + _count_tags_sql(
+                "NEW.UserID", snippet_tags.format("NEW.ID"), "NEW.IsPublic = 1", 1
+            ),
+        ),
+    ]
+
+    return """
+        CREATE TABLE IF NOT EXISTS TagStats (
+            UserID INTEGER NOT NULL,    -- 0 for every user's snippets together
+            TagID INTEGER NOT NULL,
+            PublicCount INTEGER NOT NULL,
+            TotalCount INTEGER NOT NULL,
+            PRIMARY KEY (UserID, TagID)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS TagStatsPublic ON TagStats(UserID, PublicCount);
+        CREATE INDEX IF NOT EXISTS TagStatsTotal ON TagStats(UserID, TotalCount);
+    """ + "".join(
+        # Snippets are deleted before their tags, so their counts are taken first
+        f"""
+        CREATE TRIGGER IF NOT EXISTS TagStats{name}
+        {"BEFORE" if event.startswith("DELETE ON Snippet") else "AFTER"} {event}
+        {when} BEGIN {body} END;
+        """
+        for name, event, when, body in triggers
+    )
+
+
+_TAG_STATS_SQL = _tag_stats_triggers()
+
+# Fills TagStats from scratch
+_TAG_STATS_REBUILD_SQL = f"""
+    INSERT INTO TagStats (UserID, TagID, PublicCount, TotalCount)
+    SELECT {_ALL_USERS}, TagID, SUM(Snippet.IsPublic = 1), COUNT(*)
+    FROM TagUse JOIN Snippet ON Snippet.ID = TagUse.SnippetID
+    GROUP BY TagID
+    UNION ALL
+    SELECT Snippet.UserID, TagID, SUM(Snippet.IsPublic = 1), COUNT(*)
+    FROM TagUse JOIN Snippet ON Snippet.ID = TagUse.SnippetID
+    WHERE Snippet.UserID IS NOT NULL
+    GROUP BY Snippet.UserID, TagID
+"""
+
+
 class Data:
     def __init__(self):
         """Connect to the database, creating it if necessary."""
@@ -42,22 +1098,45 @@ class Data:
             os.mkdir("databases")
         _db_path = os.path.join("databases", "snippet_oracle.db")
 
-        self._db = sqlite3.connect(_db_path)
+        # Pooled connections move between threads, but only one uses them at a time
+        self._db = sqlite3.connect(_db_path, check_same_thread=False)
         self._db.enable_load_extension(True)
         sqlite_vec.load(self._db)
         self._db.enable_load_extension(False)
+        self._db.create_function(
+            "REGEXP", 2, code_search.regexp, deterministic=True
+        )
 
         self.generate_embeddings = True
-
+        self.clear_identity_maps()
         self._init_db()
 
     def close(self):
         """Close the database connection."""
         self._db.close()
 
+    def interrupt(self):
+        """Aborts any query running on this connection. Safe to call from any thread."""
+        self._db.interrupt()
+
+    def clear_identity_maps(self):
+        """Forgets every lookup remembered since the connection was opened or pooled."""
+        # Identity maps for this connection's lifetime (one request)
+        self._user_details = {}
+        self._snippets = {}
+        self._snippet_tags = {}
+        self._access_synced = False
+
     def _init_db(self):
         """Initialize the database's tables."""
         cur = self._db.cursor()
+        cur.execute(
+            """
+            SELECT name FROM sqlite_master
+            WHERE name IN ('SnippetCode', 'SnippetSymbol', 'SnippetLineage', 'TagStats')
+            """
+        )
+        indexes = {row[0] for row in cur.fetchall()}
 
         # Create tables
         cur.executescript(
@@ -70,7 +1149,8 @@ class Data:
                 PasswordHash TEXT,
                 ProfilePicture BLOB,    -- For storing profile picture BLOB (binary large object)
                 Bio TEXT,               -- User biography
-                Description VARCHAR(250)
+                Description VARCHAR(250),
+                HotScore REAL NOT NULL DEFAULT 0    -- Sum of public snippets' HotScore
             );
             CREATE TABLE IF NOT EXISTS Snippet (
                 ID INTEGER PRIMARY KEY,
@@ -79,16 +1159,24 @@ class Data:
                 Description TEXT,
                 UserID INTEGER REFERENCES User(ID) ON DELETE SET NULL,
                 ParentSnippetID INTEGER REFERENCES Snippet(ID) ON DELETE SET NULL,
-                Date,
+                Date INTEGER,   -- Seconds since the Unix epoch
                 IsPublic BOOLEAN DEFAULT 0, --0 for private and 1 for public
-                ShareableLink TEXT UNIQUE
+                ShareableLink TEXT UNIQUE,
+                LikeCount INTEGER NOT NULL DEFAULT 0,   -- Kept current by triggers
+                RemixCount INTEGER NOT NULL DEFAULT 0,
+                CodePreview TEXT,   -- Start of Code shown by listings, from code_preview
+                CodeTruncated BOOLEAN NOT NULL DEFAULT 0,
+                HotScore REAL NOT NULL DEFAULT 0   -- Trending rank, see _HOT_SCORE_SQL
             );
-            CREATE TABLE IF NOT EXISTS TagUse (
-                SnippetID INTEGER,
-                TagName TEXT,
-                PRIMARY KEY (SnippetID, TagName),
+            CREATE INDEX IF NOT EXISTS UserNameNoCase ON User(Name COLLATE NOCASE);
+            CREATE TABLE IF NOT EXISTS SnippetSymbol (
+                Symbol TEXT NOT NULL,   -- Lowercased identifier used in the code
+                SnippetID INTEGER NOT NULL,
+                Count INTEGER NOT NULL, -- Times the code uses it
+                PRIMARY KEY (Symbol, SnippetID),
                 FOREIGN KEY (SnippetID) REFERENCES Snippet(ID) ON DELETE CASCADE
-            );
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS SnippetSymbolSnippet ON SnippetSymbol(SnippetID);
             CREATE TABLE IF NOT EXISTS Links (
                 ID INTEGER PRIMARY KEY,
                 UserID INTEGER,
@@ -96,13 +1184,6 @@ class Data:
                 URL TEXT,       -- The actual link
                 FOREIGN KEY (UserID) REFERENCES User(ID) ON DELETE CASCADE
             );
-            CREATE TABLE IF NOT EXISTS SnippetPermissions (
-                SnippetID INTEGER,
-                UserID INTEGER,
-                PRIMARY KEY (SnippetID, UserID),
-                FOREIGN KEY (SnippetID) REFERENCES Snippet(ID) ON DELETE CASCADE,
-                FOREIGN KEY (UserID) REFERENCES User(ID) ON DELETE CASCADE
-            );
             CREATE VIRTUAL TABLE IF NOT EXISTS SnippetEmbedding USING vec0(
                 SnippetID INTEGER PRIMARY KEY ON DELETE CASCADE,
                 Embedding float[384]
@@ -118,19 +1199,165 @@ class Data:
                 FOREIGN KEY (UserID) REFERENCES User(ID) ON DELETE CASCADE,
                 FOREIGN KEY (ParentCommentID) REFERENCES Comments(ID) ON DELETE CASCADE
             );
-            CREATE TABLE IF NOT EXISTS Like (
-                SnippetID INTEGER NOT NULL,
+            CREATE INDEX IF NOT EXISTS CommentsThread ON Comments(SnippetID, ParentCommentID);
+            CREATE TABLE IF NOT EXISTS UserTaste (
+                UserID INTEGER PRIMARY KEY,
+                LikeCount INTEGER NOT NULL DEFAULT 0,
+                EmbeddingSum BLOB,      -- Running sum of liked snippet embeddings
+                FOREIGN KEY (UserID) REFERENCES User(ID) ON DELETE CASCADE
+            );
+            CREATE TABLE IF NOT EXISTS Recommendation (
                 UserID INTEGER NOT NULL,
-                FOREIGN KEY (SnippetID) REFERENCES Snippet(ID) ON DELETE CASCADE,
+                SnippetID INTEGER NOT NULL,
+                Distance REAL NOT NULL,
+                PRIMARY KEY (UserID, SnippetID),
                 FOREIGN KEY (UserID) REFERENCES User(ID) ON DELETE CASCADE,
-                UNIQUE (SnippetID, UserID)
+                FOREIGN KEY (SnippetID) REFERENCES Snippet(ID) ON DELETE CASCADE
+            );
+            CREATE INDEX IF NOT EXISTS RecommendationRank ON Recommendation(UserID, Distance);
+            CREATE TABLE IF NOT EXISTS SnippetVersion (
+                SnippetID INTEGER PRIMARY KEY,
+                Version INTEGER NOT NULL,
+                Modified TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS GlobalVersion (
+                Name TEXT PRIMARY KEY,  -- See get_version
+                Version INTEGER NOT NULL,
+                Modified TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS UserVersion (
+                UserID INTEGER PRIMARY KEY, -- Kept after the user is deleted
+                Version INTEGER NOT NULL,
+                Modified TEXT NOT NULL
             );
             COMMIT;
             """
         )
 
+        # Databases in the first storage layout are moved to the current one
+        cur.execute("SELECT name FROM pragma_table_info('TagUse')")
+        if "TagName" in {row[0] for row in cur.fetchall()}:
+            cur.executescript(_STORAGE_V2_SQL)
+            indexes.discard("TagStats")
+        else:
+            cur.executescript(_LINK_TABLES_SQL)
+        cur.executescript(_VERSION_TRIGGERS)
+
+        # Snippets made before Snippet kept counts or previews get them added
+        cur.execute("SELECT name FROM pragma_table_info('Snippet')")
+        columns = {row[0] for row in cur.fetchall()}
+        if "LikeCount" not in columns:
+            cur.executescript(
+                f"""
+                BEGIN;
+                ALTER TABLE Snippet ADD COLUMN LikeCount INTEGER NOT NULL DEFAULT 0;
+                ALTER TABLE Snippet ADD COLUMN RemixCount INTEGER NOT NULL DEFAULT 0;
+                {_COUNT_SQL};
+                COMMIT;
+                """
+            )
+        if "CodePreview" not in columns:
+            cur.execute("ALTER TABLE Snippet ADD COLUMN CodePreview TEXT")
+            cur.execute(
+                """
+                ALTER TABLE Snippet
+                ADD COLUMN CodeTruncated BOOLEAN NOT NULL DEFAULT 0
+                """
+            )
+            cur.execute("SELECT ID, Code FROM Snippet")
+            cur.executemany(
+                "UPDATE Snippet SET CodePreview = ?, CodeTruncated = ? WHERE ID = ?",
+                [(*code_preview(code), id) for id, code in cur.fetchall()],
+            )
+            self._db.commit()
+        if "HotScore" not in columns:
+            cur.executescript(
+                f"""
+                BEGIN;
+                ALTER TABLE User ADD COLUMN HotScore REAL NOT NULL DEFAULT 0;
+                ALTER TABLE Snippet ADD COLUMN HotScore REAL NOT NULL DEFAULT 0;
+                {_TRENDING_REBUILD_SQL}
+                COMMIT;
+                """
+            )
+        cur.executescript(_LISTING_SQL)
+        cur.executescript(_TRENDING_SQL)
+        cur.executescript(_LINEAGE_SQL)
+        if "SnippetLineage" not in indexes:
+            cur.execute(_LINEAGE_REBUILD_SQL)
+            self._db.commit()
+        cur.executescript(_ACCESS_SQL)
+        cur.executescript(_TAG_STATS_SQL)
+        if "TagStats" not in indexes:
+            cur.execute(_TAG_STATS_REBUILD_SQL)
+            self._db.commit()
+
+        # Code indexes are filled from existing snippets when they are first made
+        cur.executescript(code_search.INDEX_SQL)
+        if "SnippetCode" not in indexes:
+            cur.execute(code_search.REBUILD_SQL)
+            self._db.commit()
+        if "SnippetSymbol" not in indexes:
+            self.reindex_symbols()
+
     ## GENERAL ##
 
+    def invalidate_user(self, user_id):
+        """
+        Forgets everything remembered about a user after their profile changes.
+        """
+        self._user_details.pop(int(user_id), None)
+        self._snippets.clear()  # Snippets include their author's details
+        session_users.pop(str(user_id))
+        invalidate_popular()  # Popular listings show profile details
+
+    def _get_access_index(self):
+        """
+        Returns the index of which snippets each user can see, caught up with
+        AccessChange at the request's first access check, and again after each
+        change to access it makes.
+        """
+        if self._access_synced:
+            return _access_index
+
+        cur = self._db.cursor()
+        with _access_lock:
+            cur.execute("SELECT min(ID), max(ID) FROM AccessChange")
+            first, last = cur.fetchone()
+            last = last or 0
+            applied = _access_index.change_id
+            if applied is None or applied > last or (first or 1) - 1 > applied:
+                cur.execute("SELECT ID, IsPublic = 1, UserID FROM Snippet")
+                snippets = cur.fetchall()
+                cur.execute("SELECT SnippetID, UserID FROM SnippetPermissions")
+                _access_index.rebuild(snippets, cur.fetchall())
+            elif applied < last:
+                cur.execute(
+                    "SELECT DISTINCT SnippetID FROM AccessChange WHERE ID > ?",
+                    [applied],
+                )
+                changed = [row[0] for row in cur.fetchall()]
+                cur.execute(
+                    """
+                    SELECT ID, IsPublic = 1, UserID FROM Snippet
+                    WHERE ID IN (SELECT value FROM json_each(?))
+                    """,
+                    [json.dumps(changed)],
+                )
+                snippets = cur.fetchall()
+                cur.execute(
+                    """
+                    SELECT SnippetID, UserID FROM SnippetPermissions
+                    WHERE SnippetID IN (SELECT value FROM json_each(?))
+                    """,
+                    [json.dumps(changed)],
+                )
+                _access_index.update(changed, snippets, cur.fetchall())
+            _access_index.change_id = last
+
+        self._access_synced = True
+        return _access_index
+
     def reset(self):
         """Clears all tables in the database."""
         cur = self._db.cursor()
@@ -142,14 +1369,28 @@ class Data:
             DROP TABLE IF EXISTS SnippetPermissions;
             DROP TABLE IF EXISTS Links;
             DROP TABLE IF EXISTS TagUse;
+            DROP TABLE IF EXISTS Tag;
+            DROP TABLE IF EXISTS SnippetCode;
+            DROP TABLE IF EXISTS SnippetSymbol;
+            DROP TABLE IF EXISTS SnippetLineage;
+            DROP TABLE IF EXISTS TagStats;
             DROP TABLE IF EXISTS Snippet;
             DROP TABLE IF EXISTS User;
             DROP TABLE IF EXISTS Like;
+            DROP TABLE IF EXISTS UserTaste;
+            DROP TABLE IF EXISTS Recommendation;
+            DROP TABLE IF EXISTS SnippetVersion;
+            DROP TABLE IF EXISTS GlobalVersion;
+            DROP TABLE IF EXISTS UserVersion;
             COMMIT;
             PRAGMA foreign_keys = 1;
             """
         )
         self._init_db()
+        with _word_lock:
+            _word_indexes.clear()
+        with _access_lock:
+            _access_index.change_id = None
 
     def populate(self):
         """Fills all tables with a bunch of fake data."""
@@ -189,10 +1430,69 @@ class Data:
                     [snippet[0], embedding],
                 )
 
+    ## VERSIONS ##
+
+    def get_version(self, name):
+        """
+        Returns a `(version, last_modified)` pair for a GlobalVersion counter.
+
+        - "snippets": Changes with any snippet or anything shown alongside one.
+        - "profiles": Changes with any user's details or links.
+        - "recommendations": Changes each time "for you" feeds are refreshed.
+        - "trending": Changes each time trending scores are refreshed.
+        """
+        cur = self._db.cursor()
+        cur.execute("SELECT Version, Modified FROM GlobalVersion WHERE Name = ?", [name])
+
+        res = cur.fetchone()
+        return (0, None) if res is None else (res[0], res[1])
+
+    def get_snippet_version(self, snippet_id):
+        """
+        Returns a `(version, last_modified)` pair for a snippet and its parent snippet,
+        or `None` if the snippet does not exist.
+        The version changes whenever anything shown on the snippet's page does,
+        apart from user profiles.
+        """
+        cur = self._db.cursor()
+        cur.execute(
+            """
+            SELECT
+                COALESCE(V.Version, 0), COALESCE(V.Modified, datetime(S.Date, 'unixepoch')),
+                P.ID, COALESCE(PV.Version, 0),
+                COALESCE(PV.Modified, datetime(P.Date, 'unixepoch'))
+            FROM Snippet AS S
+            LEFT JOIN SnippetVersion AS V ON V.SnippetID = S.ID
+            LEFT JOIN Snippet AS P ON P.ID = S.ParentSnippetID
+            LEFT JOIN SnippetVersion AS PV ON PV.SnippetID = P.ID
+            WHERE S.ID = ?
+            """,
+            [snippet_id],
+        )
+
+        res = cur.fetchone()
+        if res is None:
+            return None
+        return (res[0], res[2], res[3]), max(filter(None, [res[1], res[4]]), default=None)
+
+    def get_user_snippets_version(self, user_id):
+        """
+        Returns a `(version, last_modified)` pair that changes whenever any snippet
+        owned by the user is created, changed or deleted.
+        """
+        cur = self._db.cursor()
+        cur.execute(
+            "SELECT Version, Modified FROM UserVersion WHERE UserID = ?", [user_id]
+        )
+
+        res = cur.fetchone()
+        return (0, None) if res is None else (res[0], res[1])
+
     ## USER INFO ###
 
     def delete_user(self, id):
         """Deletes a user account. Returns `True` if the account was deleted, `False` otherwise."""
+        name = self.get_user_name(id)
         cur = self._db.cursor()
         cur.execute(
             """
@@ -203,6 +1503,9 @@ class Data:
             [id],
         )
         self._db.commit()
+        self._access_synced = False
+        self.invalidate_user(id)
+        _update_indexed_users(removed=name)
         return True
 
     def get_user_by_id(self, user_id):
@@ -231,6 +1534,15 @@ class Data:
         else:
             return {"name": res[0], "password_hash": res[1], "profile_picture": res[2]}
 
+    def get_user_name(self, user_id):
+        """Returns a user's name, or `None` if a user with the given ID does not exist."""
+
+        cur = self._db.cursor()
+        cur.execute("SELECT Name FROM User WHERE ID = ?", [user_id])
+
+        res = cur.fetchone()
+        return None if res is None else res[0]
+
     def get_user_by_name(self, name):
         """
         Returns a dictionary of user data, or `None` if a user with the given name does not exist.
@@ -270,6 +1582,7 @@ class Data:
                 [name, password_hash],
             )
             self._db.commit()
+            _update_indexed_users(added=name)
             return True
         except sqlite3.IntegrityError:
             # Raised when Name was not unique
@@ -287,6 +1600,10 @@ class Data:
         if user_id is None:
             return None
 
+        user_id = int(user_id)
+        if user_id in self._user_details:
+            return self._user_details[user_id]
+
         cur = self._db.cursor()
         cur.execute(
             """
@@ -312,7 +1629,7 @@ class Data:
 
         social_links = [{"platform": row[0], "url": row[1]} for row in cur.fetchall()]
 
-        return {
+        user_details = {
             "name": res[0],
             "bio": res[1] if res[1] else "",
             "profile_picture": res[2]
@@ -320,20 +1637,20 @@ class Data:
             else "default_image.png",  # Return BLOB (frontend should handle display)
             "social_links": social_links,
         }
+        self._user_details[user_id] = user_details
+        return user_details
 
     def get_popular_users(self):
         """
-        Gets the Top 10 Most Popular Users
+        Gets the Top 10 Users whose public snippets are trending
         Returns Username, Profle Picture for card
         """
         cur = self._db.cursor()
         results = cur.execute(
             """
-            SELECT User.Name, User.ProfilePicture
-            FROM Snippet, User
-            WHERE Snippet.IsPublic = 1 AND Snippet.UserID = User.ID 
-            GROUP BY Snippet.UserID
-            ORDER BY SUM ((SELECT COUNT(*) FROM Like WHERE Like.SnippetID = Snippet.ID)) DESC, User.Name
+            SELECT Name, ProfilePicture FROM User
+            WHERE HotScore > 0
+            ORDER BY HotScore DESC, Name
             LIMIT 10
             """
         )
@@ -363,12 +1680,13 @@ class Data:
 
         cur.execute(
             """
-            INSERT INTO Snippet (Name, Code, Description, UserID, Date, IsPublic, ShareableLink, ParentSnippetID)
-            VALUES (?, ?, ?, ?, datetime('now'), ?, ?, ?)
+            INSERT INTO Snippet (Name, Code, CodePreview, CodeTruncated, Description, UserID, Date, IsPublic, ShareableLink, ParentSnippetID)
+            VALUES (?, ?, ?, ?, ?, ?, CAST(strftime('%s', 'now') AS INTEGER), ?, ?, ?)
             """,
             [
                 name,
                 code,
+                *code_preview(code),
                 description or "",
                 user_id,
                 int(is_public),
@@ -395,14 +1713,8 @@ class Data:
         if tags:
             # Remove empty strings and whitespace-only tags
             tags = [tag.strip() for tag in tags if tag.strip()]
-
-            cur.executemany(
-                """
-                INSERT INTO TagUse (SnippetID, TagName)
-                VALUES (?, ?)
-                """,
-                [(snippet_id, tag) for tag in tags],
-            )
+            self._add_tags(cur, snippet_id, tags)
+        self._index_symbols(cur, snippet_id, code, tags)
 
         if is_public and self.generate_embeddings:
             embedding = _get_transformer().encode(name + " " + description)
@@ -415,12 +1727,161 @@ class Data:
             )
 
         self._db.commit()
+        self._access_synced = False
+        invalidate_popular()
+        self._refresh_indexed_snippet(snippet_id)
 
         # Posters like their own snippets by default
         self.add_like(snippet_id, user_id)
 
         return snippet_id
 
+    def _add_tags(self, cur, snippet_id, tags):
+        """Tags a snippet, adding any tags not used before to Tag."""
+        cur.executemany(
+            "INSERT OR IGNORE INTO Tag (Name, NameNorm) VALUES (?, lower(?))",
+            [(tag, tag) for tag in tags],
+        )
+        cur.executemany(
+            """
+            INSERT OR IGNORE INTO TagUse (SnippetID, TagID)
+            SELECT ?, ID FROM Tag WHERE NameNorm = lower(?)
+            """,
+            [(snippet_id, tag) for tag in tags],
+        )
+
+    def _index_symbols(self, cur, snippet_id, code, tags):
+        """Replaces a snippet's symbols in the symbol index."""
+        cur.execute("DELETE FROM SnippetSymbol WHERE SnippetID = ?", [snippet_id])
+        cur.executemany(
+            """
+            INSERT INTO SnippetSymbol (Symbol, SnippetID, Count)
+            VALUES (?, ?, ?)
+            """,
+            [
+                (symbol, snippet_id, count)
+                for symbol, count in code_symbols.symbols(code, tags).items()
+            ],
+        )
+
+    def reindex_symbols(self):
+        """Rebuilds the symbol index from every snippet's code and tags."""
+        cur = self._db.cursor()
+        cur.execute(
+            """
+            SELECT Snippet.ID, Snippet.Code, json_group_array(Tag.Name)
+            FROM Snippet
+            LEFT JOIN TagUse ON TagUse.SnippetID = Snippet.ID
+            LEFT JOIN Tag ON Tag.ID = TagUse.TagID
+            GROUP BY Snippet.ID
+            """
+        )
+        snippets = cur.fetchall()
+
+        cur.execute("DELETE FROM SnippetSymbol")
+        for snippet_id, code, tags in snippets:
+            tags = [tag for tag in json.loads(tags) if tag is not None]
+            self._index_symbols(cur, snippet_id, code, tags)
+        self._db.commit()
+
+    def get_snippet_code(self, snippet_id, viewer_id=None):
+        """
+        Returns the full code of a snippet, or None if it doesn't exist or the
+        viewer can't access it.
+        """
+        if not self._get_access_index().can_view(snippet_id, viewer_id):
+            return None
+
+        cur = self._db.cursor()
+        cur.execute("SELECT Code FROM Snippet WHERE ID = ?", [snippet_id])
+        result = cur.fetchone()
+        return result[0] if result else None
+
+    def get_remix_ancestry(self, snippet_id, viewer_id=None):
+        """
+        Returns the snippets a snippet was remixed from that the viewer can see,
+        the original first and its parent last, each with "id", "name",
+        "user_id" and "depth", how many remixes back it is.
+        """
+        cur = self._db.cursor()
+        cur.execute(
+            """
+            SELECT Snippet.ID, Snippet.Name, Snippet.UserID, SnippetLineage.Depth
+            FROM SnippetLineage
+            JOIN Snippet ON Snippet.ID = SnippetLineage.AncestorID
+            WHERE SnippetLineage.DescendantID = ? AND SnippetLineage.Depth > 0
+            ORDER BY SnippetLineage.Depth DESC
+            """,
+            [snippet_id],
+        )
+        index = self._get_access_index()
+        return [
+            {"id": row[0], "name": row[1], "user_id": row[2], "depth": row[3]}
+            for row in cur.fetchall()
+            if index.can_view(row[0], viewer_id)
+        ]
+
+    def get_remix_tree(self, snippet_id, viewer_id=None):
+        """
+        Returns the remixes of a snippet, and the remixes of those however deeply
+        nested, that the viewer can see, oldest first. Each has "id", "name",
+        "user_id", "parent_snippet_id", "depth", how many remixes away it is,
+        and its own "remixes" in the same form. Remixes of a snippet the viewer
+        can't see are left out.
+        """
+        cur = self._db.cursor()
+        cur.execute(
+            """
+            SELECT Snippet.ID, Snippet.Name, Snippet.UserID, Snippet.ParentSnippetID,
+                SnippetLineage.Depth
+            FROM SnippetLineage
+            JOIN Snippet ON Snippet.ID = SnippetLineage.DescendantID
+            WHERE SnippetLineage.AncestorID = ? AND SnippetLineage.Depth > 0
+            ORDER BY SnippetLineage.Depth, Snippet.ID
+            """,
+            [snippet_id],
+        )
+
+        index = self._get_access_index()
+        remixes = {int(snippet_id): {"remixes": []}}
+        for row in cur.fetchall():
+            parent = remixes.get(row[3])
+            if parent is None or not index.can_view(row[0], viewer_id):
+                continue  # It or its parent is hidden
+            remix = {
+                "id": row[0],
+                "name": row[1],
+                "user_id": row[2],
+                "parent_snippet_id": row[3],
+                "depth": row[4],
+                "remixes": [],
+            }
+            parent["remixes"].append(remix)
+            remixes[remix["id"]] = remix
+        return remixes[int(snippet_id)]["remixes"]
+
+    def get_fork_counts(self, snippet_ids, viewer_id=None):
+        """
+        Returns how often each snippet was remixed, keyed by ID: "forks", its
+        direct remixes, and "descendants", its remixes at any depth. Only remixes
+        the viewer can see are counted.
+        """
+        counts = {int(id): {"forks": 0, "descendants": 0} for id in snippet_ids}
+        cur = self._db.cursor()
+        cur.execute(
+            """
+            SELECT AncestorID, DescendantID, Depth FROM SnippetLineage
+            WHERE AncestorID IN (SELECT value FROM json_each(?)) AND Depth > 0
+            """,
+            [json.dumps(list(counts))],
+        )
+        index = self._get_access_index()
+        for ancestor, descendant, depth in cur.fetchall():
+            if index.can_view(descendant, viewer_id):
+                counts[ancestor]["forks"] += depth == 1
+                counts[ancestor]["descendants"] += 1
+        return counts
+
     def get_snippet_isPublic(self, snippet_id):
         cur = self._db.cursor()
 
@@ -441,37 +1902,30 @@ class Data:
             return None
 
     def get_snippet(self, snippet_id, viewer_id=None):
+        key = (int(snippet_id), None if viewer_id is None else int(viewer_id))
+        if key in self._snippets:
+            return self._snippets[key]
+
+        if not self._get_access_index().can_view(snippet_id, viewer_id):
+            return None
+
         cur = self._db.cursor()
 
-        cur.execute(
-            """
-            SELECT * FROM Snippet 
-            WHERE ID = ? 
-            AND (IsPublic = 1 
-                OR UserID = ? 
-                OR EXISTS (
-                    SELECT 1 FROM SnippetPermissions 
-                    WHERE SnippetID = ? 
-                    AND UserID = ?
-                )
-            )
-            """,
-            (snippet_id, viewer_id, snippet_id, viewer_id),
-        )
+        cur.execute("SELECT * FROM Snippet WHERE ID = ?", [snippet_id])
 
         snippet = cur.fetchone()
 
         if snippet:
             user_details = self.get_user_details(snippet[4])
 
-            return {
+            self._snippets[key] = {
                 "id": snippet[0],
                 "name": snippet[1],
                 "code": snippet[2],
                 "description": snippet[3],
                 "user_id": snippet[4],
                 "parent_snippet_id": snippet[5],
-                "date": snippet[6],
+                "date": _date_text(snippet[6]),
                 "is_public": bool(snippet[7]),  # Explicit conversion
                 "tags": self.get_tags_for_snippet(snippet[0]),  # Fetch tags
                 "shareable_link": snippet[8],
@@ -479,43 +1933,79 @@ class Data:
                 "is_liked": self.is_liked(snippet[0], viewer_id),
                 "author": user_details,  # Include (name, bio, profile_picture)
             }
+            return self._snippets[key]
 
         return None  # Snippet not found or not accessible
 
-    def get_user_snippets(self, user_id, viewer_id=None):
+    def get_user_snippets(
+        self,
+        user_id,
+        viewer_id=None,
+        public_only=False,
+        sort="newest",
+        after=None,
+        limit=SNIPPET_PAGE_SIZE,
+    ):
         """
-        Gets all snippets posted by a specific user.
-
-        - "id": The integer ID of the snippet.
-        - "name": The name of the snippet.
-        - "code": The content of the snippet.
-        - "description": The user-provided description.
-        - "user_id": The author's integer ID.
-        - "parent_snippet_id": The integer ID of the parent snippet or `None`.
-        - "date": The date and time of this snippet's creation.
-        - "is_public": True if the snippet is public, False otherwise.
-        - "tags": A list of tags that the snippet has.
+        Gets a page of the snippets posted by a specific user, or only their
+        public ones, in one of the orders in `SNIPPET_SORTS`:
+
+        - "snippets": A list of up to `limit` snippets, each with:
+          - "id": The integer ID of the snippet.
+          - "name": The name of the snippet.
+          - "code_preview": The start of the snippet's code, from `code_preview`.
+          - "code_truncated": Whether the preview is missing any of the code.
+          - "description": The user-provided description.
+          - "user_id": The author's integer ID.
+          - "parent_snippet_id": The integer ID of the parent snippet or `None`.
+          - "date": The date and time of this snippet's creation.
+          - "is_public": True if the snippet is public, False otherwise.
+          - "tags": A list of tags that the snippet has.
+        - "next": A cursor to pass as `after` for the next page, or None if this
+          is the last one.
+
+        An unknown sort order or a cursor that isn't for it raises ValueError.
         """
+        if sort not in SNIPPET_SORTS:
+            raise ValueError(f"Unknown sort order {sort!r}")
+        columns = SNIPPET_SORTS[sort]
+        conditions = ["UserID = ?1"]
+        params = [user_id, limit + 1]
+        if public_only:
+            conditions.append("IsPublic = 1")
+        if after:
+            conditions.append(_after_sql(columns, len(params)))
+            params += _decode_cursor(after, sort, len(columns))
+
         cur = self._db.cursor()
         cur.execute(
-            """
+            f"""
             SELECT
                 ID,
                 Name,
-                Code,
+                CodePreview,
                 Description,
                 UserID,
                 ParentSnippetID,
                 Date,
-                IsPublic
+                IsPublic,
+                CodeTruncated,
+                LikeCount,
+                {", ".join(columns)}
             FROM Snippet
-            WHERE UserID = ?
-            ORDER BY Date DESC
+            WHERE {" AND ".join(conditions)}
+            ORDER BY {", ".join(column + " DESC" for column in columns)}
+            LIMIT ?2
             """,
-            [user_id],
+            params,
         )
         snippets = cur.fetchall()
 
+        next_cursor = None
+        if len(snippets) > limit:
+            snippets = snippets[:limit]
+            next_cursor = _encode_cursor(sort, snippets[-1][-len(columns) :])
+
         snippets_list = []
         for snippet in snippets:
             user_details = self.get_user_details(snippet[4])
@@ -524,20 +2014,21 @@ class Data:
                 {
                     "id": snippet[0],
                     "name": snippet[1],
-                    "code": snippet[2],
+                    "code_preview": snippet[2],
+                    "code_truncated": bool(snippet[8]),
                     "description": snippet[3],
                     "user_id": snippet[4],
                     "parent_snippet_id": snippet[5],
-                    "date": snippet[6],
+                    "date": _date_text(snippet[6]),
                     "is_public": bool(snippet[7]),
                     "tags": self.get_tags_for_snippet(snippet[0]),
-                    "likes": self.get_likes(snippet[0]),
+                    "likes": snippet[9],
                     "is_liked": self.is_liked(snippet[0], viewer_id),
                     "author": user_details,  # Include (name, bio, profile_picture)
                 }
             )
 
-        return snippets_list
+        return {"snippets": snippets_list, "next": next_cursor}
 
     def set_snippet_visibility(self, snippet_id, is_public):
         """
@@ -554,6 +2045,10 @@ class Data:
             [is_public, snippet_id],
         )
         self._db.commit()
+        self._access_synced = False
+        self._snippets.clear()
+        invalidate_popular()
+        self._refresh_indexed_snippet(snippet_id)
 
     def get_snippet_id_by_shareable_link(self, link):
         """
@@ -577,18 +2072,18 @@ class Data:
 
     def get_popular_public_snippets(self, viewer_id=None):
         """
-        Gets the Top 10 Most Popular Snippets
+        Gets the Top 10 Trending Snippets
         Returns Snippet Card Info
         """
         cur = self._db.cursor()
         results = cur.execute(
             """
-            SELECT Snippet.ID, Snippet.Name, Snippet.Code, Snippet.Description,
+            SELECT Snippet.ID, Snippet.Name, Snippet.CodePreview, Snippet.Description,
                 Snippet.UserID, Snippet.ParentSnippetID, Snippet.Date, Snippet.IsPublic,
-                (SELECT COUNT(*) FROM Like WHERE Like.SnippetID = Snippet.ID) AS like_count
+                Snippet.CodeTruncated, Snippet.LikeCount
             FROM Snippet
             WHERE Snippet.IsPublic = 1
-            ORDER BY like_count DESC, Snippet.Date DESC
+            ORDER BY Snippet.HotScore DESC, Snippet.LikeCount DESC, Snippet.Date DESC
             LIMIT 10
             """
         )
@@ -600,14 +2095,15 @@ class Data:
                 {
                     "id": res[0],
                     "name": res[1],
-                    "code": res[2],
+                    "code_preview": res[2],
+                    "code_truncated": bool(res[8]),
                     "description": res[3],
                     "user_id": res[4],
                     "parent_snippet_id": res[5],
-                    "date": res[6],
+                    "date": _date_text(res[6]),
                     "is_public": bool(res[7]),
                     "tags": self.get_tags_for_snippet(res[0]),  # Fetch snippet tags
-                    "likes": res[8],  # Sort by like count
+                    "likes": res[9],  # Sort by like count
                     "is_liked": self.is_liked(
                         res[0], viewer_id
                     ),  # Check if the user liked it
@@ -625,8 +2121,9 @@ class Data:
         cur = self._db.cursor()
         results = cur.execute(
             """
-            SELECT Snippet.ID, Snippet.Name, Snippet.Code, Snippet.Description,
-                Snippet.UserID, Snippet.ParentSnippetID, Snippet.Date, Snippet.IsPublic
+            SELECT Snippet.ID, Snippet.Name, Snippet.CodePreview, Snippet.Description,
+                Snippet.UserID, Snippet.ParentSnippetID, Snippet.Date, Snippet.IsPublic,
+                Snippet.CodeTruncated
             FROM Snippet
             WHERE Snippet.ID IN 
               (SELECT SnippetID FROM SnippetPermissions
@@ -644,11 +2141,12 @@ class Data:
                 {
                     "id": res[0],
                     "name": res[1],
-                    "code": res[2],
+                    "code_preview": res[2],
+                    "code_truncated": bool(res[8]),
                     "description": res[3],
                     "user_id": res[4],
                     "parent_snippet_id": res[5],
-                    "date": res[6],
+                    "date": _date_text(res[6]),
                     "is_public": bool(res[7]),
                     "tags": self.get_tags_for_snippet(res[0]),  # Fetch snippet tags
                     "likes": self.get_likes(res[0]),  # Sort by like count
@@ -661,10 +2159,48 @@ class Data:
 
         return snippets_list
 
-    def search_tags(self, query):
-        """Returns a list of all preset tags matching the search query."""
-        query = query.lower()
-        return [tag for tag in preset_tags if query in tag.lower()]
+    def get_popular(self):
+        """
+        Gets the homepage listings that look the same to every viewer.
+        The result is cached between requests, so it must not be modified.
+
+        - "tags": The most popular tags.
+        - "users": The users whose public snippets are trending.
+        - "snippets": The trending public snippets, as seen by a signed-out viewer.
+        """
+        popular = _popular_cache.get("popular")
+        if popular is None:
+            popular = {
+                "tags": self.get_popular_public_tags(),
+                "users": self.get_popular_users(),
+                "snippets": self.get_popular_public_snippets(),
+            }
+            _popular_cache.set("popular", popular)
+
+        return popular
+
+    def search_tags(self, query, limit=TAG_SUGGESTION_LIMIT):
+        """
+        Returns up to `limit` preset or used tags containing the search query,
+        those starting with it first and then the most used, or the tags closest
+        to it if it has a typo.
+        """
+        indexes = self._get_word_indexes()
+        tags = [tag for tag, _ in indexes["tag_dictionary"].complete(query, limit)]
+        if not tags and query:
+            tags = indexes["tags"].lookup(query, limit)
+        return tags
+
+    def complete_tag(self, text, limit=TAG_SUGGESTION_LIMIT):
+        """
+        Returns up to `limit` tags containing `text` to suggest while tagging a
+        snippet, ranked like `search_tags`, each as a dictionary of:
+
+        - "name": The tag's name.
+        - "uses": How many public snippets use it.
+        """
+        tags = self._get_word_indexes()["tag_dictionary"].complete(text, limit)
+        return [{"name": name, "uses": uses} for name, uses in tags]
 
     def search_users(self, query):
         """
@@ -684,10 +2220,68 @@ class Data:
             """,
             ["%" + query + "%"],
         )
+        users = [{"name": res[0], "profile_picture": res[1]} for res in results]
+        if users or not query:
+            return users
+
+        # Fall back to the names closest to a misspelled one
+        names = self._get_word_indexes()["users"].lookup(query)
+        cur.execute(
+            """
+            SELECT Name, ProfilePicture
+            FROM User
+            WHERE Name IN (SELECT value FROM json_each(?))
+            """,
+            [json.dumps(names)],
+        )
+        pictures = dict(cur.fetchall())
+        return [
+            {"name": name, "profile_picture": pictures[name]}
+            for name in names
+            if name in pictures
+        ]
+
+    def did_you_mean(self, query):
+        """
+        Returns the search query with typos in its words, tags and usernames
+        corrected, or None if none of them look misspelled. Words and names that
+        are part of a known one aren't corrected, since they match it.
+        """
+        indexes = self._get_word_indexes()
+
+        def correct_word(word, index):
+            if index.contains_part(word):
+                return word
+            suggestions = index.lookup(word, limit=1)
+            return suggestions[0] if suggestions else word
+
+        def correct(kind, value):
+            if kind == "term":
+                # Words can appear in names or be searched as tags or authors
+                def correct_match(match):
+                    word = match.group()
+                    for index in (indexes["tags"], indexes["users"]):
+                        if index.contains_part(word):
+                            return word
+                    return correct_word(word, indexes["names"]).lower()
+
+                return re.sub(r"[^\W\d_]{3,}", correct_match, value)
+            if kind in ("tag", "exclude"):
+                return correct_word(value, indexes["tags"])
+            if kind == "user":
+                return correct_word(value, indexes["users"])
+            return None
 
-        return [{"name": res[0], "profile_picture": res[1]} for res in results]
+        return search_query.correct(query, correct)
 
-    def search_snippets(
+    def search_snippets(self, *args, **kwargs):
+        """
+        Returns the first page of snippets found by `search_snippets_page`, which
+        takes the same arguments.
+        """
+        return self.search_snippets_page(*args, **kwargs)["snippets"]
+
+    def search_snippets_page(
         self,
         terms=None,
         include_tags=None,
@@ -695,135 +2289,132 @@ class Data:
         usernames=None,
         viewer_id=None,
         public=True,
+        session=None,
+        clauses=None,
+        sort="relevance",
+        after=None,
+        limit=SNIPPET_PAGE_SIZE,
     ):
         """
-        Performs an AND-based search on snippets.
+        Performs an AND-based search on snippets, returning a page of results:
+
+        - "snippets": Up to `limit` matching snippets, in `sort` order.
+        - "next": A cursor to pass as `after` for the next page, or None if this
+          is the last one.
 
         - Returns only snippets that match ALL provided terms, tags, and usernames.
         - If multiple search terms are provided, they must ALL appear in either name or description.
         - If multiple tags are provided, the snippet must have ALL the specified tags.
         - If multiple usernames are provided, the snippet must be owned by one of them.
+        - `clauses` from `search_query.parse` can be given instead, to search with
+          phrases and alternatives.
+        - If a `session` ID is given, its last search is remembered, and a search
+          that narrows it down only checks the snippets that matched it.
+        - `sort` is one of `SEARCH_SORTS`. An unknown sort order or a cursor that
+          isn't for it raises ValueError.
         """
-
-        if isinstance(terms, str):
-            terms = [terms]
-        if isinstance(include_tags, str):
-            include_tags = [include_tags]
-        if isinstance(exclude_tags, str):
-            exclude_tags = [exclude_tags]
-        if isinstance(usernames, str):
-            usernames = [usernames]
-
-        # Convert usernames and tags to lowercase for case-insensitive search
-        usernames = [username.lower() for username in usernames] if usernames else []
-        include_tags = [tag.lower() for tag in include_tags] if include_tags else []
-        exclude_tags = [tag.lower() for tag in exclude_tags] if exclude_tags else []
-
-        queries = []
-        params = []
-        cur = self._db.cursor()
-
-        # AND-based Name & Description search
-        if terms:
-            term_conditions = " AND ".join(
-                [
-                    "(LOWER(Snippet.Name) LIKE LOWER(?) OR LOWER(Snippet.Description) LIKE LOWER(?))"
-                ]
-                * len(terms)
-            )
-            queries.append(f"({term_conditions})")
-            for term in terms:
-                params.extend(
-                    [f"%{term}%", f"%{term}%"]
-                )  # Both for name and description
-
-        user_conditions = []
-        for username in usernames:
-            cur.execute(
-                "SELECT ID FROM User WHERE LOWER(Name) = ?",
-                [username.lower()],
+        if clauses is None:
+            clauses = self._clauses_from_filters(
+                terms, include_tags, exclude_tags, usernames
             )
-            exact_match = cur.fetchone()
 
-            if exact_match:
-                user_conditions.append("Snippet.UserID = ?")
-                params.append(exact_match[0])
-            else:
-                user_conditions.append(
-                    "Snippet.UserID IN (SELECT ID FROM User WHERE Name LIKE ?)"
-                )
-                params.append("%" + username + "%")
+        # A canonical order lets differently ordered queries share a plan
+        clauses = [
+            tuple(sorted((kind, _fold_search_value(kind, value)) for kind, value in clause))
+            for clause in clauses
+        ]
+        excludes = [clause[0][1] for clause in clauses if clause[0][0] == "exclude"]
+        clauses = sorted(clause for clause in clauses if clause[0][0] != "exclude")
+        if excludes:
+            clauses.append((("exclude", excludes),))
 
-        if user_conditions:
-            queries.append(f"({' OR '.join(user_conditions)})")
-
-        # AND-based Tag Filtering (Must Contain All Tags)
-        if include_tags:
-            tag_conditions = []
-            for tag in include_tags:
-                cur.execute(
-                    "SELECT TagName FROM TagUse WHERE LOWER(TagName) = ?",
-                    [tag.lower()],
-                )
-                exact_match = cur.fetchone()
+        versions = (self.get_version("snippets")[0], self.get_version("profiles")[0])
+        users, tags = self._get_search_vocabulary(versions)
 
-                if exact_match:
-                    tag_conditions.append(
-                        "Snippet.ID IN (SELECT SnippetID FROM TagUse WHERE LOWER(TagName) = ?)"
-                    )
-                    params.append(tag.lower())
+        shape = []
+        params = []
+        for clause in clauses:
+            kinds = []
+            for kind, value in clause:
+                if kind == "term":
+                    params.append(f"%{value}%")
+                elif kind == "tag":
+                    # Partial tags match every tag containing them
+                    matches = [value]
+                    if value not in tags:
+                        matches = [tag for tag in tags if value in tag]
+                    params.append(json.dumps(matches))
+                elif kind == "exclude":
+                    params.append(json.dumps(value))
+                elif kind == "user":
+                    matches = [users[value]] if value in users else []
+                    if value not in users:
+                        # Partial usernames match every user whose name contains them
+                        matches = [id for name, id in users.items() if value in name]
+                    params.append(json.dumps(matches))
+                elif kind == "symbol":
+                    params.append(value)
                 else:
-                    tag_conditions.append(
-                        "Snippet.ID IN (SELECT SnippetID FROM TagUse WHERE LOWER(TagName) LIKE ?)"
-                    )
-                    params.append("%" + tag + "%")
-
-            if tag_conditions:
-                queries.append(f"({' AND '.join(tag_conditions)})")
-
-        # Exclude tags filtering (-tag)
-        if exclude_tags:
-            exclude_tags_match = ",".join(["?"] * len(exclude_tags))
-            queries.append(f"""
-                Snippet.ID NOT IN (
-                    SELECT DISTINCT SnippetID FROM TagUse WHERE LOWER(TagName) IN ({exclude_tags_match})
-                )
-            """)
-            params.extend(exclude_tags)
-
-        # Access control filter (public/private visibility)
-        if public:
-            access_filter = """
-                (Snippet.IsPublic = 1 OR EXISTS (
-                    SELECT 1 FROM SnippetPermissions AS P
-                    WHERE P.SnippetID = Snippet.ID AND P.UserID = ?
-                ))
-            """
-        else:
-            access_filter = "Snippet.UserID = ?"
-        queries.append(access_filter)
+                    # Code and regexes are checked against every snippet unless the
+                    # trigram index can narrow them down
+                    params.append(value)
+                    if kind == "code":
+                        index_query = code_search.substring_query(value)
+                    else:
+                        index_query = code_search.regex_query(value)
+                    if index_query is None:
+                        kind += "_scan"
+                    else:
+                        params.append(index_query)
+                kinds.append(kind)
+            shape.append(tuple(kinds))
+        shape = tuple(shape)
         params.append(viewer_id)
 
-        # Ensure there's at least one condition to prevent empty WHERE clause
-        if not queries:
-            queries.append(
-                "1=1"
-            )  # This prevents SQL syntax errors if no filters are applied
-
-        # Final SQL query with ordering: Name Matches First, Then Sort by Likes
-        query = f"""
-            SELECT Snippet.ID, Snippet.Name, Snippet.Code, Snippet.Description,
-                Snippet.UserID, Snippet.ParentSnippetID, Snippet.Date, Snippet.IsPublic,
-                (SELECT COUNT(*) FROM Like WHERE Like.SnippetID = Snippet.ID) AS like_count
-            FROM Snippet
-            WHERE {" AND ".join(queries)}
-            ORDER BY like_count DESC, Snippet.Date DESC
-            LIMIT 50
-        """
+        candidates = False
+        if session is not None:
+            search = {
+                "viewer_id": None if viewer_id is None else str(viewer_id),
+                "public": bool(public),
+                "clauses": [clause for clause in clauses if clause[0][0] != "exclude"]
+                + [(("exclude", value),) for value in excludes],
+                "versions": versions,
+            }
+            candidates = self._narrow_search(session, shape, public, params, search)
+            if candidates is not None:
+                shape, params = (), [candidates]
+
+        symbols = [
+            value for clause in clauses for kind, value in clause if kind == "symbol"
+        ]
+        ranked = bool(symbols) and sort == "relevance"
+        if ranked:
+            params.append(json.dumps(symbols))
+        columns = _sort_columns(sort, ranked)
+        if after:
+            params += _decode_cursor(after, sort, len(columns))
+        params.append(limit + 1)
 
-        cur.execute(query, params)
+        cur = self._db.cursor()
+        # Candidates are matches the viewer was just found to have access to
+        plan = _search_plan(
+            shape,
+            public,
+            bool(candidates),
+            True,
+            ranked,
+            sort,
+            bool(after),
+            checked=bool(candidates),
+        )
+        cur.execute(plan, params)
         results = cur.fetchall()
 
+        next_cursor = None
+        if len(results) > limit:
+            results = results[:limit]
+            next_cursor = _encode_cursor(sort, results[-1][-len(columns) :])
+
         snippets_list = []
         for res in results:
             user_details = self.get_user_details(res[4])  # Fetch user details
@@ -831,14 +2422,15 @@ class Data:
                 {
                     "id": res[0],
                     "name": res[1],
-                    "code": res[2],
+                    "code_preview": res[2],
+                    "code_truncated": bool(res[8]),
                     "description": res[3],
                     "user_id": res[4],
                     "parent_snippet_id": res[5],
-                    "date": res[6],
+                    "date": _date_text(res[6]),
                     "is_public": bool(res[7]),
                     "tags": self.get_tags_for_snippet(res[0]),  # Fetch snippet tags
-                    "likes": res[8],  # Sort by like count
+                    "likes": res[9],  # Sort by like count
                     "is_liked": self.is_liked(
                         res[0], viewer_id
                     ),  # Check if the user liked it
@@ -846,7 +2438,139 @@ class Data:
                 }
             )
 
-        return snippets_list
+        return {"snippets": snippets_list, "next": next_cursor}
+
+    def _clauses_from_filters(self, terms, include_tags, exclude_tags, usernames):
+        """Converts separate search filters to clauses like `search_query.parse`'s."""
+        if isinstance(terms, str):
+            terms = [terms]
+        if isinstance(include_tags, str):
+            include_tags = [include_tags]
+        if isinstance(exclude_tags, str):
+            exclude_tags = [exclude_tags]
+        if isinstance(usernames, str):
+            usernames = [usernames]
+
+        clauses = [(("term", term),) for term in terms or [] if term]
+        clauses += [(("tag", tag.lower()),) for tag in include_tags or []]
+        clauses += [(("exclude", tag.lower()),) for tag in exclude_tags or []]
+        if usernames:
+            clauses.append(tuple(("user", name.lower()) for name in usernames))
+        return clauses
+
+    def _get_search_vocabulary(self, versions):
+        """
+        Returns every user's ID keyed by lowercased name, and the set of every
+        lowercased tag name in use, reloading them if `versions` are newer.
+        """
+        snippets_version, profiles_version = versions
+        cur = self._db.cursor()
+
+        loaded = _search_vocabulary.get("profiles")
+        if loaded is None or loaded[0] != profiles_version:
+            cur.execute("SELECT LOWER(Name), ID FROM User")
+            loaded = _search_vocabulary["profiles"] = (profiles_version, dict(cur))
+        users = loaded[1]
+
+        loaded = _search_vocabulary.get("snippets")
+        if loaded is None or loaded[0] != snippets_version:
+            cur.execute(
+                """
+                SELECT NameNorm FROM Tag
+                WHERE EXISTS (SELECT 1 FROM TagUse WHERE TagID = Tag.ID)
+                """
+            )
+            tags = frozenset(row[0] for row in cur)
+            loaded = _search_vocabulary["snippets"] = (snippets_version, tags)
+        return users, loaded[1]
+
+    def _get_word_indexes(self):
+        """
+        Returns the in-memory indexes of names, building them if the app didn't
+        at startup with `preload_word_indexes`.
+        """
+        with _word_lock:
+            if _word_indexes:
+                return _word_indexes
+
+            cur = self._db.cursor()
+            cur.execute("SELECT Name FROM User")
+            _word_indexes["users"] = fuzzy.FuzzyIndex(row[0] for row in cur)
+            _word_indexes["tags"] = fuzzy.FuzzyIndex(preset_tags)
+            _word_indexes["names"] = fuzzy.FuzzyIndex()
+            _word_indexes["tag_dictionary"] = tag_dictionary.TagDictionary(preset_tags)
+            _word_indexes["snippets"] = {}
+
+            cur.execute(
+                """
+                SELECT Snippet.ID, Snippet.Name, json_group_array(Tag.Name)
+                FROM Snippet
+                LEFT JOIN TagUse ON TagUse.SnippetID = Snippet.ID
+                LEFT JOIN Tag ON Tag.ID = TagUse.TagID
+                WHERE Snippet.IsPublic = 1
+                GROUP BY Snippet.ID
+                """
+            )
+            for snippet_id, name, tags in cur.fetchall():
+                tags = [tag for tag in json.loads(tags) if tag is not None]
+                _index_public_snippet(snippet_id, name, tags)
+            return _word_indexes
+
+    def _refresh_indexed_snippet(self, snippet_id):
+        """Updates a saved or deleted snippet in the in-memory indexes."""
+        with _word_lock:
+            if not _word_indexes:
+                return  # They'll be built with the change
+
+            _unindex_public_snippet(int(snippet_id))
+            cur = self._db.cursor()
+            cur.execute(
+                "SELECT Name FROM Snippet WHERE ID = ? AND IsPublic = 1", [snippet_id]
+            )
+            row = cur.fetchone()
+            if row is not None:
+                cur.execute(
+                    """
+                    SELECT Tag.Name FROM TagUse JOIN Tag ON Tag.ID = TagUse.TagID
+                    WHERE TagUse.SnippetID = ?
+                    """,
+                    [snippet_id],
+                )
+                tags = [tag for tag, in cur.fetchall()]
+                _index_public_snippet(int(snippet_id), row[0], tags)
+
+    def _narrow_search(self, session, shape, public, params, search):
+        """
+        Finds every snippet matching a search, checking only the snippets that
+        matched the session's last search if this one narrows it down. Remembers
+        the matches for the session's next search, and returns them as a JSON list,
+        or None if there are too many.
+        """
+        # Matches are checked against the viewer's access in memory, unless the
+        # search doesn't narrow anything down and would match every snippet
+        checked = public and bool(shape)
+        if checked:
+            params = params[:-1]  # The viewer's ID
+
+        candidates = False
+        previous = search_states.get(session)
+        if previous is not None and _narrows(search, previous):
+            candidates = True
+            params = params + [previous["ids"]]
+
+        cur = self._db.cursor()
+        cur.execute(
+            _search_plan(shape, public, candidates, False, checked=checked), params
+        )
+        ids = [row[0] for row in cur.fetchall()]
+        if checked:
+            ids = self._get_access_index().filter(ids, search["viewer_id"], owned=False)
+        if len(ids) > SEARCH_STATE_MAX_IDS:
+            return None  # Too many to remember or pass around
+
+        search["ids"] = json.dumps(ids)
+        search_states.set(session, search)
+        return search["ids"]
 
     def smart_search_snippets(self, query, viewer_id=None):
         """
@@ -855,7 +2579,8 @@ class Data:
 
         - "id": The integer ID of the snippet.
         - "name": The name of the snippet.
-        - "code": The content of the snippet.
+        - "code_preview": The start of the snippet's code, from `code_preview`.
+        - "code_truncated": Whether the preview is missing any of the code.
         - "description": The user-provided description.
         - "user_id": The author's integer ID.
         - "parent_snippet_id": The integer ID of the parent snippet or `None`.
@@ -882,29 +2607,34 @@ class Data:
             SELECT
                 Snippet.ID,
                 Snippet.Name,
-                Snippet.Code,
+                Snippet.CodePreview,
                 Snippet.Description,
                 Snippet.UserID,
                 Snippet.ParentSnippetID,
                 Snippet.Date,
-                Snippet.IsPublic
+                Snippet.IsPublic,
+                Snippet.CodeTruncated
             FROM DescMatches
             JOIN Snippet ON Snippet.ID = DescMatches.SnippetID
             """,
             [query_embedding],
         )
 
+        index = self._get_access_index()
         results = []
         for res in cur.fetchall():
+            if not index.can_view(res[0], viewer_id):
+                continue
             results.append(
                 {
                     "id": res[0],
                     "name": res[1],
-                    "code": res[2],
+                    "code_preview": res[2],
+                    "code_truncated": bool(res[8]),
                     "description": res[3],
                     "user_id": res[4],
                     "parent_snippet_id": res[5],
-                    "date": res[6],
+                    "date": _date_text(res[6]),
                     "is_public": bool(res[7]),
                     "tags": self.get_tags_for_snippet(res[0]),
                     "likes": self.get_likes(res[0]),
@@ -931,6 +2661,8 @@ class Data:
                 [snippet_id, user_id],
             )
             self._db.commit()
+            self._access_synced = False
+            self._snippets.clear()
             return True
         except sqlite3.IntegrityError:
             # Permission already exists
@@ -952,6 +2684,8 @@ class Data:
         )
         if cur.rowcount > 0:
             self._db.commit()
+            self._access_synced = False
+            self._snippets.clear()
             return True
         return False
 
@@ -971,6 +2705,8 @@ class Data:
         )
         count = cur.rowcount
         self._db.commit()
+        self._access_synced = False
+        self._snippets.clear()
         return count
 
     def user_has_permission(self, snippet_id, user_id):
@@ -979,17 +2715,7 @@ class Data:
 
         Returns True if the user has access, False otherwise.
         """
-        cur = self._db.cursor()
-        cur.execute(
-            """
-            SELECT IsPublic OR P.UserID FROM Snippet as S
-            LEFT JOIN SnippetPermissions AS P ON P.SnippetID = S.ID AND P.UserID = ?
-            WHERE S.ID = ?
-            """,
-            [user_id, snippet_id],
-        )
-        result = cur.fetchone()
-        return result is not None and result[0]
+        return self._get_access_index().can_view(snippet_id, user_id)
 
     def get_snippets_user_has_access_to(self, user_id):
         """
@@ -1026,32 +2752,63 @@ class Data:
 
         return [{"id": row[0], "name": row[1]} for row in cur.fetchall()]
 
-    def get_all_users_excluding_current(self, current_user_id):
-        """Fetches all users except the current user."""
+    def find_users_by_prefix(self, prefix, current_user_id, limit, after=None):
+        """
+        Returns a page of up to `limit` users, other than the current user, whose
+        names start with `prefix` ignoring case, in order of name:
+
+        - "users": A list of dictionaries with each user's "id" and "name".
+        - "next": A cursor to pass as `after` for the next page, or None if this
+          is the last one.
+        """
+        after_name, after_id = "", 0
+        if after:
+            after_id, _, after_name = after.partition(":")
+            after_id = int(after_id) if after_id.isdigit() else 0
+
+        # A range rather than LIKE, so that the NOCASE index on Name is used
         cur = self._db.cursor()
         cur.execute(
             """
-            SELECT ID, Name FROM User WHERE ID != ?
+            SELECT ID, Name FROM User
+            WHERE Name >= ?1 COLLATE NOCASE AND Name < ?1 || char(1114111) COLLATE NOCASE
+                AND (Name COLLATE NOCASE, ID) > (?2, ?3)
+                AND ID != ?4
+            ORDER BY Name COLLATE NOCASE, ID
+            LIMIT ?5
             """,
-            [current_user_id],
+            [prefix, after_name, after_id, current_user_id, limit + 1],
         )
-        return [{"id": row[0], "name": row[1]} for row in cur.fetchall()]
+        users = [{"id": row[0], "name": row[1]} for row in cur.fetchall()]
+
+        next_cursor = None
+        if len(users) > limit:
+            users = users[:limit]
+            next_cursor = f"{users[-1]['id']}:{users[-1]['name']}"
+        return {"users": users, "next": next_cursor}
 
     # Finds the tags by snippetID
     def get_tags_for_snippet(self, snippet_id):
         """
         Fetches all tags associated with a given snippet.
         """
+        snippet_id = int(snippet_id)
+        if snippet_id in self._snippet_tags:
+            return self._snippet_tags[snippet_id]
+
         cur = self._db.cursor()
         cur.execute(
             """
-            SELECT TagName FROM TagUse WHERE SnippetID = ?
+            SELECT Tag.Name FROM TagUse JOIN Tag ON Tag.ID = TagUse.TagID
+            WHERE TagUse.SnippetID = ?
             """,
             [snippet_id],
         )
         tags = cur.fetchall()
 
-        return [tag[0] for tag in tags]  # Convert tuple list to a simple list
+        # Convert tuple list to a simple list
+        self._snippet_tags[snippet_id] = [tag[0] for tag in tags]
+        return self._snippet_tags[snippet_id]
 
     def get_tags(self, id):
         """
@@ -1064,10 +2821,11 @@ class Data:
         cur.execute(
             """
             SELECT
-                TagName
+                Tag.Name
             FROM TagUse
-            WHERE SnippetID = ?
-            ORDER BY TagName
+            JOIN Tag ON Tag.ID = TagUse.TagID
+            WHERE TagUse.SnippetID = ?
+            ORDER BY Tag.Name
             """,
             [id],
         )
@@ -1077,18 +2835,18 @@ class Data:
 
     def get_popular_public_tags(self):
         """
-        Gets The Top 10 Most Popular Global Snippets
-        Returns a list of tag and count
+        Gets The Top 10 Most Popular Tags on public snippets
+        Returns a list of tag names
         """
         cur = self._db.cursor()
         cur.execute(
             """
-            SELECT TAGUSE.TAGNAME, count(*) AS tagCount
-            FROM TAGUSE
-            GROUP BY TAGUSE.TAGNAME 
-            ORDER BY tagCount DESC
-            LIMIT 10;
+            SELECT Tag.Name FROM TagStats JOIN Tag ON Tag.ID = TagStats.TagID
+            WHERE TagStats.UserID = ? AND TagStats.PublicCount > 0
+            ORDER BY TagStats.PublicCount DESC
+            LIMIT 10
             """,
+            [_ALL_USERS],
         )
         return [row[0] for row in cur.fetchall()]
 
@@ -1100,18 +2858,11 @@ class Data:
         cur = self._db.cursor()
         cur.execute(
             """
-            SELECT TAGUSE.TAGNAME, count(*) AS tagCount
-            FROM TAGUSE
-            WHERE TAGUSE.SNIPPETID 
-            IN (
-              SELECT SNIPPET.ID 
-              FROM SNIPPET
-              WHERE SNIPPET.USERID  = :ok
-              AND SNIPPET.ISPUBLIC = 1
-            )
-            GROUP BY TAGUSE.TAGNAME 
-            ORDER BY tagCount DESC
-            LIMIT 10;
+            SELECT Tag.Name, TagStats.PublicCount
+            FROM TagStats JOIN Tag ON Tag.ID = TagStats.TagID
+            WHERE TagStats.UserID = ? AND TagStats.PublicCount > 0
+            ORDER BY TagStats.PublicCount DESC
+            LIMIT 10
             """,
             [user_id],
         )
@@ -1119,25 +2870,18 @@ class Data:
 
     def get_profile_all_tags(self, user_id):
         """
-        Takes user_id and returns top 10 tags based on all their snippest
+        Takes user_id and returns top 10 tags based on all their snippets
         Returns top 10
         """
         cur = self._db.cursor()
         cur.execute(
             """
-          SELECT TAGUSE.TAGNAME, count(*) AS tagCount
-          FROM TAGUSE
-          WHERE TAGUSE.SNIPPETID 
-          IN (
-            SELECT SNIPPET.ID 
-            FROM SNIPPET
-            WHERE SNIPPET.USERID  = :ok
-            AND SNIPPET.ISPUBLIC = 1
-          )
-          GROUP BY TAGUSE.TAGNAME 
-          ORDER BY tagCount DESC
-          LIMIT 10;
-          """,
+            SELECT Tag.Name, TagStats.TotalCount
+            FROM TagStats JOIN Tag ON Tag.ID = TagStats.TagID
+            WHERE TagStats.UserID = ?
+            ORDER BY TagStats.TotalCount DESC
+            LIMIT 10
+            """,
             [user_id],
         )
         return [{"Name": row[0], "Count": row[1]} for row in cur.fetchall()]
@@ -1166,12 +2910,15 @@ class Data:
             SET 
                 Name = ?,
                 Code = ?,
+                CodePreview = ?,
+                CodeTruncated = ?,
                 Description = ?,
-                Date = datetime('now')
+                Date = CAST(strftime('%s', 'now') AS INTEGER)
             WHERE ID = ? AND UserID = ?
             """,
-            [name, code, description or "", id, user_id],
+            [name, code, *code_preview(code), description or "", id, user_id],
         )
+        updated = cur.rowcount > 0
 
         # Delete old tags
         cur.execute(
@@ -1184,13 +2931,9 @@ class Data:
 
         # Add new tags
         if tags is not None and tags != "":
-            cur.executemany(
-                """
-                INSERT INTO TagUse (SnippetID, TagName)
-                VALUES (?, ?)
-                """,
-                [(id, tag) for tag in tags],
-            )
+            self._add_tags(cur, id, tags)
+        if updated:
+            self._index_symbols(cur, id, code, tags)
 
         # Create a "summary" of the snippet description for smart searches
         # Only generate embeddings for public snippets
@@ -1212,6 +2955,9 @@ class Data:
             )
 
         self._db.commit()
+        self._access_synced = False
+        self._snippet_tags.pop(int(id), None)
+        invalidate_popular()
 
         self.set_snippet_visibility(id, is_public)
         self.clear_snippet_permission(id)
@@ -1236,7 +2982,16 @@ class Data:
             [id, user_id],
         )
 
+        # Embeddings live in a virtual table, so they aren't removed by the cascade
+        if cur.rowcount > 0:
+            cur.execute("DELETE FROM SnippetEmbedding WHERE SnippetID = ?", [id])
+
         self._db.commit()
+        self._access_synced = False
+        self._snippets.clear()
+        self._snippet_tags.pop(int(id), None)
+        invalidate_popular()
+        self._refresh_indexed_snippet(id)
 
     # Comment Functions
     def add_comment(self, snippet_id, user_id, comment, parent_id=None):
@@ -1251,25 +3006,56 @@ class Data:
         )
         self._db.commit()
 
-    def get_comments(self, snippet_id):
-        """Fetches all comments and their replies for a snippet."""
+    def get_comments(self, snippet_id, limit=COMMENT_PAGE_SIZE, after=None):
+        """
+        Fetches a page of a snippet's comments, oldest first, with every reply
+        to them however deeply nested:
+
+        - "comments": Up to `limit` top-level comments. Each has "id", "content",
+          "date", "user_id", "parent_id", "user_name", "profile_picture", its
+          "depth" below the top level, its "replies" oldest first in the same
+          form, and "reply_count", the number of replies to it at any depth.
+        - "next": A cursor to pass as `after` for the next page, or None if this
+          is the last one.
+
+        A cursor that isn't one of these raises ValueError.
+        """
+        after_id = _decode_cursor(after, "comments", 1)[0] if after else 0
+
+        # Each comment's path is the zero-padded IDs of the comments above it and
+        # its own, so sorting by path lists every reply under its parent, oldest
+        # first. One more thread than asked for is found to tell if there's more.
         cur = self._db.cursor()
         cur.execute(
             """
-            SELECT Comments.ID, Comments.Content, Comments.Date, Comments.UserID, Comments.ParentCommentID, 
-                User.Name, User.ProfilePicture
-            FROM Comments
+            WITH RECURSIVE Thread(ID, Depth, Path) AS (
+                SELECT * FROM (
+                    SELECT ID, 0, printf('%010d', ID) FROM Comments
+                    WHERE SnippetID = ?1 AND ParentCommentID IS NULL AND ID > ?2
+                    ORDER BY ID
+                    LIMIT ?3
+                )
+                UNION ALL
+                SELECT Comments.ID, Thread.Depth + 1,
+                    Thread.Path || '/' || printf('%010d', Comments.ID)
+                FROM Comments
+                JOIN Thread ON Comments.SnippetID = ?1
+                    AND Comments.ParentCommentID = Thread.ID
+            )
+            SELECT Comments.ID, Comments.Content, Comments.Date, Comments.UserID,
+                Comments.ParentCommentID, User.Name, User.ProfilePicture, Thread.Depth
+            FROM Thread
+            JOIN Comments ON Comments.ID = Thread.ID
             JOIN User ON Comments.UserID = User.ID
-            WHERE Comments.SnippetID = ?
-            ORDER BY Comments.ParentCommentID NULLS FIRST, Comments.Date ASC
+            ORDER BY Thread.Path
             """,
-            [snippet_id],
+            [snippet_id, after_id, limit + 1],
         )
 
-        comments = cur.fetchall()
-        comment_tree = {}
-        for row in comments:
-            comment_data = {
+        comments = {}
+        roots = []
+        for row in cur.fetchall():
+            comment = {
                 "id": row[0],
                 "content": row[1],
                 "date": row[2],
@@ -1277,21 +3063,27 @@ class Data:
                 "parent_id": row[4],
                 "user_name": row[5],
                 "profile_picture": row[6],
+                "depth": row[7],
                 "replies": [],
+                "reply_count": 0,
             }
-
-            if comment_data["parent_id"] is None:
-                comment_tree[comment_data["id"]] = comment_data
+            comments[comment["id"]] = comment
+            if comment["parent_id"] is None:
+                roots.append(comment)
             else:
-                if comment_data["parent_id"] in comment_tree:
-                    comment_tree[comment_data["parent_id"]]["replies"].append(
-                        comment_data
-                    )
-                else:
-                    comment_tree[comment_data["parent_id"]] = {
-                        "replies": [comment_data]
-                    }
-        return list(comment_tree.values())
+                # Parents always come before their replies
+                comments[comment["parent_id"]]["replies"].append(comment)
+
+        # Count replies from the deepest up
+        for comment in reversed(list(comments.values())):
+            if comment["parent_id"] is not None:
+                comments[comment["parent_id"]]["reply_count"] += 1 + comment["reply_count"]
+
+        next_cursor = None
+        if len(roots) > limit:
+            roots = roots[:limit]
+            next_cursor = _encode_cursor("comments", [roots[-1]["id"]])
+        return {"comments": roots, "next": next_cursor}
 
     def get_comment_by_id(self, comment_id):
         """Fetches a specific comment by its ID."""
@@ -1317,29 +3109,22 @@ class Data:
         return None  # Comment not found
 
     def delete_comment(self, comment_id):
-        """Deletes a comment and all its replies recursively."""
+        """Deletes a comment and all its replies, however deeply nested."""
         cur = self._db.cursor()
-
-        cur.execute(
-            """
-            SELECT ID FROM Comments WHERE ParentCommentID = ?
-            """,
-            [comment_id],
-        )
-        replies = cur.fetchall()
-
-        # Recursively delete each reply
-        for reply in replies:
-            self.delete_comment(reply[0])
-
-        # Finally, delete the parent comment itself
         cur.execute(
             """
-            DELETE FROM Comments WHERE ID = ?
+            WITH RECURSIVE Subtree(ID, SnippetID) AS (
+                SELECT ID, SnippetID FROM Comments WHERE ID = ?
+                UNION ALL
+                SELECT Comments.ID, Comments.SnippetID
+                FROM Comments
+                JOIN Subtree ON Comments.SnippetID = Subtree.SnippetID
+                    AND Comments.ParentCommentID = Subtree.ID
+            )
+            DELETE FROM Comments WHERE ID IN (SELECT ID FROM Subtree)
             """,
             [comment_id],
         )
-
         self._db.commit()
 
     # Like Functions
@@ -1359,7 +3144,11 @@ class Data:
         except sqlite3.IntegrityError:
             return False
 
+        self._add_to_taste(cur, snippet_id, user_id)
+
         self._db.commit()
+        self._snippets.clear()
+        invalidate_popular()
         return True
 
     def remove_like(self, snippet_id, user_id):
@@ -1368,7 +3157,13 @@ class Data:
         cur.execute(
             "DELETE FROM Like WHERE SnippetID = ? AND UserID = ?", [snippet_id, user_id]
         )
+        removed = cur.rowcount > 0
+        if removed:
+            self._remove_from_taste(cur, snippet_id, user_id)
         self._db.commit()
+        if removed:
+            self._snippets.clear()
+            invalidate_popular()
 
     def get_likes(self, snippet_id):
         """Returns the number of likes a snippet has."""
@@ -1378,6 +3173,21 @@ class Data:
 
         return cur.fetchone()[0]
 
+    def get_liked_snippet_ids(self, user_id, snippet_ids):
+        """Returns the set of snippet IDs from `snippet_ids` that the user has liked."""
+        if user_id is None or not snippet_ids:
+            return set()
+
+        cur = self._db.cursor()
+        cur.execute(
+            f"""
+            SELECT SnippetID FROM Like
+            WHERE UserID = ? AND SnippetID IN ({",".join(["?"] * len(snippet_ids))})
+            """,
+            [user_id, *snippet_ids],
+        )
+        return {row[0] for row in cur.fetchall()}
+
     def is_liked(self, snippet_id, user_id):
         """Returns True if the user has liked the snippet, False otherwise."""
         if user_id is None:
@@ -1389,3 +3199,324 @@ class Data:
             [snippet_id, user_id],
         )
         return cur.fetchone()[0] > 0
+
+    ## RECOMMENDATIONS ##
+
+    def _add_to_taste(self, cur, snippet_id, user_id):
+        """
+        Adds a liked snippet's embedding to the user's running embedding sum.
+        Snippets without an embedding (private ones) are skipped.
+        """
+        cur.execute(
+            """
+            INSERT INTO UserTaste (UserID, LikeCount, EmbeddingSum)
+            SELECT ?, 1, Embedding
+            FROM SnippetEmbedding
+            WHERE SnippetID = ?
+            ON CONFLICT (UserID) DO UPDATE SET
+                LikeCount = LikeCount + 1,
+                EmbeddingSum = vec_add(EmbeddingSum, excluded.EmbeddingSum)
+            """,
+            [user_id, snippet_id],
+        )
+
+    def _remove_from_taste(self, cur, snippet_id, user_id):
+        """Subtracts an unliked snippet's embedding from the user's running embedding sum."""
+        cur.execute(
+            """
+            UPDATE UserTaste
+            SET
+                LikeCount = LikeCount - 1,
+                EmbeddingSum = vec_sub(EmbeddingSum, E.Embedding)
+            FROM (SELECT Embedding FROM SnippetEmbedding WHERE SnippetID = ?) AS E
+            WHERE UserID = ?
+            """,
+            [snippet_id, user_id],
+        )
+        cur.execute(
+            "DELETE FROM UserTaste WHERE UserID = ? AND LikeCount <= 0", [user_id]
+        )
+
+    def refresh_trending(self):
+        """
+        Recomputes the trending scores of snippets and users for the current time.
+        Scores are only updated as snippets are liked, so this is run every
+        TRENDING_REFRESH_SECONDS to let older snippets fall down the rankings.
+        """
+        self._db.executescript(
+            f"BEGIN; {_TRENDING_REFRESH_SQL} {_bump_version_sql('trending')} COMMIT;"
+        )
+        invalidate_popular()
+
+    def refresh_recommendations(self, count=RECOMMENDATION_COUNT):
+        """
+        Precomputes every user's "for you" feed.
+
+        Each user's embedding sum is rebuilt from their current likes, since edits and
+        deletions can leave the incrementally maintained sums out of date. The normalized
+        sum points in the same direction as the centroid of their liked snippets, so the
+        nearest embeddings to it become the user's recommendations, excluding their own
+        and already-liked snippets.
+        """
+        cur = self._db.cursor()
+
+        cur.execute("DELETE FROM UserTaste")
+        cur.execute("SELECT SnippetID, UserID FROM Like")
+        for like in cur.fetchall():
+            self._add_to_taste(cur, like[0], like[1])
+
+        cur.execute("DELETE FROM Recommendation")
+        cur.execute(
+            """
+            SELECT UserTaste.UserID, UserTaste.LikeCount + (
+                SELECT COUNT(*) FROM Snippet
+                WHERE Snippet.UserID = UserTaste.UserID AND Snippet.IsPublic = 1
+            )
+            FROM UserTaste
+            """
+        )
+        for user_id, excluded_count in cur.fetchall():
+            # Over-fetch so that enough candidates survive the exclusions
+            k = min(count + excluded_count, _MAX_KNN)
+            cur.execute(
+                """
+                INSERT INTO Recommendation (UserID, SnippetID, Distance)
+                SELECT ?, Candidates.SnippetID, Candidates.distance
+                FROM (
+                    SELECT SnippetID, distance
+                    FROM SnippetEmbedding
+                    WHERE Embedding MATCH (
+                        SELECT vec_normalize(EmbeddingSum) FROM UserTaste WHERE UserID = ?
+                    ) AND k = ?
+                ) AS Candidates
+                JOIN Snippet ON Snippet.ID = Candidates.SnippetID
+                WHERE Snippet.UserID IS NOT ?
+                AND NOT EXISTS (
+                    SELECT 1 FROM Like
+                    WHERE Like.SnippetID = Candidates.SnippetID AND Like.UserID = ?
+                )
+                ORDER BY Candidates.distance
+                LIMIT ?
+                """,
+                [user_id, user_id, k, user_id, user_id, count],
+            )
+
+        self._db.commit()
+        cur.executescript(_bump_version_sql("recommendations"))
+
+    def get_recommended_snippets(self, user_id, limit=RECOMMENDATION_COUNT):
+        """
+        Gets a user's precomputed "for you" feed, closest matches first.
+        Run `refresh_recommendations` to update it.
+
+        Returns Snippet Card Info
+        """
+        cur = self._db.cursor()
+        results = cur.execute(
+            """
+            SELECT Snippet.ID, Snippet.Name, Snippet.CodePreview, Snippet.Description,
+                Snippet.UserID, Snippet.ParentSnippetID, Snippet.Date, Snippet.IsPublic,
+                Snippet.CodeTruncated
+            FROM Recommendation
+            JOIN Snippet ON Snippet.ID = Recommendation.SnippetID
+            WHERE Recommendation.UserID = ? AND Snippet.IsPublic = 1
+            AND NOT EXISTS (
+                SELECT 1 FROM Like
+                WHERE Like.SnippetID = Snippet.ID AND Like.UserID = Recommendation.UserID
+            )
+            ORDER BY Recommendation.Distance
+            LIMIT ?
+            """,
+            [user_id, limit],
+        ).fetchall()
+
+        snippets_list = []
+        for res in results:
+            user_details = self.get_user_details(res[4])  # Fetch user details
+            snippets_list.append(
+                {
+                    "id": res[0],
+                    "name": res[1],
+                    "code_preview": res[2],
+                    "code_truncated": bool(res[8]),
+                    "description": res[3],
+                    "user_id": res[4],
+                    "parent_snippet_id": res[5],
+                    "date": _date_text(res[6]),
+                    "is_public": bool(res[7]),
+                    "tags": self.get_tags_for_snippet(res[0]),  # Fetch snippet tags
+                    "likes": self.get_likes(res[0]),
+                    "is_liked": False,  # Liked snippets are never recommended
+                    "author": user_details,  # Attach user details
+                }
+            )
+
+        return snippets_list
+
+
+## BENCHMARK ##
+
+# The first storage layout's link tables, which _STORAGE_V2_SQL migrates from
+_STORAGE_V1_SQL = """
+    CREATE TABLE TagUse (
+        SnippetID INTEGER,
+        TagName TEXT,
+        PRIMARY KEY (SnippetID, TagName),
+        FOREIGN KEY (SnippetID) REFERENCES Snippet(ID) ON DELETE CASCADE
+    );
+    CREATE TABLE Like (
+        SnippetID INTEGER NOT NULL,
+        UserID INTEGER NOT NULL,
+        FOREIGN KEY (SnippetID) REFERENCES Snippet(ID) ON DELETE CASCADE,
+        FOREIGN KEY (UserID) REFERENCES User(ID) ON DELETE CASCADE,
+        UNIQUE (SnippetID, UserID)
+    );
+    CREATE TABLE SnippetPermissions (
+        SnippetID INTEGER,
+        UserID INTEGER,
+        PRIMARY KEY (SnippetID, UserID),
+        FOREIGN KEY (SnippetID) REFERENCES Snippet(ID) ON DELETE CASCADE,
+        FOREIGN KEY (UserID) REFERENCES User(ID) ON DELETE CASCADE
+    );
+"""
+
+# The queries timed in each layout, with the parameters they take
+_STORAGE_QUERIES = {
+    "tag search": (
+        """
+        SELECT COUNT(*) FROM Snippet WHERE Snippet.ID IN (
+            SELECT SnippetID FROM TagUse
+            WHERE LOWER(TagName) IN (SELECT value FROM json_each(?))
+        )
+        """,
+        """
+        SELECT COUNT(*) FROM Snippet WHERE Snippet.ID IN (
+            SELECT TagUse.SnippetID FROM Tag JOIN TagUse ON TagUse.TagID = Tag.ID
+            WHERE Tag.NameNorm IN (SELECT value FROM json_each(?))
+        )
+        """,
+        "tags",
+    ),
+    "snippet tags": (
+        "SELECT TagName FROM TagUse WHERE SnippetID = ?",
+        """
+        SELECT Tag.Name FROM TagUse JOIN Tag ON Tag.ID = TagUse.TagID
+        WHERE TagUse.SnippetID = ?
+        """,
+        "snippet",
+    ),
+    "liked snippets": (
+        "SELECT SnippetID FROM Like WHERE UserID = ? AND SnippetID BETWEEN ? AND ?",
+        "SELECT SnippetID FROM Like WHERE UserID = ? AND SnippetID BETWEEN ? AND ?",
+        "user_range",
+    ),
+    "shared with user": (
+        "SELECT COUNT(*) FROM SnippetPermissions WHERE UserID = ?",
+        "SELECT COUNT(*) FROM SnippetPermissions WHERE UserID = ?",
+        "user",
+    ),
+    "snippets this week": (
+        "SELECT COUNT(*) FROM Snippet WHERE Date >= datetime('now', '-7 days')",
+        f"SELECT COUNT(*) FROM Snippet WHERE Date >= {_NOW_SQL} - 7 * 24 * 60 * 60",
+        None,
+    ),
+}
+
+
+def benchmark_storage(count=100_000, repeat=200, seed=0):
+    """
+    Builds `count` synthetic snippets with tags, likes and permitted users in the
+    first storage layout, migrates them with _STORAGE_V2_SQL, and compares the
+    two. Returns a row per measurement of its name, unit, and value before and
+    after: the database's size, then the time each of `_STORAGE_QUERIES` takes
+    `repeat` times in milliseconds. Also returns the results of every query run,
+    as a `(before, after)` pair of lists that match if the migration kept them.
+    """
+    rng = random.Random(seed)
+    user_count = max(count // 20, 10)
+    db = sqlite3.connect(":memory:")
+    db.executescript(
+        """
+        CREATE TABLE User (ID INTEGER PRIMARY KEY, Name TEXT);
+        CREATE TABLE Snippet (
+            ID INTEGER PRIMARY KEY, UserID INTEGER, Date, IsPublic BOOLEAN
+        );
+        CREATE INDEX SnippetNewest ON Snippet(Date);
+        """
+        + _STORAGE_V1_SQL
+    )
+
+    now = datetime.datetime.now(datetime.timezone.utc)
+    db.executemany(
+        "INSERT INTO User (ID, Name) VALUES (?, ?)",
+        [(id, f"user{id}") for id in range(1, user_count + 1)],
+    )
+    db.executemany(
+        "INSERT INTO Snippet (ID, UserID, Date, IsPublic) VALUES (?, ?, ?, ?)",
+        [
+            (
+                id,
+                rng.randint(1, user_count),
+                (now - datetime.timedelta(seconds=rng.randint(0, 10**8))).strftime(
+                    "%Y-%m-%d %H:%M:%S"
+                ),
+                rng.random() < 0.7,
+            )
+            for id in range(1, count + 1)
+        ],
+    )
+    db.executemany(
+        "INSERT OR IGNORE INTO TagUse (SnippetID, TagName) VALUES (?, ?)",
+        [
+            (id, tag)
+            for id in range(1, count + 1)
+            for tag in rng.sample(preset_tags, rng.randint(1, 5))
+        ],
+    )
+    db.executemany(
+        "INSERT OR IGNORE INTO Like (SnippetID, UserID) VALUES (?, ?)",
+        [
+            (rng.randint(1, count), rng.randint(1, user_count))
+            for _ in range(count * 3)
+        ],
+    )
+    db.executemany(
+        "INSERT OR IGNORE INTO SnippetPermissions (SnippetID, UserID) VALUES (?, ?)",
+        [(rng.randint(1, count), rng.randint(1, user_count)) for _ in range(count // 2)],
+    )
+    db.commit()
+
+    params = {
+        "tags": lambda: [json.dumps([rng.choice(preset_tags).lower()])],
+        "snippet": lambda: [rng.randint(1, count)],
+        "user": lambda: [rng.randint(1, user_count)],
+        "user_range": lambda: [
+            rng.randint(1, user_count),
+            *sorted(rng.sample(range(1, count + 1), 2)),
+        ],
+        None: lambda: [],
+    }
+
+    def measure(layout):
+        db.execute("VACUUM")
+        (pages,) = db.execute("PRAGMA page_count").fetchone()
+        (page_size,) = db.execute("PRAGMA page_size").fetchone()
+        measurements = [("database size", "KiB", pages * page_size / 1024)]
+        results = []
+        for name, queries in _STORAGE_QUERIES.items():
+            rng.seed(seed)
+            runs = [params[queries[2]]() for _ in range(repeat)]
+            started = time.perf_counter()
+            for run in runs:
+                results.append(sorted(db.execute(queries[layout], run).fetchall()))
+            measurements.append((name, "ms", (time.perf_counter() - started) * 1000))
+        return measurements, results
+
+    before, old_results = measure(0)
+    db.executescript(_STORAGE_V2_SQL)
+    after, new_results = measure(1)
+    db.close()
+    measurements = [
+        (name, unit, old, new) for (name, unit, old), (_, _, new) in zip(before, after)
+    ]
+    return measurements, (old_results, new_results)
@@ -0,0 +1,172 @@
+"""
+Typo-tolerant word lookups, with SymSpell's symmetric delete algorithm.
+
+Every word in an index is stored under each string made by deleting up to
+`max_distance` characters from its start. Deleting the same number of
+characters from a misspelled query lands on one of those strings, so the words
+within a few typos of it are found with a handful of dictionary lookups instead
+of comparing it to every word.
+
+Every suffix of every word is also kept in a sorted list, so the words containing
+some text are the ones with a suffix starting with it, found by bisecting.
+"""
+
+import bisect
+import itertools
+import threading
+
+# Edits allowed between a query and the words it finds
+MAX_DISTANCE = 2
+# Characters of each word whose deletes are stored, bounding the index's size
+PREFIX_LENGTH = 7
+# Most suffixes added since the list was last sorted to insert one at a time
+_INSERT_LIMIT = 64
+
+
+def distance(a, b, limit):
+    """
+    Returns the optimal string alignment distance between `a` and `b`: the
+    insertions, deletions, substitutions and swaps of adjacent characters that
+    turn one into the other. Returns None if it is more than `limit`.
+    """
+    if abs(len(a) - len(b)) > limit:
+        return None
+
+    previous2 = None
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = a[i - 1] != b[j - 1]
+            current[j] = min(
+                previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost
+            )
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                # Swapped characters
+                current[j] = min(current[j], previous2[j - 2] + 1)
+        if min(current) > limit:
+            return None
+        previous2, previous = previous, current
+
+    return previous[-1] if previous[-1] <= limit else None
+
+
+def allowed_distance(text):
+    """Returns how many typos to allow in `text`: fewer for shorter words."""
+    return min(MAX_DISTANCE, len(text) // 3)
+
+
+def _deletes(word, max_distance):
+    """Returns every string made by deleting up to `max_distance` characters."""
+    word = word[:PREFIX_LENGTH]
+    deletes = {word}
+    for count in range(1, min(max_distance, len(word)) + 1):
+        for kept in itertools.combinations(range(len(word)), len(word) - count):
+            deletes.add("".join(word[i] for i in kept))
+    return deletes
+
+
+class FuzzyIndex:
+    """
+    Words that can be looked up despite typos, ignoring case. Each word keeps
+    the spelling it was first added with, and counts how many times it was
+    added, so it is only removed once every copy is. Safe to use from any thread.
+    """
+
+    def __init__(self, words=()):
+        self._lock = threading.Lock()
+        self._words = {}  # Lowercased word -> [spelling, count]
+        self._deletes = {}  # Delete -> set of lowercased words
+        self._suffixes = []  # Sorted (suffix, lowercased word)
+        self._unsorted = []  # Suffixes of words added since, sorted when needed
+        for word in words:
+            self.add(word)
+
+    def __contains__(self, word):
+        return word.lower() in self._words
+
+    def __len__(self):
+        return len(self._words)
+
+    def _sort_suffixes(self):
+        """Moves the suffixes of newly added words into the sorted list."""
+        if len(self._unsorted) > _INSERT_LIMIT:
+            self._suffixes += self._unsorted
+            self._suffixes.sort()
+        else:
+            for suffix in self._unsorted:
+                bisect.insort(self._suffixes, suffix)
+        self._unsorted.clear()
+
+    def contains_part(self, text):
+        """Whether any word contains `text`, ignoring case."""
+        text = text.lower()
+        with self._lock:
+            if text in self._words:
+                return True
+            self._sort_suffixes()
+            index = bisect.bisect_left(self._suffixes, (text,))
+            following = self._suffixes[index : index + 1]
+            return bool(following) and following[0][0].startswith(text)
+
+    def add(self, word):
+        """Adds a word, or another copy of it."""
+        key = word.lower()
+        with self._lock:
+            entry = self._words.get(key)
+            if entry is not None:
+                entry[1] += 1
+                return
+
+            self._words[key] = [word, 1]
+            for delete in _deletes(key, MAX_DISTANCE):
+                self._deletes.setdefault(delete, set()).add(key)
+            self._unsorted += [(key[i:], key) for i in range(len(key))]
+
+    def remove(self, word):
+        """Removes a copy of a word, if it was added."""
+        key = word.lower()
+        with self._lock:
+            entry = self._words.get(key)
+            if entry is None:
+                return
+
+            entry[1] -= 1
+            if entry[1] > 0:
+                return
+
+            del self._words[key]
+            self._sort_suffixes()
+            for i in range(len(key)):
+                index = bisect.bisect_left(self._suffixes, (key[i:], key))
+                del self._suffixes[index]
+            for delete in _deletes(key, MAX_DISTANCE):
+                keys = self._deletes.get(delete)
+                if keys is not None:
+                    keys.discard(key)
+                    if not keys:
+                        del self._deletes[delete]
+
+    def lookup(self, text, limit=10, max_distance=None):
+        """
+        Returns up to `limit` words within `max_distance` typos of `text`, the
+        closest first, then the most often added. By default, more typos are
+        allowed in longer text.
+        """
+        key = text.lower()
+        if max_distance is None:
+            max_distance = allowed_distance(key)
+
+        with self._lock:
+            candidates = set()
+            for delete in _deletes(key, max_distance):
+                candidates.update(self._deletes.get(delete, ()))
+
+            found = []
+            for candidate in candidates:
+                edits = distance(key, candidate, max_distance)
+                if edits is not None:
+                    spelling, count = self._words[candidate]
+                    found.append((edits, -count, spelling))
+
+        return [spelling for _, _, spelling in sorted(found)[:limit]]
@@ -0,0 +1,128 @@
+"""
+Parses the search bar's query language.
+
+A query is a list of terms, separated by spaces, that must all match:
+
+- `word` or `"quoted phrase"`: Appears in a snippet's name or description.
+- `+tag`: The snippet has the tag, or a tag containing it if there's no such tag.
+- `-tag`: The snippet doesn't have the tag.
+- `@user`: The snippet's author is the user, or one whose name contains it. A
+  snippet only needs to match one of the users in a query.
+- `code:text` or `code:"quoted text"`: The snippet's code contains the text,
+  matching case.
+- `sym:name`: The snippet's code uses the identifier, outside of comments and
+  strings. Snippets using it most, and with the most likes, come first.
+- `/regex/` or `/regex/i`: The snippet's code matches the regular expression,
+  optionally ignoring case. Use `\\s` for spaces. An invalid regular expression,
+  or one with backreferences or lookarounds, is searched for as text.
+- `a OR b`: The snippet only needs to match one of the terms. `-tag` terms can't
+  be alternatives.
+
+Prefixes also apply to quoted phrases, like `+"machine learning"`. Partly typed
+queries are accepted: an unclosed quote runs to the end, and a lone prefix or
+dangling `OR` is ignored.
+"""
+
+import code_search
+import re
+
+_TOKEN = re.compile(r'(code:|sym:|[+\-@]?)(?:"([^"]*)"?|(\S+))')
+_KINDS = {
+    "": "term",
+    "+": "tag",
+    "-": "exclude",
+    "@": "user",
+    "code:": "code",
+    "sym:": "symbol",
+}
+_REGEX = re.compile(r"/(.+)/(i?)")
+
+
+def parse(text):
+    """
+    Parses a search query into clauses that must all match, each a tuple of
+    `(kind, value)` alternatives where kind is "term", "tag", "exclude", "user",
+    "code", "symbol" or "regex". Tag, exclude, user and symbol values are
+    lowercased.
+    """
+    clauses = []
+    users = []
+    joining = False  # Whether the last token was OR
+
+    for match in _TOKEN.finditer(text):
+        prefix, phrase, word = match.groups()
+        if phrase is None and prefix == "" and word == "OR":
+            joining = bool(clauses) and clauses[-1][0][0] != "exclude"
+            continue
+
+        value = phrase if phrase is not None else word
+        if not value.strip() or (phrase is None and value in _KINDS):
+            joining = False
+            continue
+
+        kind = _KINDS[prefix]
+        regex = _REGEX.fullmatch(value) if phrase is None and prefix == "" else None
+        if regex:
+            kind, value = _parse_regex(*regex.groups())
+        elif kind not in ("term", "code"):
+            value = value.lower()
+
+        if joining and kind != "exclude":
+            clauses[-1].append((kind, value))
+        else:
+            clauses.append([(kind, value)])
+        joining = False
+
+    # Users are always alternatives to each other
+    for clause in clauses:
+        if all(kind == "user" for kind, _ in clause):
+            users.extend(clause)
+    clauses = [clause for clause in clauses if any(k != "user" for k, _ in clause)]
+    if users:
+        clauses.append(users)
+
+    return [tuple(clause) for clause in clauses]
+
+
+def _parse_regex(pattern, flags):
+    """Returns the atom for a `/regex/` term, or a code one if it is invalid."""
+    if flags:
+        pattern = "(?i)" + pattern
+    if not code_search.supported(pattern):
+        return "code", pattern.removeprefix("(?i)")
+    return "regex", pattern
+
+
+def correct(text, fix):
+    """
+    Returns a search query with the value of each term replaced by
+    `fix(kind, value)`, or None if that doesn't change any of them. `fix` can
+    return None to keep a value.
+    """
+    corrected = []
+    end = 0
+    for match in _TOKEN.finditer(text):
+        prefix, phrase, word = match.groups()
+        value = phrase if phrase is not None else word
+        if phrase is None and (
+            (prefix == "" and word == "OR")
+            or value in _KINDS
+            or (prefix == "" and _REGEX.fullmatch(value))
+        ):
+            continue
+
+        fixed = fix(_KINDS[prefix], value)
+        if fixed is None or fixed == value:
+            continue
+        start = match.start(2 if phrase is not None else 3)
+        corrected += [text[end:start], fixed]
+        end = start + len(value)
+
+    if not corrected:
+        return None
+    return "".join(corrected) + text[end:]
+
+
+def is_advanced(clauses):
+    """Whether parsed clauses filter by anything other than text."""
+    return any(kind != "term" for clause in clauses for kind, _ in clause)
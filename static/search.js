@@ -21,10 +21,60 @@ const similarCount = $("#results-similar-count");
 const sharedDiv = $("#results-shared-div");
 const sharedResults = $("#results-shared");
 const sharedCount = $("#results-shared-count");
+const recommendedDiv = $("#results-recommended-div");
+const recommendedResults = $("#results-recommended");
+const recommendedCount = $("#results-recommended-count");
+const didYouMean = $("#did-you-mean");
+const didYouMeanLink = $("#did-you-mean-link");
+const sortField = $("#search-sort-field");
+const sortSelect = $("#search-sort");
+const moreSnippets = $("#more-snippets");
+
+// Each section's elements and how to render one of its results
+const sections = {
+  tags: { div: tagDiv, results: tagResults, count: tagCount, create: createTag },
+  users: {
+    div: userDiv,
+    results: userResults,
+    count: userCount,
+    create: createUserCard,
+  },
+  snippets: {
+    div: snippetDiv,
+    results: snippetResults,
+    count: snippetCount,
+    create: createSnippet,
+  },
+  similar: {
+    div: similarDiv,
+    results: similarResults,
+    count: similarCount,
+    create: createSnippet,
+  },
+  shared: {
+    div: sharedDiv,
+    results: sharedResults,
+    count: sharedCount,
+    create: createSnippet,
+  },
+  recommended: {
+    div: recommendedDiv,
+    results: recommendedResults,
+    count: recommendedCount,
+    create: createSnippet,
+  },
+};
 
 let popValues;
 
 let pendingSearchUrl = null;
+let pendingSearch = null;
+
+// Cursor for the page of snippets after the ones shown, if there is one
+let nextSnippets = null;
+
+// Identifies this page's searches, so the server can drop the ones it replaces
+const searchSession = Math.random().toString(36).slice(2);
 let searchTimeout = null;
 
 toggleResults("results-tags", true);
@@ -32,12 +82,17 @@ toggleResults("results-users", true);
 toggleResults("results-snippets", true);
 toggleResults("results-similar", false);
 toggleResults("results-shared", true);
+toggleResults("results-recommended", true);
 
 tagDiv.hide()
 userDiv.hide()
 snippetDiv.hide()
 similarDiv.hide()
 sharedDiv.hide()
+recommendedDiv.hide()
+didYouMean.hide()
+sortField.hide()
+moreSnippets.hide()
 
 $(function () {
   // Start search after the user stops typing
@@ -47,6 +102,9 @@ $(function () {
     }
     searchTimeout = setTimeout(doSearch, searchDelayMs);
   });
+
+  sortSelect.on("change", () => doSearch());
+  moreSnippets.on("click", () => doSearch(nextSnippets));
 });
 
 $(async function () {
@@ -83,33 +141,51 @@ $(".results-section > .level").on("click", function (event) {
 
 /**
  * Start a search immediately, updating search results when complete.
+ * @param {?string} after cursor to load the next page of snippets after, adding
+ * them to the ones shown instead of starting a new search
  */
-async function doSearch() {
+async function doSearch(after) {
   const query = searchInput.val();
   searchTimeout = null;
 
   // Don't search if input is empty
   if (!query.trim()) {
+    if (pendingSearch !== null) pendingSearch.abort();
+    pendingSearchUrl = pendingSearch = null;
+    searchInput.parent().removeClass("is-loading");
     populateResults(popValues);
     history.pushState(null, "", "/");
     popText();
     return;
   }
 
-  toggleResults("results-tags", false);
-  toggleResults("results-users", false);
-  toggleResults("results-snippets", true);
-  toggleResults("results-similar", true);
-  toggleResults("results-shared", false);
+  if (!after) {
+    toggleResults("results-tags", false);
+    toggleResults("results-users", false);
+    toggleResults("results-snippets", true);
+    toggleResults("results-similar", true);
+    toggleResults("results-shared", false);
+    toggleResults("results-recommended", false);
+  }
 
   searchInput.parent().addClass("is-loading");
+  moreSnippets.hide();
 
-  // Send the query to the server via AJAX (using fetch)
+  // Send the query to the server, streaming each section as it's ready
   const searchUrl = new URL(script_root + "/search", location.href);
   searchUrl.searchParams.append("q", query);
   searchUrl.searchParams.append("public", 1);
+  searchUrl.searchParams.append("format", 2);
+  searchUrl.searchParams.append("stream", 1);
+  searchUrl.searchParams.append("sort", sortSelect.val());
+  if (after) searchUrl.searchParams.append("after", after);
   pendingSearchUrl = searchUrl;
 
+  // Stop reading results for the previous query
+  if (pendingSearch !== null) pendingSearch.abort();
+  const search = new AbortController();
+  pendingSearch = search;
+
   //update url to match current search
   const newUrl = new URL(script_root + "/", location.href);
   newUrl.searchParams.append("q", query);
@@ -117,24 +193,89 @@ async function doSearch() {
   history.pushState(null, "", newUrl);
 
   try {
-    const json = await fetch(searchUrl).then((response) => response.json());
+    const response = await fetch(searchUrl, {
+      signal: search.signal,
+      headers: { "X-Search-Session": searchSession },
+    });
     allResults.show();
 
-    // Ignore results if another search is pending
-    if (searchUrl !== pendingSearchUrl) return;
+    await readRecords(response, (record) => {
+      // Ignore results if another search is pending
+      if (searchUrl !== pendingSearchUrl || !record.section) return;
+      if (record.section === "did_you_mean") {
+        showSuggestion(record.did_you_mean);
+        return;
+      }
+      if (record.section === "next") {
+        showMoreSnippets(record.next);
+        return;
+      }
 
-    populateResults(json);
+      const section = expandListings(record)[record.section];
+      if (after && record.section === "snippets") appendSnippets(section);
+      else populateSection(record.section, section);
+      sortField.show();
+      attachTagListeners();
+    });
   } catch (error) {
+    if (error.name === "AbortError") return;
     console.error("Error fetching search results:", error);
     snippetResults.text("Error occurred while searching.");
   }
 
   if (searchUrl === pendingSearchUrl) {
     pendingSearchUrl = null;
+    pendingSearch = null;
     searchInput.parent().removeClass("is-loading");
   }
 }
 
+/**
+ * Reads a newline-delimited JSON response, calling `onRecord` with each record
+ * as soon as it arrives.
+ * @param {Response} response
+ * @param {function(*): void} onRecord
+ */
+async function readRecords(response, onRecord) {
+  const reader = response.body.pipeThrough(new TextDecoderStream()).getReader();
+  let buffer = "";
+
+  while (true) {
+    const { value, done } = await reader.read();
+    if (done) break;
+
+    buffer += value;
+    const lines = buffer.split("\n");
+    buffer = lines.pop();
+    for (const line of lines) if (line.trim()) onRecord(JSON.parse(line));
+  }
+  if (buffer.trim()) onRecord(JSON.parse(buffer));
+}
+
+/**
+ * Turns a compact (version 2) response back into lists of snippets with authors.
+ * @param {*} json compact search results
+ * @returns {*} search results with each snippet in full, except for its code
+ */
+function expandListings(json) {
+  if (json.version !== 2) return json;
+
+  const expanded = {};
+  for (const [name, listing] of Object.entries(json)) {
+    if (["version", "authors", "snippets_by_id"].includes(name)) continue;
+    if (!Array.isArray(listing) || name === "tags" || name === "users") {
+      expanded[name] = listing;
+      continue;
+    }
+
+    expanded[name] = listing.map((id) => {
+      const snippet = json.snippets_by_id[id];
+      return { ...snippet, author: json.authors[snippet.user_id] };
+    });
+  }
+  return expanded;
+}
+
 /**
  * Creates a tag button from the given text.
  */
@@ -189,7 +330,13 @@ function createSnippet(snippet) {
   // Update attributes
   card.removeAttr("id");
   card.attr("data-snippet-id", snippet.id);
-  card.attr("data-code", snippet.code);
+  if (snippet.code_truncated) {
+    // Only a preview was sent; the full code is fetched when needed
+    card.attr("data-code", snippet.code_preview);
+    card.attr("data-code-truncated", "true");
+  } else {
+    card.attr("data-code", snippet.code ?? snippet.code_preview);
+  }
   card.find(".snippet-card-name").text(snippet.name);
 
   if (snippet.author && snippet.author.name) {
@@ -344,45 +491,71 @@ function toggleSearch() {
  * @param {*} json Takes in search results
  */
 function populateResults(json) {
-  $(".results-container").empty();
-
-  // Tag text matches
-  tagCount.text(json.tags.length);
-  for (const tag of json.tags) createTag(tag).appendTo(tagResults);
-  if (!json.tags.length) tagDiv.hide();
-  else tagDiv.show();
-
-  // Username matches
-  userCount.text(json.users.length);
-  for (const user of json.users) createUserCard(user).appendTo(userResults);
-  if (!json.users.length) userDiv.hide();
-  else userDiv.show();
-
-  // Name match snippet cards
-  snippetCount.text(json.snippets.length);
-  for (const snippet of json.snippets)
-    createSnippet(snippet).appendTo(snippetResults);
-  if (!json.snippets.length) snippetDiv.hide();
-  else snippetDiv.show();
-
-  // Similar description snippet cards
-  if (json.similar && json.similar.length) {
-    similarDiv.show();
-    similarCount.text(json.similar.length);
-    for (const snippet of json.similar)
-      createSnippet(snippet).appendTo(similarResults);
-  } else similarDiv.hide();
-  
-  if (json.shared && json.shared.length) {
-    sharedDiv.show();
-    sharedCount.text(json.shared.length);
-    for (const snippet of json.shared)
-      createSnippet(snippet).appendTo(sharedResults);
-  } else sharedDiv.hide();
-  
+  for (const name of Object.keys(sections)) populateSection(name, json[name]);
+  showSuggestion(json.did_you_mean);
+  showMoreSnippets(json.next);
+  sortField.hide();
   attachTagListeners();
 }
 
+/**
+ * Offers the next page of snippets, or hides the offer if there isn't one.
+ * @param {?string} cursor cursor for the next page, if any
+ */
+function showMoreSnippets(cursor) {
+  nextSnippets = cursor || null;
+  if (nextSnippets) moreSnippets.show();
+  else moreSnippets.hide();
+}
+
+/**
+ * Adds the next page of snippets after the ones shown.
+ * @param {*[]} snippets
+ */
+function appendSnippets(snippets) {
+  for (const snippet of snippets || [])
+    createSnippet(snippet).appendTo(snippetResults);
+  snippetCount.text(snippetResults.children().length);
+}
+
+/**
+ * Offers a search for the query with its typos corrected, or hides the offer.
+ * @param {?string} query corrected query, if any
+ */
+function showSuggestion(query) {
+  if (!query) {
+    didYouMean.hide();
+    return;
+  }
+
+  const url = new URL(script_root + "/", location.href);
+  url.searchParams.append("q", query);
+  didYouMeanLink.text(query);
+  didYouMeanLink.attr("href", url.href);
+  didYouMeanLink.off("click").on("click", function (event) {
+    event.preventDefault();
+    searchInput.val(query);
+    doSearch();
+  });
+  didYouMean.show();
+}
+
+/**
+ * Replaces one category of search results, hiding it if there are none.
+ * @param {string} name section name, like "snippets"
+ * @param {*[]} items results in that section
+ */
+function populateSection(name, items) {
+  const section = sections[name];
+  items = items || [];
+
+  section.results.empty();
+  section.count.text(items.length);
+  for (const item of items) section.create(item).appendTo(section.results);
+  if (!items.length) section.div.hide();
+  else section.div.show();
+}
+
 /**
  * Change Default Category Display
  */
@@ -12,6 +12,24 @@ function toggleSnippet(card) {
   }
 }
 
+/**
+ * Gets a snippet card's full code, loading it if the card only has a preview.
+ * @param {JQuery} card
+ * @returns {Promise<string>}
+ */
+async function getSnippetCode(card) {
+  if (card.attr("data-code-truncated")) {
+    const id = card.attr("data-snippet-id");
+    const response = await fetch(script_root + `/snippet/${id}/code`);
+    if (!response.ok) throw new Error("Failed to load code: " + response.status);
+
+    const json = await response.json();
+    card.attr("data-code", json.code);
+    card.removeAttr("data-code-truncated");
+  }
+  return card.attr("data-code");
+}
+
 /**
  * Show the contents of a snippet card.
  * @param {JQuery} card
@@ -32,6 +50,19 @@ function openSnippet(card) {
   code.text(card.attr("data-code"));
   hljs.highlightElement(code[0]);
 
+  // Swap the preview for the full code once it loads
+  if (card.attr("data-code-truncated")) {
+    getSnippetCode(card)
+      .then((fullCode) => {
+        code.text(fullCode);
+        code.removeAttr("data-highlighted");
+        hljs.highlightElement(code[0]);
+      })
+      .catch((err) => {
+        console.error("Failed to load snippet code: ", err);
+      });
+  }
+
   // Description
   const desc = $(document.createElement("p")).appendTo(codeDiv);
   desc.addClass("mt-4 mb-4");
@@ -62,8 +93,8 @@ function closeSnippet() {
  * @param {JQuery} card
  */
 function copySnippet(card) {
-  navigator.clipboard
-    .writeText(card.attr("data-code"))
+  getSnippetCode(card)
+    .then((code) => navigator.clipboard.writeText(code))
     .then(() => {
       alert("Code snippet copied to clipboard!");
     })
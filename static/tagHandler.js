@@ -3,12 +3,16 @@ $(function () {
   const tagInput = $("#tag-input");
   const hiddenInput = $("#hidden-tags");
   const tagsContainer = $("#tags-container");
-  const presetTags = $(".preset-tag");
+  const suggestions = $("#tag-suggestions");
   const dropdown = $("#tag-dropdown");
   const dropdownButton = $("#dropdown-button");
   const tagCounter = $("#tag-count");
   const charCounter = $("#tag-char-count");
+  const suggestionDelayMs = 150;
   let tags = [];
+  let suggested = []; // Names of the tags last suggested
+  let suggestionTimeout = null;
+  let suggestionRequest = null;
 
   /**
    * Update the tag count display
@@ -36,26 +40,53 @@ $(function () {
   }
 
   /**
-   * Hide tags that are already on post or do not match current input.
+   * Fetch the most used tags matching the current input, after a short delay.
    */
-  function updatePresetTags() {
-    const search = tagInput.val().toUpperCase();
-    let anyVisible = false;
-    for (const presetTag of presetTags) {
-      const tagText = presetTag.innerText;
-
-      if (
-        tags.includes(tagText) ||
-        (search && !tagText.toUpperCase().includes(search))
-      ) {
-        $(presetTag).hide();
-      } else {
-        $(presetTag).show();
-        anyVisible = true;
-      }
+  function updateSuggestions() {
+    if (suggestionTimeout !== null) clearTimeout(suggestionTimeout);
+    suggestionTimeout = setTimeout(fetchSuggestions, suggestionDelayMs);
+  }
+
+  /**
+   * Replace the dropdown's suggestions with the tags matching the current input.
+   */
+  async function fetchSuggestions() {
+    suggestionTimeout = null;
+    if (suggestionRequest !== null) suggestionRequest.abort();
+    const request = new AbortController();
+    suggestionRequest = request;
+
+    const url = new URL(script_root + "/tags", location.href);
+    url.searchParams.append("q", tagInput.val().trim());
+    let found;
+    try {
+      found = await fetch(url, { signal: request.signal }).then((response) =>
+        response.json()
+      );
+    } catch (error) {
+      if (error.name !== "AbortError") console.error("Error fetching tags:", error);
+      return;
+    }
+    suggestionRequest = null;
+
+    suggested = found.map((tag) => tag.name);
+    suggestions.empty();
+    for (const tag of found) {
+      if (tags.includes(tag.name)) continue;
+      $(document.createElement("a"))
+        .addClass("cell dropdown-item preset-tag has-text-inherit")
+        .attr("title", `Used by ${tag.uses} snippets`)
+        .text(tag.name)
+        .on("click", function () {
+          if (tags.length < MAX_TAGS) {
+            addTag(tag.name);
+            dropdown.removeClass("is-active");
+          }
+        })
+        .appendTo(suggestions);
     }
 
-    if (!anyVisible) dropdown.removeClass("is-active");
+    if (!suggestions.children().length) dropdown.removeClass("is-active");
   }
 
   /**
@@ -64,7 +95,7 @@ $(function () {
   function tagsChanged() {
     hiddenInput.val(tags.join(","));
     updateTagCount();
-    updatePresetTags();
+    updateSuggestions();
   }
 
   /**
@@ -82,9 +113,9 @@ $(function () {
     }
 
     // Apply canonical capitalization
-    for (const presetTag of presetTags) {
-      if (presetTag.innerText.toUpperCase() === tagText.toUpperCase()) {
-        tagText = presetTag.innerText;
+    for (const name of suggested) {
+      if (name.toUpperCase() === tagText.toUpperCase()) {
+        tagText = name;
         break;
       }
     }
@@ -103,7 +134,6 @@ $(function () {
         .on("click", function () {
           tag.remove();
           tags = tags.filter((t) => t !== tagText);
-          $(`#preset-${tagText}`).show();
           tagsChanged();
         });
 
@@ -140,18 +170,9 @@ $(function () {
       resetTagCharCounter();
     }
 
-    updatePresetTags();
+    updateSuggestions();
   });
 
-  for (const tag of presetTags) {
-    $(tag).on("click", function () {
-      if (tags.length < MAX_TAGS) {
-        addTag($(tag).text());
-        dropdown.removeClass("is-active");
-      }
-    });
-  }
-
   dropdownButton.on("click", function (event) {
     event.preventDefault();
     event.stopPropagation();
@@ -160,6 +181,7 @@ $(function () {
 
   updateTagCount();
   resetTagCharCounter();
+  updateSuggestions();
 
   tagInput.closest("form").on("keydown", function (event) {
     if (event.key === "Enter" && tagInput.is(":focus")) {
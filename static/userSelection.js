@@ -11,9 +11,11 @@ $(function () {
   const selectedUsersContainer = document.getElementById("selected-users");
   const form = document.querySelector("form");
 
-  // Load user data from Flask JSON
-  const users = JSON.parse(document.getElementById("user-data").textContent);
+  const searchDelayMs = 150;
+  const pageSize = 10;
   let selectedUsers = new Set(); // Store selected users
+  let searchTimeout = null;
+  let pendingSearch = null;
 
   if (document.getElementById("edit")) {
     const existingUsers = JSON.parse(
@@ -88,26 +90,63 @@ $(function () {
   }
 
   /**
-   * Renders the user list based on search input
+   * Fetches a page of users whose names start with `prefix`.
+   * @param {string} prefix
+   * @param {?string} after cursor of the page before, if any
+   * @param {AbortSignal} signal
+   * @returns {Promise<{users: {id: number, name: string}[], next: ?string}>}
    */
-  function renderUserList(filter = "") {
+  async function fetchUsers(prefix, after, signal) {
+    const url = new URL(script_root + "/users", location.href);
+    url.searchParams.append("q", prefix);
+    url.searchParams.append("limit", pageSize);
+    if (after) url.searchParams.append("after", after);
+    const response = await fetch(url, { signal });
+    return response.json();
+  }
+
+  /**
+   * Renders the users whose names start with the search input, a page at a time
+   */
+  async function renderUserList(filter = "") {
     userSelection.innerHTML = ""; // Clear previous results
     updateCharacterCount('userSearch', 'userSearch-char-count');
-    
+    if (pendingSearch !== null) pendingSearch.abort();
+    pendingSearch = null;
+
     if (filter.length === 0) {
       userSelection.style.display = "none"; // Hide list if search is empty
       return;
     }
 
     userSelection.style.display = "block"; // Show list when searching
+    await renderUserPage(filter, null);
+  }
+
+  /**
+   * Appends a page of matching users to the list, with a button for the next.
+   * @param {string} filter
+   * @param {?string} after cursor of the page before, if any
+   */
+  async function renderUserPage(filter, after) {
+    const search = new AbortController();
+    pendingSearch = search;
+    let page;
+    try {
+      page = await fetchUsers(filter, after, search.signal);
+    } catch (error) {
+      if (error.name !== "AbortError") console.error("Error fetching users:", error);
+      return;
+    }
+    if (pendingSearch !== search) return;
+    pendingSearch = null;
 
-    const filteredUsers = users.filter(
+    const filteredUsers = page.users.filter(
       (user) =>
-        user.name.toLowerCase().includes(filter.toLowerCase()) &&
         !Array.from(selectedUsers).some((selected) => selected.id === user.id)
     );
 
-    if (filteredUsers.length === 0) {
+    if (filteredUsers.length === 0 && !after && !page.next) {
       userSelection.innerHTML =
         "<p class='has-text-centered has-text-grey'>No users found</p>";
       return;
@@ -133,6 +172,18 @@ $(function () {
 
       userSelection.appendChild(label);
     });
+
+    if (page.next) {
+      const more = document.createElement("button");
+      more.type = "button";
+      more.classList.add("button", "is-small", "is-fullwidth", "is-light");
+      more.textContent = "More users";
+      more.addEventListener("click", function () {
+        more.remove();
+        renderUserPage(filter, page.next);
+      });
+      userSelection.appendChild(more);
+    }
   }
 
   userSearch.addEventListener("keydown", function (event) {
@@ -141,9 +192,13 @@ $(function () {
     }
   });
 
-  // Listen to search input
+  // Search after the user stops typing
   userSearch.addEventListener("input", function () {
-    renderUserList(userSearch.value.trim());
+    if (searchTimeout !== null) clearTimeout(searchTimeout);
+    searchTimeout = setTimeout(function () {
+      searchTimeout = null;
+      renderUserList(userSearch.value.trim());
+    }, searchDelayMs);
   });
 
   // Ensure users are correctly sent before form submission
@@ -0,0 +1,91 @@
+"""
+Autocompletes tag names, ranked by how many snippets use them.
+"""
+
+import bisect
+import heapq
+import threading
+
+
+class TagDictionary:
+    """
+    Preset tags and the tags snippets use, with how many snippets use each.
+
+    Tags are found by any part of their name, ignoring case. Every suffix of
+    every lowercased name is kept in one sorted list, so the names containing
+    some text are the ones with a suffix starting with it, found by bisecting.
+    Names keep the spelling of the preset tag, or of their first use. Safe to
+    use from any thread.
+    """
+
+    def __init__(self, preset=()):
+        self._lock = threading.Lock()
+        self._tags = {}  # Lowercased name -> [spelling, uses, preset]
+        self._suffixes = []  # Sorted (suffix, lowercased name)
+        for tag in preset:
+            key = tag.lower()
+            if key not in self._tags:
+                self._tags[key] = [tag, 0, True]
+                self._suffixes += [(key[i:], key) for i in range(len(key))]
+        self._suffixes.sort()
+
+    def __len__(self):
+        return len(self._tags)
+
+    def uses(self, tag):
+        """Returns how many snippets use a tag."""
+        entry = self._tags.get(tag.lower())
+        return 0 if entry is None else entry[1]
+
+    def add(self, tag, uses=1):
+        """Counts more uses of a tag, adding it if it's new."""
+        key = tag.lower()
+        with self._lock:
+            entry = self._tags.get(key)
+            if entry is None:
+                entry = self._tags[key] = [tag, 0, False]
+                for i in range(len(key)):
+                    bisect.insort(self._suffixes, (key[i:], key))
+            entry[1] += uses
+
+    def remove(self, tag, uses=1):
+        """Counts fewer uses of a tag, dropping it once unused unless it's preset."""
+        key = tag.lower()
+        with self._lock:
+            entry = self._tags.get(key)
+            if entry is None:
+                return
+            entry[1] = max(0, entry[1] - uses)
+            if entry[1] or entry[2]:
+                return
+
+            del self._tags[key]
+            for i in range(len(key)):
+                index = bisect.bisect_left(self._suffixes, (key[i:], key))
+                del self._suffixes[index]
+
+    def complete(self, text, limit=10):
+        """
+        Returns up to `limit` tags containing `text` as `(name, uses)`: those
+        starting with it first, then the most used. Empty text finds every tag.
+        """
+        text = text.lower()
+        with self._lock:
+            # Whether each matching tag starts with the text
+            matches = {}
+            if not text:
+                matches = dict.fromkeys(self._tags, True)
+            index = bisect.bisect_left(self._suffixes, (text,))
+            while text and index < len(self._suffixes):
+                suffix, key = self._suffixes[index]
+                if not suffix.startswith(text):
+                    break
+                matches[key] = matches.get(key, False) or len(suffix) == len(key)
+                index += 1
+
+            top = heapq.nsmallest(
+                limit,
+                matches.items(),
+                key=lambda item: (not item[1], -self._tags[item[0]][1], item[0]),
+            )
+            return [(self._tags[key][0], self._tags[key][1]) for key, _ in top]
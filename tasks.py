@@ -0,0 +1,65 @@
+"""
+Cancellation of work that nobody is waiting for anymore.
+"""
+
+import contextlib
+import sqlite3
+import threading
+
+# WSGI environ key under which a server can provide a request's cancel token
+ENVIRON_KEY = "snippet_oracle.cancel_token"
+
+
+class Cancelled(Exception):
+    """Raised by work that stopped because its cancel token was cancelled."""
+
+
+class CancelToken:
+    """
+    Lets one thread cancel work that other threads are doing on its behalf.
+
+    Work checks the token between steps with `raise_if_cancelled`, and wraps
+    database queries in `watching` so that cancelling interrupts them mid-query.
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._watched = set()
+
+    @property
+    def cancelled(self):
+        """Whether the token has been cancelled."""
+        return self._event.is_set()
+
+    def cancel(self):
+        """Cancels the token, interrupting any queries being watched."""
+        with self._lock:
+            self._event.set()
+            for db in self._watched:
+                db.interrupt()
+
+    def raise_if_cancelled(self):
+        """Raises `Cancelled` if the token has been cancelled."""
+        if self.cancelled:
+            raise Cancelled()
+
+    @contextlib.contextmanager
+    def watching(self, db):
+        """
+        Interrupts queries that a `Data` connection runs inside the `with` block
+        if the token is cancelled, raising `Cancelled` in place of SQLite's error.
+        """
+        with self._lock:
+            self.raise_if_cancelled()
+            self._watched.add(db)
+
+        try:
+            yield db
+        except sqlite3.OperationalError:
+            if self.cancelled:
+                raise Cancelled() from None
+            raise
+        finally:
+            with self._lock:
+                self._watched.discard(db)
@@ -1,5 +1,14 @@
+import access
+import assets
+import code_search
 import data
+import fuzzy
+import json
 import pytest
+import re2
+import search_query
+import tasks
+import threading
 
 # Fixtures
 
@@ -95,3 +104,647 @@ def test_remove_like(db, user, snippet):
         db.remove_like(snippet["id"], user["id"])
         assert not db.is_liked(snippet["id"], user["id"])
         assert db.get_likes(snippet["id"]) == initial_likes
+
+
+def set_embedding(db, snippet_id, direction):
+    """Gives a snippet a unit embedding along the given axis."""
+    embedding = [0.0] * 384
+    embedding[direction] = 1.0
+    db._db.execute(
+        "INSERT INTO SnippetEmbedding (SnippetID, Embedding) VALUES (?, ?)",
+        [snippet_id, json.dumps(embedding)],
+    )
+    db._db.commit()
+
+
+def test_recommendations_follow_likes(db, author, user):
+    liked = db.create_snippet("Liked", "Code", author["id"], is_public=True)
+    near = db.create_snippet("Near", "Code", author["id"], is_public=True)
+    own = db.create_snippet("Own", "Code", user["id"], is_public=True)
+    set_embedding(db, liked, 0)
+    set_embedding(db, near, 0)
+    set_embedding(db, own, 0)
+
+    db.add_like(liked, user["id"])
+    db.refresh_recommendations()
+    feed = [snippet["id"] for snippet in db.get_recommended_snippets(user["id"])]
+
+    assert near in feed
+    assert liked not in feed
+    assert own not in feed
+
+    db.add_like(near, user["id"])
+    feed = [snippet["id"] for snippet in db.get_recommended_snippets(user["id"])]
+    assert near not in feed
+
+    db.delete_snippet(liked, author["id"])
+    db.delete_snippet(near, author["id"])
+    db.delete_snippet(own, user["id"])
+
+
+def test_popular_cache_invalidated_by_likes(db, user, snippet):
+    popular = db.get_popular()
+    assert db.get_popular() is popular
+
+    for change in [db.add_like, db.remove_like]:
+        change(snippet["id"], user["id"])
+        assert db.get_popular() is not popular
+        popular = db.get_popular()
+        for listed in popular["snippets"]:
+            assert listed["likes"] == db.get_likes(listed["id"])
+        assert db.get_popular() is popular
+
+
+def test_identity_map_reuses_lookups(db, author, snippet):
+    details = db.get_user_details(author["id"])
+    assert db.get_user_details(str(author["id"])) is details
+
+    db.invalidate_user(author["id"])
+    assert db.get_user_details(author["id"]) is not details
+
+    assert db.get_snippet(snippet["id"]) is db.get_snippet(snippet["id"])
+
+
+def test_session_user_evicted_on_profile_change(db, author):
+    key = str(author["id"])
+    data.session_users.set(key, object())
+    db.invalidate_user(author["id"])
+    assert data.session_users.get(key) is None
+    assert db.get_user_name(author["id"]) == author["name"]
+
+
+def test_snippet_version_changes_with_likes(db, user, snippet):
+    version, _ = db.get_snippet_version(snippet["id"])
+    snippets_version, _ = db.get_version("snippets")
+
+    db.add_like(snippet["id"], user["id"])
+    assert db.get_snippet_version(snippet["id"])[0] != version
+    assert db.get_version("snippets")[0] > snippets_version
+
+
+def test_user_snippets_version_never_repeats(db, author):
+    seen = [db.get_user_snippets_version(author["id"])[0]]
+    first = db.create_snippet("First", "Code", author["id"])
+    seen.append(db.get_user_snippets_version(author["id"])[0])
+
+    # Swapping one untouched snippet for another still changes the version
+    db.delete_snippet(first, author["id"])
+    seen.append(db.get_user_snippets_version(author["id"])[0])
+    second = db.create_snippet("Second", "Code", author["id"])
+    seen.append(db.get_user_snippets_version(author["id"])[0])
+    assert len(set(seen)) == len(seen)
+
+    db.delete_snippet(second, author["id"])
+
+
+def test_minify_js_keeps_literals():
+    source = """
+    /*! License */
+    // Comment
+    const url = "http://example.com"; /* inline */
+    const pattern = /\\/\\*not a comment/g;
+    const text = `a ${ { b: "//" }.b } c`;
+    """
+    minified = assets.minify_js(source)
+
+    assert "/*! License */" in minified
+    assert "Comment" not in minified and "inline" not in minified
+    assert '"http://example.com"' in minified
+    assert "/\\/\\*not a comment/g" in minified
+    assert '`a ${ { b: "//" }.b } c`' in minified
+
+
+def test_compact_listings_dedupes_snippets(db, author, snippet):
+    long_code = "\n".join(f"line {i}" for i in range(data.CODE_PREVIEW_LINES * 2))
+    long_id = db.create_snippet("Long", long_code, author["id"], is_public=True)
+    full = [db.get_snippet(snippet["id"]), db.get_snippet(long_id)]
+
+    compact = data.compact_listings({"snippets": full, "similar": full[:1], "tags": []})
+
+    assert compact["snippets"] == [snippet["id"], long_id]
+    assert compact["similar"] == [snippet["id"]]
+    assert compact["tags"] == []
+    assert compact["authors"] == {author["id"]: full[0]["author"]}
+
+    short, long = compact["snippets_by_id"][snippet["id"]], compact["snippets_by_id"][long_id]
+    assert "code" not in short and "author" not in short
+    assert short["code_preview"] == "Snippet Code" and not short["code_truncated"]
+    assert long["code_truncated"]
+    assert long["code_preview"].count("\n") == data.CODE_PREVIEW_LINES - 1
+    assert db.get_snippet_code(long_id) == long_code
+
+    db.delete_snippet(long_id, author["id"])
+
+
+def test_listings_send_stored_code_previews(db, author):
+    long_code = "x" * (data.CODE_PREVIEW_CHARS * 2)
+    id = db.create_snippet("Qzxv preview", "short", author["id"], is_public=True)
+
+    def listed():
+        (snippet,) = db.search_snippets(terms=["qzxv preview"])
+        return snippet
+
+    assert "code" not in listed()
+    assert listed()["code_preview"] == "short" and not listed()["code_truncated"]
+
+    db.update_snippet(id, author["id"], "Qzxv preview", long_code, is_public=True)
+    assert listed()["code_preview"] == long_code[: data.CODE_PREVIEW_CHARS]
+    assert listed()["code_truncated"]
+    assert db.get_snippet_code(id) == long_code
+
+    compact = data.compact_listings({"snippets": [listed()]})
+    assert compact["snippets_by_id"][id]["code_truncated"]
+
+    db.delete_snippet(id, author["id"])
+
+
+def test_pooled_connections_are_reused_and_forgetful(author):
+    with data.pooled() as db:
+        db.get_user_details(author["id"])
+        assert db._user_details
+    with data.pooled() as reused:
+        assert reused is db
+        assert not reused._user_details
+
+
+def test_cancel_token_interrupts_queries(db):
+    token = tasks.CancelToken()
+    timer = threading.Timer(0.1, token.cancel)
+    timer.start()
+
+    with pytest.raises(tasks.Cancelled):
+        with token.watching(db):
+            db._db.execute(
+                """
+                WITH RECURSIVE Counter(X) AS (
+                    SELECT 1 UNION ALL SELECT X + 1 FROM Counter WHERE X < 1000000000
+                )
+                SELECT COUNT(*) FROM Counter
+                """
+            ).fetchone()
+
+    with pytest.raises(tasks.Cancelled):
+        with token.watching(db):
+            pass
+
+
+def test_search_session_narrows_previous_matches(db, author):
+    first = db.create_snippet("Qzxv one", "Code", author["id"], is_public=True)
+    second = db.create_snippet("Qzxv two", "Code", author["id"], is_public=True)
+
+    def search(*terms):
+        results = db.search_snippets(terms=list(terms), session="test")
+        return {snippet["id"] for snippet in results}
+
+    assert search("qzx") == {first, second}
+
+    # Narrower searches only look at the remembered matches
+    state = data.search_states.get("test")
+    data.search_states.set("test", {**state, "ids": json.dumps([second])})
+    assert search("QZXV") == {second}
+    assert search("qzxv", "one") == set()
+
+    # Widening the search, or changing any snippet, starts over
+    assert search("qz") == {first, second}
+    data.search_states.set("test", {**state, "ids": json.dumps([second])})
+    db.update_snippet(first, author["id"], "Qzxv uno", "Code", is_public=True)
+    assert search("qzxv") == {first, second}
+
+    db.delete_snippet(first, author["id"])
+    db.delete_snippet(second, author["id"])
+
+
+def test_parse_search_query():
+    assert search_query.parse('sort "linked list" +Python OR +rust -old @a @b') == [
+        (("term", "sort"),),
+        (("term", "linked list"),),
+        (("tag", "python"), ("tag", "rust")),
+        (("exclude", "old"),),
+        (("user", "a"), ("user", "b")),
+    ]
+    # Partly typed queries
+    assert search_query.parse('OR + "open phrase') == [(("term", "open phrase"),)]
+    assert search_query.parse("a OR") == [(("term", "a"),)]
+
+
+def test_search_phrases_and_alternatives(db, author):
+    first = db.create_snippet("Qzxv alpha", "Code", author["id"], is_public=True)
+    second = db.create_snippet("Qzxv beta", "Code", author["id"], is_public=True)
+
+    def search(query):
+        results = db.search_snippets(clauses=search_query.parse(query))
+        return {snippet["id"] for snippet in results}
+
+    assert search("qzxv alpha OR beta") == {first, second}
+    assert search('"qzxv alpha"') == {first}
+    assert search('"alpha qzxv"') == set()
+    assert search(f'qzxv @{author["name"][:3]}') == {first, second}
+
+    hits = data._search_plan.cache_info().hits
+    assert search("qzxv beta OR alpha") == {first, second}
+    assert data._search_plan.cache_info().hits > hits
+
+    db.delete_snippet(first, author["id"])
+    db.delete_snippet(second, author["id"])
+
+
+def test_code_search_uses_trigram_index(db, author):
+    code = "fetch(url).then(r => r.json())"
+    first = db.create_snippet("Fetch", code, author["id"], is_public=True)
+    code = "def tree_query(node):"
+    second = db.create_snippet("Def", code, author["id"], is_public=True)
+
+    def search(query):
+        results = db.search_snippets(clauses=search_query.parse(query))
+        return {snippet["id"] for snippet in results}
+
+    assert code_search.regex_query(r"def (tree|node)_query\(") == (
+        '"def " AND (("tree") OR ("node")) AND "_query("'
+    )
+    assert code_search.regex_query(r"\w+") is None
+
+    assert search("code:.then(r") == {first}
+    assert search("code:.THEN(r") == set()
+    assert search(r"/def\s\w+_query/") == {second}
+    assert search(r"/DEF\sTREE/i OR code:json") == {first, second}
+    assert search("code:(r") == {first}  # Too short for the index
+
+    db.update_snippet(second, author["id"], "Def", "def node_query():", is_public=True)
+    assert search("code:tree_query") == set()
+
+    db.delete_snippet(first, author["id"])
+    db.delete_snippet(second, author["id"])
+
+
+def test_regex_search_runs_with_re2(db, author):
+    code = "a" * 20
+    snippet = db.create_snippet("Aaa", code, author["id"], is_public=True)
+
+    def search(query):
+        results = db.search_snippets(clauses=search_query.parse(query))
+        return {snippet["id"] for snippet in results}
+
+    # Python's re backtracks exponentially through these as the code grows
+    for pattern in ["(a|aa)+$", ".*.*x", "(a+)+b"]:
+        assert isinstance(code_search._compile(pattern), re2._Regexp)
+    assert snippet in search("/(a|aa)+$/")
+    assert snippet not in search("/.*.*x/ OR /(a+)+b/")
+
+    # Backreferences need backtracking, so they're searched for as text
+    assert search_query.parse(r"/(a)\1/") == [(("code", r"(a)\1"),)]
+
+    db.delete_snippet(snippet, author["id"])
+
+
+def test_symbol_search_skips_comments_and_ranks_by_use(db, author):
+    once = "Map<String, Integer> m = new HashMap<>(); // TreeMap"
+    twice = "var a = new HashMap<>();\nvar b = new HashMap<>();"
+    comment = "/* HashMap */ var list = new ArrayList<>();"
+    ids = [
+        db.create_snippet(name, code, author["id"], tags=["Java"], is_public=True)
+        for name, code in [("Once", once), ("Twice", twice), ("Comment", comment)]
+    ]
+
+    def search(query):
+        results = db.search_snippets(clauses=search_query.parse(query))
+        return [snippet["id"] for snippet in results]
+
+    assert search("sym:HashMap") == [ids[1], ids[0]]
+    assert search("sym:treemap") == []
+    assert search("sym:arraylist") == [ids[2]]
+
+    db.update_snippet(ids[2], author["id"], "Comment", "HashMap m;", is_public=True)
+    assert set(search("sym:hashmap")) == set(ids)
+
+    for id in ids:
+        db.delete_snippet(id, author["id"])
+
+
+def test_fuzzy_index_corrects_typos():
+    index = fuzzy.FuzzyIndex(["Python", "JavaScript", "Java"])
+    assert index.lookup("pyhton") == ["Python"]
+    assert index.lookup("javscript")[0] == "JavaScript"
+    assert index.lookup("jaav", max_distance=0) == []
+
+    index.add("python")
+    index.remove("Python")
+    assert index.lookup("pyhton") == ["Python"]
+    index.remove("Python")
+    assert index.lookup("pyhton") == []
+
+    # Words are found by any part of them, as they're added and removed
+    assert index.contains_part("SCRIP") and not index.contains_part("thon")
+    index.add("Typhoon")
+    assert index.contains_part("phoo")
+    index.remove("Typhoon")
+    assert not index.contains_part("phoo") and index.contains_part("ava")
+
+
+def test_did_you_mean_follows_changes(db, author):
+    assert db.search_tags("pyhton") == ["Python"]
+    assert db.search_users(author["name"][:1] + author["name"][2:]) == [
+        {"name": author["name"], "profile_picture": None}
+    ]
+    assert db.did_you_mean("+pyhton sort") == "+Python sort"
+    assert db.did_you_mean("qzxvwky") is None
+
+    id = db.create_snippet("Qzxvwyk widget", "Code", author["id"], is_public=True)
+    db.create_user("Qzxvyw", "N/A")
+    assert db.did_you_mean("qzxvwky @qzxvwy") == "qzxvwyk @Qzxvyw"
+
+    db.delete_snippet(id, author["id"])
+    db.delete_user(db.get_user_by_name("Qzxvyw")["id"])
+    assert db.did_you_mean("qzxvwky @qzxvwy") is None
+
+
+def test_tag_dictionary_counts_public_uses(db, author):
+    assert db.search_tags("ytho")[0] == "Python"
+
+    def uses(name):
+        found = {tag["name"]: tag["uses"] for tag in db.complete_tag(name)}
+        return found.get(name)
+
+    before = uses("Python")
+    id = db.create_snippet(
+        "Tagged", "Code", author["id"], tags=["python", "Qzxv-tag"], is_public=True
+    )
+    assert uses("Python") == before + 1
+    assert db.complete_tag("zxv-t") == [{"name": "Qzxv-tag", "uses": 1}]
+
+    db.set_snippet_visibility(id, False)
+    assert uses("Python") == before
+    assert db.complete_tag("zxv-t") == []
+
+    db.set_snippet_visibility(id, True)
+    db.delete_snippet(id, author["id"])
+    assert db.complete_tag("zxv-t") == []
+
+
+def test_find_users_by_prefix_pages(db, author):
+    names = ["Qzxv-b", "qzxv-a", "QZXV-c", "Qzx"]
+    for name in names:
+        db.create_user(name, "N/A")
+    me = db.get_user_by_name("qzxv-a")["id"]
+
+    first = db.find_users_by_prefix("qZXv", me, 1)
+    assert [user["name"] for user in first["users"]] == ["Qzxv-b"]
+    second = db.find_users_by_prefix("qZXv", me, 1, first["next"])
+    assert [user["name"] for user in second["users"]] == ["QZXV-c"]
+    assert second["next"] is None
+
+    for name in names:
+        db.delete_user(db.get_user_by_name(name)["id"])
+
+
+def test_user_snippets_page_in_each_order(db, author, user):
+    ids = [
+        db.create_snippet(name, "Code", author["id"], is_public=True)
+        for name in ["A", "B", "C"]
+    ]
+    ids += [
+        db.create_snippet("Remix", "Code", author["id"], parent_snippet_id=parent)
+        for parent in [ids[0], ids[0], ids[1]]
+    ]
+    db.add_like(ids[1], user["id"])  # Authors like their own snippets already
+    db.remove_like(ids[2], author["id"])
+
+    def pages(sort, public_only=False):
+        found, after = [], None
+        while True:
+            page = db.get_user_snippets(
+                author["id"], public_only=public_only, sort=sort, after=after, limit=2
+            )
+            found += [snippet["id"] for snippet in page["snippets"]]
+            after = page["next"]
+            if after is None:
+                return found
+
+    newest = sorted(ids, reverse=True)
+    assert pages("newest") == newest
+    assert pages("newest", public_only=True) == newest[3:]
+    assert pages("liked") == [ids[1], ids[5], ids[4], ids[3], ids[0], ids[2]]
+    assert pages("remixed") == [ids[0], ids[1], ids[5], ids[4], ids[3], ids[2]]
+
+    # Counts follow likes and remixes being removed
+    db.remove_like(ids[1], user["id"])
+    db.delete_snippet(ids[3], author["id"])
+    assert pages("liked") == [ids[5], ids[4], ids[1], ids[0], ids[2]]
+    assert pages("remixed")[:2] == [ids[1], ids[0]]
+
+    with pytest.raises(ValueError):
+        db.get_user_snippets(author["id"], sort="liked", after="not a cursor")
+
+    for id in ids[:3] + ids[4:]:
+        db.delete_snippet(id, author["id"])
+
+
+def test_search_cursors_need_a_key_per_sort_column(db, author):
+    snippets = [
+        db.create_snippet("Cursor", "int used = 1;", author["id"], is_public=True)
+        for _ in range(2)
+    ]
+    page = db.search_snippets_page(clauses=search_query.parse("sym:used"), limit=1)
+
+    assert data.is_cursor_for(page["next"], "relevance", symbols=True)
+    assert not data.is_cursor_for(page["next"], "relevance")
+    for keys in [["relevance", 1], ["newest", 1], ["relevance", 1, 2, 3, 4, 5]]:
+        assert not data.is_cursor_for(data._encode_cursor(keys[0], keys[1:]), keys[0])
+
+    for id in snippets:
+        db.delete_snippet(id, author["id"])
+
+
+def test_comments_nest_to_any_depth_and_page(db, author, snippet, user):
+    def comment(text, parent=None):
+        db.add_comment(snippet["id"], user["id"], text, parent)
+        return db._db.execute("SELECT MAX(ID) FROM Comments").fetchone()[0]
+
+    first = comment("First")
+    reply = comment("Reply", first)
+    deep = comment("Deep", reply)
+    second = comment("Second")
+    late = comment("Late reply", first)
+
+    page = db.get_comments(snippet["id"], limit=1)
+    (thread,) = page["comments"]
+    assert thread["id"] == first and thread["reply_count"] == 3
+    assert [r["id"] for r in thread["replies"]] == [reply, late]
+    assert thread["replies"][0]["replies"][0]["id"] == deep
+    assert thread["replies"][0]["replies"][0]["depth"] == 2
+
+    page = db.get_comments(snippet["id"], limit=1, after=page["next"])
+    assert [c["id"] for c in page["comments"]] == [second]
+    assert page["next"] is None
+
+    db.delete_comment(reply)
+    (thread, _) = db.get_comments(snippet["id"])["comments"]
+    assert [r["id"] for r in thread["replies"]] == [late]
+    assert db.get_comment_by_id(deep) is None
+
+
+def test_remix_lineage_follows_creates_and_deletes(db, author):
+    def remix(name, parent=None):
+        return db.create_snippet(
+            name, "Code", author["id"], is_public=True, parent_snippet_id=parent
+        )
+
+    original = remix("Original")
+    middle = remix("Middle", original)
+    leaf = remix("Leaf", middle)
+    sibling = remix("Sibling", original)
+
+    assert [s["id"] for s in db.get_remix_ancestry(leaf)] == [original, middle]
+    tree = db.get_remix_tree(original)
+    assert [s["id"] for s in tree] == [middle, sibling]
+    assert [s["id"] for s in tree[0]["remixes"]] == [leaf]
+    assert db.get_fork_counts([original, leaf]) == {
+        original: {"forks": 2, "descendants": 3},
+        leaf: {"forks": 0, "descendants": 0},
+    }
+
+    # Pages showing a tree or breadcrumb change with the snippets in them
+    def version(id):
+        return db.get_snippet_version(id)[0]
+
+    before = version(original), version(leaf)
+    hidden = db.create_snippet(
+        "Hidden", "Code", author["id"], is_public=False, parent_snippet_id=leaf
+    )
+    assert version(original) != before[0]
+    db.update_snippet(original, author["id"], "Renamed", "Code", is_public=True)
+    assert version(leaf) != before[1]
+    assert db.get_fork_counts([original])[original]["descendants"] == 3
+    assert db.get_fork_counts([original], author["id"])[original]["descendants"] == 4
+    db.delete_snippet(hidden, author["id"])
+
+    # Remixes of a deleted snippet become originals
+    db.delete_snippet(middle, author["id"])
+    assert db.get_remix_ancestry(leaf) == []
+    assert [s["id"] for s in db.get_remix_tree(original)] == [sibling]
+    assert db.get_fork_counts([original])[original]["descendants"] == 1
+
+    for id in [original, leaf, sibling]:
+        db.delete_snippet(id, author["id"])
+
+
+def test_tag_stats_follow_tags_visibility_and_deletes(db, author, user):
+    def counts(tags):
+        return {tag["Name"]: tag["Count"] for tag in tags}
+
+    shared = db.create_snippet(
+        "Shared", "Code", author["id"], tags=["StatsTag", "OtherTag"], is_public=True
+    )
+    hidden = db.create_snippet("Hidden", "Code", author["id"], tags=["StatsTag"])
+    assert counts(db.get_profile_public_tags(author["id"])) == {
+        "StatsTag": 1,
+        "OtherTag": 1,
+    }
+    assert counts(db.get_profile_all_tags(author["id"])) == {
+        "StatsTag": 2,
+        "OtherTag": 1,
+    }
+
+    # Private snippets' tags aren't popular
+    db.update_snippet(shared, author["id"], "Shared", "Code", tags=["StatsTag"])
+    assert "StatsTag" not in db.get_popular_public_tags()
+    assert counts(db.get_profile_all_tags(author["id"])) == {"StatsTag": 2}
+
+    db.update_snippet(
+        hidden, author["id"], "Hidden", "Code", tags=["StatsTag"], is_public=True
+    )
+    assert counts(db.get_profile_public_tags(author["id"])) == {"StatsTag": 1}
+
+    db.delete_snippet(hidden, author["id"])
+    db.delete_snippet(shared, author["id"])
+    assert db.get_profile_all_tags(author["id"]) == []
+    assert db.get_profile_all_tags(user["id"]) == []
+
+
+def test_trending_scores_follow_likes_and_decay(db, author, user):
+    old = db.create_snippet("Old", "Code", author["id"], is_public=True)
+    new = db.create_snippet("New", "Code", author["id"], is_public=True)
+    for id in [old, new]:
+        db.add_like(id, user["id"])
+
+    def scores():
+        return dict(
+            db._db.execute(
+                "SELECT ID, HotScore FROM Snippet WHERE ID IN (?, ?)", [old, new]
+            ).fetchall()
+        )
+
+    assert scores()[old] > 0 and scores()[old] == pytest.approx(scores()[new])
+    assert author["name"] in [u["name"] for u in db.get_popular_users()]
+
+    # Only likes from others count, and scores aren't shown on profiles
+    profiles = db.get_version("profiles")[0]
+    db.remove_like(old, author["id"])
+    assert scores()[old] == pytest.approx(scores()[new])
+    db.add_like(old, author["id"])
+    assert db.get_version("profiles")[0] == profiles
+
+    # Snippets nobody has liked lately sink once scores are refreshed
+    db._db.execute(
+        "UPDATE Snippet SET Date = Date - 2 * 24 * 60 * 60 WHERE ID = ?", [old]
+    )
+    trending, version = db.get_version("trending")[0], db.get_snippet_version(old)[0]
+    db.refresh_trending()
+    assert 0 < scores()[old] < scores()[new]
+    assert db.get_version("trending")[0] > trending
+    assert db.get_snippet_version(old)[0] == version
+    trending = [s["id"] for s in db.get_popular_public_snippets()]
+    assert new in trending and trending.index(new) < trending.index(old)
+
+    db.remove_like(new, user["id"])
+    assert scores()[new] == 0
+    (total,) = db._db.execute(
+        "SELECT HotScore FROM User WHERE ID = ?", [author["id"]]
+    ).fetchone()
+    assert total == pytest.approx(scores()[old])
+
+    for id in [old, new]:
+        db.delete_snippet(id, author["id"])
+
+
+def test_storage_migration_keeps_results_and_shrinks():
+    measurements, results = data.benchmark_storage(200, repeat=1)
+    before, after = results
+    assert len(before) == len(data._STORAGE_QUERIES) and before == after
+
+    before, after = {row[0]: row[2:] for row in measurements}["database size"]
+    assert after < before
+
+
+def test_access_bitmaps_follow_permissions_and_visibility(db, author, user):
+    dense = access.Bitmap(range(0, 2 * access.ARRAY_MAX + 2, 2))
+    sparse = access.Bitmap([4, 5, 70000])
+    assert isinstance(dense._chunks[0], int) and len(dense) == access.ARRAY_MAX + 1
+    assert list(dense & sparse) == [4]
+    assert list(sparse | dense)[-2:] == [2 * access.ARRAY_MAX, 70000]
+    dense.discard(0)
+    assert 0 not in dense and 2 in dense and not isinstance(dense._chunks[0], int)
+
+    secret = db.create_snippet("Xqvz secret", "Code", author["id"], is_public=False)
+    assert db.get_snippet(secret, author["id"]) is not None
+    assert db.get_snippet(secret, user["id"]) is None
+
+    def found():
+        results = db.search_snippets(["xqvz"], viewer_id=user["id"], session="test")
+        return [snippet["id"] for snippet in results]
+
+    # Changes made through another connection are caught up with too
+    other = data.Data()
+    other.grant_snippet_permission(secret, user["id"])
+    db.clear_identity_maps()
+    assert db.user_has_permission(secret, user["id"]) and found() == [secret]
+
+    db.revoke_snippet_permission(secret, user["id"])
+    assert not db.user_has_permission(secret, user["id"]) and found() == []
+
+    other.set_snippet_visibility(secret, True)
+    other.close()
+    db.clear_identity_maps()
+    assert db.get_snippet_code(secret, user["id"]) == "Code" and found() == [secret]
+
+    db.delete_snippet(secret, author["id"])
+    assert not db.user_has_permission(secret, None)